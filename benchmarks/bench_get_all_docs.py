@@ -0,0 +1,116 @@
+"""Memory and throughput benchmark for the `get_all_docs` decoding path.
+
+Compares the previous list-of-dicts + `pd.DataFrame` path against the columnar
+decoder in `utils_columnar` over a synthetic `#SEP#` framed document stream.
+
+Usage:
+    python benchmarks/bench_get_all_docs.py --num-docs 50000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+dirname = os.path.dirname(__file__)
+sys.path.append(os.path.join(dirname, "../"))
+
+from utils_columnar import decode_doc_stream
+
+TOPICS = [f"{i}_topic_{i}" for i in range(50)]
+SOURCES = ["Reuters", "CNN", "BBC News", "The Verge", "Bloomberg", "TechCrunch"]
+
+
+def make_stream(num_docs, body_words=120, seed=0):
+    """Build the raw chunks the all-docs-generator endpoint would stream"""
+    rng = random.Random(seed)
+    words = "bitcoin market price crypto investors bank rates health vaccine game".split()
+    chunks = []
+    for i in range(num_docs):
+        title = " ".join(rng.choices(words, k=8))
+        body = " ".join(rng.choices(words, k=body_words))
+        doc = {
+            "answer": f"{title}#SEPTAG#{body}",
+            "document_id": f"doc-{i}",
+            "meta": {
+                "source": rng.choice(SOURCES),
+                "publishedat": f"2021-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T12:00:00Z",
+                "topic_label": rng.choice(TOPICS),
+                "url": f"https://example.com/articles/{i}",
+                "urltoimage": f"https://example.com/images/{i}.jpg",
+                "umap_embeddings": [rng.uniform(-10, 10), rng.uniform(-10, 10)],
+            },
+        }
+        chunks.append(json.dumps(doc).encode("utf-8"))
+    return chunks
+
+
+def dict_path(lines):
+    """The original get_all_docs decoding path"""
+    final_docs = []
+    for line in lines:
+        if line:
+            doc = json.loads(line.decode("utf-8"))
+            answer = doc["answer"]
+            if answer:
+                meta_umapembeddings = doc["meta"].get("umap_embeddings", None)
+                final_docs.append(
+                    {
+                        "answer": answer,
+                        "source": doc["meta"].get("source", None),
+                        "publishedat": doc["meta"].get("publishedat", None),
+                        "topic": doc["meta"].get("topic_label", None),
+                        "url": doc["meta"].get("url", None),
+                        "image_url": doc["meta"].get("urltoimage", None),
+                        "umap_embeddings_x": None
+                        if meta_umapembeddings is None
+                        else meta_umapembeddings[0],
+                        "umap_embeddings_y": None
+                        if meta_umapembeddings is None
+                        else meta_umapembeddings[1],
+                        "document_id": doc["document_id"],
+                    }
+                )
+    return pd.DataFrame(final_docs)
+
+
+def columnar_path(lines):
+    return decode_doc_stream(iter(lines))
+
+
+def measure(fn, lines):
+    # Time without tracemalloc, which slows allocations down considerably
+    start = time.perf_counter()
+    df = fn(lines)
+    elapsed = time.perf_counter() - start
+    del df
+    tracemalloc.start()
+    df = fn(lines)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return df, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--num-docs", type=int, default=50000)
+    parser.add_argument("--body-words", type=int, default=120)
+    args = parser.parse_args()
+
+    lines = make_stream(args.num_docs, body_words=args.body_words)
+    print(f"{args.num_docs} docs, {sum(map(len, lines)) / 1e6:.1f} MB of JSON")
+    for name, fn in [("dicts", dict_path), ("columnar", columnar_path)]:
+        df, elapsed, peak = measure(fn, lines)
+        frame_mb = df.memory_usage(deep=True).sum() / 1e6
+        print(
+            f"{name:>9}: {elapsed:6.2f}s  {args.num_docs / elapsed:9.0f} docs/s  "
+            f"peak {peak / 1e6:7.1f} MB  frame {frame_mb:7.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
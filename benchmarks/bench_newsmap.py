@@ -0,0 +1,105 @@
+"""Benchmark of the Newsmap treemap pre-processing.
+
+Scales the headlines of data/top_headlines.csv up to --rows headlines and
+times Newsmap.pre_processing against the former per-category
+DataFrame.append implementation, after checking both build the same
+treemap data.
+
+Usage:
+    python benchmarks/bench_newsmap.py --rows 10000 --num-articles 10
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+dirname = os.path.dirname(__file__)
+sys.path.append(os.path.join(dirname, "../"))
+
+from utils_tree import Newsmap, custom_wrap
+
+
+def make_headlines(rows, seed=0):
+    seed_df = pd.read_csv(os.path.join(dirname, "../data/top_headlines.csv"), index_col=0)
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, len(seed_df), rows)
+    df = seed_df.iloc[idx].reset_index(drop=True)
+    # distinct titles, urls and dates so the ranking is deterministic
+    df["title"] = df["title"] + " #" + df.index.astype(str)
+    df["url"] = df["url"] + "?n=" + df.index.astype(str)
+    df["publishedAt"] = df["publishedAt"] - rng.permutation(rows)
+    return df
+
+
+def legacy_pre_processing(df, filter_list, num_articles, date_col="publishedAt", filter_col="category", value_col="treeRank"):
+    """The per-category loop of Newsmap before vectorization"""
+    n = 120
+    sizes = [n / 2] * 2 + [n / 3] * 3 + [n / 4] * 4
+    df = df.copy()
+    df[value_col] = df[date_col]
+    trim_df = pd.DataFrame(columns=df.columns)
+    for category in df[filter_col].unique():
+        temp_df = df[df[filter_col] == category].sort_values(value_col, ascending=False).head(num_articles)
+        temp_df[value_col] = [sizes[i] if i < len(sizes) else n / 5 for i in range(len(temp_df))]
+        trim_df = pd.concat([trim_df, temp_df])
+    trim_df["title"] = trim_df["title"].map(lambda s: custom_wrap(s, width=20))
+    trim_df["hover_text"] = trim_df["title"]
+    data = trim_df.loc[trim_df[filter_col].isin(filter_list), :]
+
+    levels, add_cols = ["title", "category"], ["hover_text", "url"]
+    df_all_trees = pd.DataFrame(columns=["id", "parent", "value"] + add_cols)
+    for i, level in enumerate(levels):
+        df_tree = pd.DataFrame(columns=["id", "parent", "value"] + add_cols)
+        if i == 0:
+            dfg = data.groupby(levels[i:] + add_cols)[value_col].sum().reset_index()
+            df_tree["id"] = dfg[level].copy()
+            df_tree[add_cols] = dfg[add_cols].copy()
+        else:
+            dfg = data.groupby(levels[i:])[value_col].sum().reset_index()
+            df_tree["id"] = dfg[level].copy()
+            for column in add_cols:
+                df_tree[column] = df_tree["id"]
+        df_tree["parent"] = dfg[levels[i + 1]].copy() if i < len(levels) - 1 else "total"
+        df_tree["value"] = dfg[value_col]
+        df_all_trees = pd.concat([df_all_trees, df_tree], ignore_index=True)
+    total = pd.DataFrame(dict(id=["total"], parent=[""], value=[data[value_col].sum()]))
+    return pd.concat([df_all_trees, total], ignore_index=True)
+
+
+def vectorized_pre_processing(df, filter_list, num_articles):
+    newsmap = Newsmap(df.copy(), num_articles=num_articles)
+    newsmap.pre_processing(filter_list)
+    return newsmap.df_trees
+
+
+def timeit(fn, repeat, *args):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(*args)
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--num-articles", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    df = make_headlines(args.rows)
+    filter_list = list(df["category"].unique())
+    print(f"{len(df)} headlines, {len(filter_list)} categories, {args.num_articles} per category")
+
+    legacy_time, expected = timeit(legacy_pre_processing, args.repeat, df, filter_list, args.num_articles)
+    new_time, result = timeit(vectorized_pre_processing, args.repeat, df, filter_list, args.num_articles)
+    pd.testing.assert_frame_equal(result[expected.columns], expected, check_dtype=False)
+
+    print(f"{'legacy':>10}: {legacy_time * 1000:8.2f} ms")
+    print(f"{'vectorized':>10}: {new_time * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
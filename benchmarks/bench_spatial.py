@@ -0,0 +1,90 @@
+"""Benchmark of the spatial index of the UMAP points.
+
+Builds a vis_components.spatial.GridIndex over --points clustered random
+points and compares its k-nearest, radius and box queries with a brute
+force scan of all the points, checking that both return the same points.
+
+Usage:
+    python benchmarks/bench_spatial.py --points 200000 --queries 200
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+dirname = os.path.dirname(__file__)
+sys.path.append(os.path.join(dirname, "../"))
+
+from vis_components.spatial import GridIndex
+
+
+def make_points(num_points, num_topics=50, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-10, 10, size=(num_topics, 2))
+    points = centers[rng.integers(0, num_topics, num_points)]
+    points = points + rng.normal(scale=0.8, size=(num_points, 2))
+    return points[:, 0].astype(np.float32), points[:, 1].astype(np.float32)
+
+
+def brute_force(x, y, query, args):
+    if query[0] == "box":
+        _, x_min, x_max, y_min, y_max = query
+        return np.flatnonzero((x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max))
+    d2 = (x - query[1]) ** 2 + (y - query[2]) ** 2
+    if query[0] == "knn":
+        return np.argsort(d2, kind="stable")[: args.k]
+    return np.flatnonzero(d2 <= args.radius ** 2)
+
+
+def indexed(index, query, args):
+    if query[0] == "box":
+        return index.box(*query[1:])
+    if query[0] == "knn":
+        return index.knn(query[1], query[2], args.k)
+    return index.radius(query[1], query[2], args.radius)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--points", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10, help="neighbours of the knn queries")
+    parser.add_argument("--radius", type=float, default=0.3)
+    args = parser.parse_args()
+
+    x, y = make_points(args.points)
+    start = time.perf_counter()
+    index = GridIndex(x, y)
+    print(f"{args.points} points indexed in {(time.perf_counter() - start) * 1000:.1f} ms")
+    x, y = x.astype(np.float64), y.astype(np.float64)
+
+    rng = np.random.default_rng(1)
+    centers = rng.uniform(-10, 10, size=(args.queries, 2))
+    for kind in ["knn", "radius", "box"]:
+        if kind == "box":
+            queries = [("box", cx - 1, cx + 1, cy - 1, cy + 1) for cx, cy in centers]
+        else:
+            queries = [(kind, cx, cy) for cx, cy in centers]
+        timings = {}
+        results = {}
+        for name, run in [("brute", lambda q: brute_force(x, y, q, args)),
+                          ("grid", lambda q: indexed(index, q, args))]:
+            start = time.perf_counter()
+            results[name] = [run(q) for q in queries]
+            timings[name] = (time.perf_counter() - start) / len(queries) * 1e6
+        # knn ties may be broken differently, compare the distances
+        for q, expected, got in zip(queries, results["brute"], results["grid"]):
+            if kind == "knn":
+                d2 = (x - q[1]) ** 2 + (y - q[2]) ** 2
+                assert np.allclose(np.sort(d2[expected]), np.sort(d2[got])), q
+            else:
+                assert set(expected) == set(got), q
+        found = np.mean([len(r) for r in results["grid"]])
+        print(f"{kind:>8}: brute {timings['brute']:9.1f} us, grid {timings['grid']:7.1f} us"
+              f" per query ({found:.0f} points found)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Micro-benchmark of the sub-article extraction of GoogleNews feed entries.
+
+Builds one refresh worth of entries from the titles in data/top_headlines.csv,
+each with a Google News style summary, and times the BeautifulSoup parser,
+the regex fast path and skipping the extraction (sub_articles=False).
+
+Usage:
+    python benchmarks/bench_sub_articles.py --items 5 --repeat 20
+"""
+import argparse
+import csv
+import html
+import os
+import sys
+import time
+
+dirname = os.path.dirname(__file__)
+sys.path.append(os.path.join(dirname, "../"))
+
+from googleNews import parse_sub_articles, parse_sub_articles_bs4
+
+
+def make_summaries(items):
+    with open(os.path.join(dirname, "../data/top_headlines.csv"), encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    summaries = []
+    for i, row in enumerate(rows):
+        title, _, publisher = row["title"].split(" | ")[0].rpartition(" - ")
+        lis = "".join(
+            f'<li><a href="{html.escape(row["url"])}&amp;n={j}" target="_blank">'
+            f'{html.escape(title)}</a>&nbsp;&nbsp;<font color="#6f6f6f">'
+            f"{html.escape(publisher)}</font></li>"
+            for j in range(items)
+        )
+        summaries.append(f"<ol>{lis}</ol>")
+    return summaries
+
+
+def timeit(fn, summaries, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for summary in summaries:
+            fn(summary)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=5, help="sub-articles per entry")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    summaries = make_summaries(args.items)
+    for summary in summaries:
+        assert parse_sub_articles(summary) == parse_sub_articles_bs4(summary)
+
+    print(f"{len(summaries)} entries, {args.items} sub-articles each")
+    for name, fn in [
+        ("bs4", parse_sub_articles_bs4),
+        ("regex", parse_sub_articles),
+        ("skipped", lambda summary: None),
+    ]:
+        elapsed = timeit(fn, summaries, args.repeat)
+        print(f"{name:>8}: {elapsed * 1000:8.2f} ms per refresh")
+
+
+if __name__ == "__main__":
+    main()
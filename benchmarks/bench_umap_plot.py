@@ -0,0 +1,110 @@
+"""Benchmark of the UMAP figure construction.
+
+Builds the topic traces of --points random points over --topics topics
+with the former loop (a boolean mask and a DataFrame copy per topic), the
+sorted-slices builder and the single-trace builder of
+vis_components.umap.topic_traces, and reports the build time and the
+size of the figure JSON.
+
+Usage:
+    python benchmarks/bench_umap_plot.py --points 100000 --topics 200
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+dirname = os.path.dirname(__file__)
+sys.path.append(os.path.join(dirname, "../"))
+
+from vis_components.umap import topic_traces
+
+
+def make_points(num_points, num_topics, seed=0):
+    rng = np.random.default_rng(seed)
+    topics = [f"{i}_topic_{i}" for i in range(num_topics)]
+    # skewed topic sizes, like BERTopic output
+    weights = 1 / np.arange(1, num_topics + 1)
+    codes = rng.choice(num_topics, size=num_points, p=weights / weights.sum())
+    documents = pd.DataFrame(
+        {
+            "umap_embeddings_x": rng.normal(size=num_points).astype(np.float32),
+            "umap_embeddings_y": rng.normal(size=num_points).astype(np.float32),
+            "topic": np.array(topics, dtype=object)[codes],
+        }
+    )
+    custom_data = pd.DataFrame(
+        {0: [f"Title {i}" for i in range(num_points)], 1: ["Content"] * num_points}
+    )
+    colors = [f"#{(i * 2654435761) % 0xFFFFFF:06x}" for i in range(num_topics)]
+    return documents, custom_data, topics, colors
+
+
+def legacy_traces(documents, custom_data, topics, colors):
+    traces = []
+    for c, topic in zip(colors, topics):
+        ix_mask = documents["topic"] == topic
+        data = documents.loc[ix_mask]
+        customd = custom_data.loc[ix_mask]
+        traces.append(
+            go.Scattergl(
+                mode="markers",
+                x=data["umap_embeddings_x"],
+                y=data["umap_embeddings_y"],
+                text=data["topic"],
+                customdata=customd,
+                opacity=0.7,
+                marker=dict(size=4, color=c, opacity=0.7, symbol="circle"),
+                name=topic,
+                hovertemplate="<b>%{customdata[0]}</b><br><br>"
+                + "<b>Topic</b>: %{text}<br>"
+                + "<b>Content</b>: %{customdata[1]}"
+                + "<extra></extra>",
+            )
+        )
+    return traces
+
+
+def array_traces(documents, custom_data, topics, colors, single_trace=False):
+    return topic_traces(
+        x=documents["umap_embeddings_x"].to_numpy(dtype=np.float32),
+        y=documents["umap_embeddings_y"].to_numpy(dtype=np.float32),
+        codes=pd.Categorical(documents["topic"], categories=topics).codes,
+        topics=topics,
+        colors=colors,
+        customdata=custom_data.to_numpy(),
+        single_trace=single_trace,
+    )
+
+
+def measure(build, *args, **kwargs):
+    start = time.perf_counter()
+    fig = go.Figure()
+    fig.add_traces(build(*args, **kwargs))
+    elapsed = time.perf_counter() - start
+    return elapsed, len(fig.to_json())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--points", type=int, default=100000)
+    parser.add_argument("--topics", type=int, default=200)
+    args = parser.parse_args()
+
+    inputs = make_points(args.points, args.topics)
+    print(f"{args.points} points, {args.topics} topics")
+    for name, build, kwargs in [
+        ("legacy", legacy_traces, {}),
+        ("slices", array_traces, {}),
+        ("single", array_traces, {"single_trace": True}),
+    ]:
+        elapsed, size = measure(build, *inputs, **kwargs)
+        print(f"{name:>8}: {elapsed * 1000:9.1f} ms, {size / 2 ** 20:6.1f} MiB JSON")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""Local stand-in for the Haystack API used by the UI.
+
+Serves the endpoints called by utils.py (query, all-docs-generator with
+the `#SEP#` framing, umap-query, topic-names, doc-count and feedback) from
+a synthetic corpus: the articles of data/articles.preprocessed.jsonl
+repeated up to --docs documents, with random topics, dates and UMAP
+coordinates. The corpus is kept in a CorpusStore, so the `terms`/`range`
+filters of the UI are answered like the local store answers them.
+
+Latency can be injected per request to reproduce a remote API:
+
+    python benchmarks/fake_api.py --docs 1000000 --latency 50 --jitter 20
+    API_ENDPOINT=http://localhost:8000 streamlit run webapp.py
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+dirname = os.path.dirname(__file__)
+sys.path.append(os.path.join(dirname, "../"))
+
+from utils_sampling import sample_indices
+from utils_store import CorpusStore
+
+SEED_ARTICLES = os.path.join(dirname, "../data/articles.preprocessed.jsonl")
+CATEGORIES = ["sports", "health", "technology", "science", "entertainment", "business", "world"]
+SOURCES = ["reuters", "bbc-news", "cnn", "the-verge", "techcrunch", "bloomberg"]
+WORDS = "bitcoin crypto market vaccine election climate football startup bank energy".split()
+
+
+def build_corpus(num_docs, num_topics=50, seed=0):
+    """Documents of the seed articles scaled up to num_docs, as store columns"""
+    with open(SEED_ARTICLES, encoding="utf-8") as f:
+        articles = [json.loads(line) for line in f]
+    answers = np.array(
+        [
+            "{}#SEPTAG#{}".format(a["title"] or a["text"].split(" .")[0], a["text"])
+            for a in articles
+        ],
+        dtype=object,
+    )
+    rng = np.random.default_rng(seed)
+    ids = np.arange(num_docs)
+    picks = np.where(ids < len(answers), ids % len(answers), rng.integers(0, len(answers), num_docs))
+    # skewed topic sizes with one cluster of UMAP points per topic
+    weights = 1 / np.arange(1, num_topics + 1)
+    topic_codes = rng.choice(num_topics, size=num_docs, p=weights / weights.sum())
+    centers = rng.uniform(-10, 10, size=(num_topics, 2))
+    points = centers[topic_codes] + rng.normal(scale=0.8, size=(num_docs, 2))
+    topics = np.array(
+        [f"{i}_{'_'.join(random.Random(i).sample(WORDS, 3))}" for i in range(num_topics)],
+        dtype=object,
+    )
+    start = np.datetime64("2020-01-01T00:00:00")
+    published = start + rng.integers(0, 2 * 365 * 86400, num_docs).astype("timedelta64[s]")
+    docs = pd.DataFrame(
+        {
+            "answer": answers[picks],
+            "source": np.array(SOURCES, dtype=object)[rng.integers(0, len(SOURCES), num_docs)],
+            "publishedat": np.char.add(published.astype(str), "Z").astype(object),
+            "topic": topics[topic_codes],
+            "url": [f"https://example.com/articles/{i}" for i in ids],
+            "image_url": [f"https://example.com/images/{i}.jpg" for i in ids],
+            "umap_embeddings_x": points[:, 0].astype(np.float32),
+            "umap_embeddings_y": points[:, 1].astype(np.float32),
+            "document_id": [f"doc-{i}" for i in ids],
+        }
+    )
+    categories = np.array(CATEGORIES, dtype=object)[topic_codes % len(CATEGORIES)]
+    return docs, categories
+
+
+class FakeApi:
+    """Responses of the Haystack API endpoints, computed from a CorpusStore"""
+
+    def __init__(self, store, categories):
+        self.store = store
+        self.categories = categories
+        self.feedbacks = []
+
+    def __docs(self, rows, scores=None):
+        """API documents of the store rows"""
+        frame = self.store.frame(rows)
+        columns = [frame[c].tolist() for c in ("answer", "document_id", "source", "publishedat",
+                                               "topic", "url", "image_url",
+                                               "umap_embeddings_x", "umap_embeddings_y")]
+        categories = self.categories[rows].tolist()
+        docs = []
+        for answer, document_id, source, publishedat, topic, url, image_url, x, y, category in zip(
+            *columns, categories
+        ):
+            docs.append({
+                "answer": answer,
+                "document_id": document_id,
+                "meta": {
+                    "source": source,
+                    "publishedat": publishedat,
+                    "topic_label": topic,
+                    "category": category,
+                    "url": url,
+                    "urltoimage": image_url,
+                    "umap_embeddings": [x, y],
+                },
+            })
+        if scores is not None:
+            for doc, score in zip(docs, scores):
+                doc["score"] = score
+        return docs
+
+    def query(self, req):
+        """Pseudo-random but deterministic answers for a query"""
+        rows = np.flatnonzero(self.store.mask(req.get("filters")))
+        rng = np.random.default_rng(zlib.crc32(req["query"].encode("utf-8")))
+        top_k = min(req.get("top_k_reader") or 10, req.get("top_k_retriever") or 100, len(rows))
+        rows = np.sort(rng.choice(rows, size=top_k, replace=False)) if top_k else rows[:0]
+        scores = np.sort(rng.uniform(-2, 10, size=len(rows)))[::-1].round(3)
+        return {"query": req["query"], "answers": self.__docs(rows, scores.tolist())}
+
+    def all_docs_generator(self, req):
+        """`#SEP#` separated documents, decoded from the store batch by batch"""
+        rows = np.flatnonzero(self.store.mask(req.get("filters")))
+        sample = req.get("sample")
+        if sample:
+            codes = self.store.gather("topic", rows)
+            rows = rows[sample_indices(codes, sample["size"], sample["method"], sample.get("seed"))]
+        # the filters are checked before the response starts, the batches are lazy
+        return self.__stream(rows, req.get("batch_size") or 10000)
+
+    def __stream(self, rows, batch_size):
+        for start in range(0, len(rows), batch_size):
+            docs = self.__docs(rows[start : start + batch_size])
+            yield "".join(json.dumps(doc) + "#SEP#" for doc in docs).encode("utf-8")
+
+    def umap_query(self, req):
+        rng = np.random.default_rng(zlib.crc32(req["query"].encode("utf-8")))
+        return {"query_text": req["query"], "query_umap": rng.uniform(-10, 10, 2).tolist()}
+
+    def topic_names(self, req):
+        return {"topic_names": self.store.meta["categories"]["topic"]}
+
+    def doc_count(self, req):
+        return {"num_documents": self.store.count(req.get("filters"))}
+
+    def feedback(self, req):
+        self.feedbacks.append(req)
+        return req
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.route()
+
+    def do_POST(self):
+        self.route()
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def route(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        endpoint = self.path.strip("/").split("?")[0].replace("-", "_")
+        method = getattr(self.server.api, endpoint, None)
+        if method is None or endpoint.startswith("_"):
+            return self.respond(404, {"detail": "Not Found"})
+        self.server.sleep()
+        try:
+            result = method(json.loads(body) if body else {})
+            if endpoint == "all_docs_generator":
+                return self.stream(result)
+        except (KeyError, ValueError) as e:
+            return self.respond(422, {"detail": str(e)})
+        self.respond(200, result)
+
+    def respond(self, status, result):
+        data = json.dumps(result).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream(self, chunks):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FakeApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, api, latency=0.0, jitter=0.0, verbose=False):
+        """latency, jitter: seconds added to every request, uniform in latency +- jitter"""
+        super().__init__(address, FakeApiHandler)
+        self.api = api
+        self.latency = latency
+        self.jitter = jitter
+        self.verbose = verbose
+
+    def sleep(self):
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve from a daemon thread"""
+        threading.Thread(target=self.serve_forever, name="fake-api", daemon=True).start()
+        return self
+
+
+def make_server(
+    num_docs=100000, num_topics=50, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, path=None, verbose=False
+):
+    """Fake API server over a corpus of num_docs documents (port 0 picks a free port)"""
+    path = path or os.path.join(tempfile.mkdtemp(prefix="fake-api-"), "corpus")
+    docs, categories = build_corpus(num_docs, num_topics)
+    store = CorpusStore(path, refresh_interval=float("inf"))
+    store.write(docs)
+    store.load()
+    return FakeApiServer((host, port), FakeApi(store, categories), latency, jitter, verbose)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=100000, help="number of documents")
+    parser.add_argument("--topics", type=int, default=50)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="ms added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="ms of uniform jitter")
+    parser.add_argument("--store", help="directory of the generated corpus (default: a temp dir)")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    server = make_server(
+        args.docs, args.topics, args.host, args.port,
+        args.latency / 1000, args.jitter / 1000, args.store, args.verbose,
+    )
+    print(f"{args.docs} documents generated in {time.perf_counter() - start:.1f} s")
+    print(f"Serving on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
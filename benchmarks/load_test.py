@@ -0,0 +1,115 @@
+"""End-to-end load test of the page render against the fake API.
+
+Every simulated session renders the Free Query flow of webapp.py the way
+the page does, through utils_pipeline.page_pipeline with a memo kept per
+session like the session state: the document count and the sampled UMAP
+documents, the umap-query and query calls, then the timeline, treemap,
+UMAP figure and timeline figure stages. --sessions sessions run
+concurrently, each rendering --renders pages with different queries, and
+the p50/p95/p99 latency of every stage, API call and render is reported.
+With --density the density layer of the UMAP is rendered too.
+
+The fake API is started in-process unless --endpoint is given:
+
+    python benchmarks/load_test.py --docs 200000 --sessions 8 --renders 5 --latency 50
+    python benchmarks/load_test.py --endpoint http://localhost:8000 --cold
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+dirname = os.path.dirname(__file__)
+sys.path.append(os.path.join(dirname, "../"))
+sys.path.append(dirname)
+
+QUERIES = [
+    "Bitcoin Crypto", "vaccine", "election results", "climate change", "football transfer",
+    "startup funding", "central bank rates", "energy prices", "space launch", "tech layoffs",
+]
+
+
+def render(query, memo, args):
+    """One Free Query render of webapp.py, with the page defaults"""
+    from utils import topic_names
+    from utils_metrics import metrics
+    from utils_pipeline import page_pipeline
+
+    with metrics.span("render"):
+        pipeline = page_pipeline(memo)
+        pipeline.set("unique_topics", list(topic_names()))
+        pipeline.set("filter_date", (date(2020, 1, 1), date.today()))
+        pipeline.set("filter_category", [])
+        pipeline.set("filter_category_exclude", True)
+        pipeline.set("top_k_retriever", 100)
+        pipeline.set("umap_perc", args.umap_perc)
+        pipeline.set("show_density", args.density)
+        pipeline.set("umap_selection", None)
+        pipeline.set("num_neighbours", 10)
+        pipeline.set("question", query)
+        pipeline.set("timeline_freq", "D")
+        pipeline.set("selected_date_range", 0)
+        pipeline.start("doc_count", "umap_docs", "density", "umap_query")
+        pipeline.get("query_newsmap")
+        pipeline.get("umap_overlay")
+        pipeline.get("timeline_figure")
+        pipeline.get("printed_articles")
+
+
+def session(session_id, args):
+    from utils import api_cache
+    from utils_tree import figure_cache
+
+    memo = {}
+    for i in range(args.renders):
+        if args.cold:
+            api_cache.clear()
+            figure_cache.clear()
+            memo.clear()
+        render(QUERIES[(session_id + i) % len(QUERIES)], memo, args)
+
+
+def report():
+    from utils_metrics import metrics
+
+    print(f"{'span':<26} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for span, stats in sorted(metrics.summary()["spans"].items()):
+        print(f"{span:<26} {stats['count']:>6} {stats['p50_ms']:9.1f} {stats['p95_ms']:9.1f} {stats['p99_ms']:9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--endpoint", help="API to test (default: start the fake API)")
+    parser.add_argument("--docs", type=int, default=100000, help="documents of the fake API")
+    parser.add_argument("--latency", type=float, default=0.0, help="ms added by the fake API")
+    parser.add_argument("--jitter", type=float, default=0.0, help="ms of jitter of the fake API")
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent sessions")
+    parser.add_argument("--renders", type=int, default=5, help="renders per session")
+    parser.add_argument("--umap-perc", type=int, default=1, help="UMAP percentage slider value")
+    parser.add_argument("--density", action="store_true", help="draw the density layer of the UMAP")
+    parser.add_argument("--cold", action="store_true", help="clear the caches before every render")
+    args = parser.parse_args()
+
+    if args.endpoint is None:
+        from fake_api import make_server
+
+        server = make_server(args.docs, latency=args.latency / 1000, jitter=args.jitter / 1000)
+        args.endpoint = server.start().url
+        print(f"Fake API with {args.docs} documents on {args.endpoint}")
+    # utils reads the endpoint when it is imported
+    os.environ["API_ENDPOINT"] = args.endpoint
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as executor:
+        for future in [executor.submit(session, i, args) for i in range(args.sessions)]:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.sessions} sessions x {args.renders} renders in {elapsed:.1f} s\n")
+    report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Startup profile of the modules imported by webapp.py.
+
+Imports them in a fresh interpreter with `python -X importtime`, prints
+the slowest imports (cumulative time) and the total wall time of the cold
+start. Importing them must not make any network call.
+
+The regression check is tests/test_startup.py, run with the other tests:
+it fails when the cold start takes longer than STARTUP_BUDGET seconds
+(default 5) or imports one of LAZY_MODULES. Here --budget only makes the
+script exit with status 1 over the given budget:
+
+    python benchmarks/profile_startup.py --budget 3.0
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+dirname = os.path.dirname(__file__)
+
+# What webapp.py imports before rendering the page
+MODULES = [
+    "pandas",
+    "streamlit",
+    "streamlit_plotly_events",
+    "utils",
+    "utils_pipeline",
+    "utils_tree",
+    "ui_components.umap_search",
+    "vis_components.timelines",
+]
+# Must not be imported at startup, only on the paths that use them
+LAZY_MODULES = ["sklearn", "matplotlib", "colorcet", "dateparser", "bs4", "feedparser", "newsapi"]
+
+
+def profile(modules):
+    """Wall time of importing modules in a new interpreter and the -X importtime rows"""
+    code = "; ".join(f"import {m}" for m in modules)
+    code += "; import sys; print(','.join(sorted(sys.modules)))"
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=os.path.join(dirname, ".."),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        sys.exit(proc.stderr)
+    rows = []
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    loaded = set(proc.stdout.strip().split(","))
+    return elapsed, rows, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top", type=int, default=25, help="number of imports listed")
+    parser.add_argument("--budget", type=float, help="maximum cold start time in seconds")
+    args = parser.parse_args()
+
+    elapsed, rows, loaded = profile(MODULES)
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[: args.top]:
+        print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {name}")
+
+    eager = [m for m in LAZY_MODULES if m in loaded]
+    print(f"\ncold start: {elapsed:.2f} s")
+    if eager:
+        print(f"imported at startup, should be lazy: {', '.join(eager)}")
+
+    if args.budget is not None and elapsed > args.budget:
+        print(f"over the budget of {args.budget:.2f} s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
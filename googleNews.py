@@ -1,40 +1,158 @@
-import feedparser
-from bs4 import BeautifulSoup
+import copy
+import html
+import re
+import threading
+import time
 import urllib
-from dateparser import parse as parse_date
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import requests
 
+# Shared by every GoogleNews instance so connections are reused
+SESSION = requests.Session()
+
+# Fast path for the known `<li><a href>title</a><font>publisher</font></li>` summaries
+LI_RE = re.compile(r'<li[\s>](.*?)</li>', re.S | re.I)
+A_RE = re.compile(r'<a\s[^>]*?href="([^"]*)"[^>]*>(.*?)</a>', re.S | re.I)
+FONT_RE = re.compile(r'<font[^>]*>(.*?)</font>', re.S | re.I)
+TAG_RE = re.compile(r'<[^>]+>')
+
+
+def parse_sub_articles_bs4(text):
+    """Return subarticles of an entry summary with BeautifulSoup"""
+    from bs4 import BeautifulSoup
+    try:
+        bs4_html = BeautifulSoup(text, "html.parser")
+        # find all li tags
+        lis = bs4_html.find_all('li')
+        sub_articles = []
+        for li in lis:
+            try:
+                sub_articles.append({"url": li.a['href'],
+                                     "title": li.a.text,
+                                     "publisher": li.font.text})
+            except:
+                pass
+        return sub_articles
+    except:
+        return text
+
+
+def parse_sub_articles(text):
+    """Return subarticles of an entry summary, falling back to BeautifulSoup
+    when the summary doesn't have the usual shape"""
+    lis = LI_RE.findall(text)
+    if len(lis) != text.lower().count('<li'):
+        return parse_sub_articles_bs4(text)
+    sub_articles = []
+    for li in lis:
+        a = A_RE.search(li)
+        font = FONT_RE.search(li)
+        if a and font:
+            sub_articles.append({"url": html.unescape(a.group(1)),
+                                 "title": html.unescape(TAG_RE.sub('', a.group(2))),
+                                 "publisher": html.unescape(TAG_RE.sub('', font.group(1)))})
+    return sub_articles
+
+
+class FeedCache:
+    """Last parsed feed per URL with its ETag/Last-Modified validators, and its
+    entries post-processed once per fetch under 'rows' (keyed by sub_articles)"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, url):
+        with self.lock:
+            return self.entries.get(url)
+
+    def put(self, url, feed, response=None):
+        entry = {
+            'feed': feed,
+            'etag': response.headers.get('ETag') if response is not None else None,
+            'last_modified': response.headers.get('Last-Modified') if response is not None else None,
+            'fetched_at': time.time(),
+            'rows': {},
+        }
+        with self.lock:
+            self.entries[url] = entry
+        return entry
+
+    def touch(self, url):
+        with self.lock:
+            self.entries[url]['fetched_at'] = time.time()
+
+
+FEED_CACHE = FeedCache()
+
+
+class FetchStats:
+    """Counters of the feed fetches, to check how many requests a refresh costs"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+    def add(self, name, value=1):
+        with self.lock:
+            self.counts[name] += value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+FETCH_STATS = FetchStats()
+
+
+class FetchBudgetExceeded(Exception):
+    pass
+
+
+class FetchBudget:
+    """Maximum number of HTTP requests a single feed call may issue"""
+    def __init__(self, max_requests=1, timeout=None):
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.used = 0
+
+    def get(self, session, url, **kwargs):
+        if self.used >= self.max_requests:
+            raise FetchBudgetExceeded('Request budget of {} exhausted for {}'.format(self.max_requests, url))
+        self.used += 1
+        response = session.get(url, timeout=self.timeout, **kwargs)
+        FETCH_STATS.add('requests')
+        FETCH_STATS.add('bytes', len(response.content))
+        return response
 
 
 class GoogleNews:
-    def __init__(self, lang = 'en', country = 'US'):
+    def __init__(self, lang = 'en', country = 'US', cache_ttl = 300, session = SESSION, cache = FEED_CACHE,
+                 max_requests = 1, timeout = (3.05, 10)):
+        """
+        cache_ttl: seconds a fetched feed is served without asking Google News again
+        max_requests: request budget of a single feed call
+        timeout: (connect, read) timeout of the feed requests
+        """
         self.lang = lang.lower()
         self.country = country.upper()
         self.BASE_URL = 'https://news.google.com/rss'
+        self.cache_ttl = cache_ttl
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.session = session
+        self.cache = cache
 
     def __top_news_parser(self, text):
         """Return subarticles from the main and topic feeds"""
-        try:
-            bs4_html = BeautifulSoup(text, "html.parser")
-            # find all li tags
-            lis = bs4_html.find_all('li')
-            sub_articles = []
-            for li in lis:
-                try:
-                    sub_articles.append({"url": li.a['href'],
-                                         "title": li.a.text,
-                                         "publisher": li.font.text})
-                except:
-                    pass
-            return sub_articles
-        except:
-            return text
+        return parse_sub_articles(text)
 
     def __ceid(self):
         """Compile correct country-lang parameters for Google News RSS URL"""
         return '?ceid={}:{}&hl={}&gl={}'.format(self.country,self.lang,self.lang,self.country)
 
-    def __add_sub_articles(self, entries):
+    def __add_sub_articles(self, entries, sub_articles=True):
+        if not sub_articles:
+            return entries
         for i, val in enumerate(entries):
             if 'summary' in entries[i].keys():
                 entries[i]['sub_articles'] = self.__top_news_parser(entries[i]['summary'])
@@ -42,8 +160,19 @@ class GoogleNews:
                 entries[i]['sub_articles'] = None
         return entries
 
-    def __scaping_bee_request(self, api_key, url):
-        response = requests.get(
+    def __feed(self, feed_url, proxies=None, scraping_bee=None, sub_articles=True):
+        """Feed at feed_url with its entries post-processed. The summaries are
+        parsed once per fetch and every call gets its own copy of the cache"""
+        cached = self.__parse_feed(feed_url, proxies=proxies, scraping_bee=scraping_bee)
+        rows = cached['rows'].get(sub_articles)
+        if rows is None:
+            rows = self.__add_sub_articles(copy.deepcopy(cached['feed']['entries']), sub_articles)
+            cached['rows'][sub_articles] = rows
+        return copy.deepcopy({'feed': cached['feed']['feed'], 'entries': rows})
+
+    def __scaping_bee_request(self, api_key, url, budget):
+        response = budget.get(
+            self.session,
             url="https://app.scrapingbee.com/api/v1/",
             params={
                 "api_key": api_key,
@@ -57,36 +186,59 @@ class GoogleNews:
             raise Exception("ScrapingBee status_code: "  + str(response.status_code) + " " + response.text)
 
 
+    def __conditional_headers(self, cached):
+        """Validators of the cached response, so an unchanged feed costs a 304"""
+        headers = {}
+        if cached is not None:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+        return headers
+
     def __parse_feed(self, feed_url, proxies=None, scraping_bee = None):
+        """FeedCache entry of the feed, fetched again once older than cache_ttl"""
 
         if scraping_bee and proxies:
             raise Exception("Pick either ScrapingBee or proxies. Not both!")
 
-        if proxies:
-            r = requests.get(feed_url, proxies = proxies)
-        else:
-            r = requests.get(feed_url)
+        cached = self.cache.get(feed_url)
+        if cached is not None and time.time() - cached['fetched_at'] < self.cache_ttl:
+            FETCH_STATS.add('cache_hits')
+            return cached
 
+        budget = FetchBudget(self.max_requests, self.timeout)
         if scraping_bee:
-            r = self.__scaping_bee_request(url = feed_url, api_key = scraping_bee)
+            r = self.__scaping_bee_request(url = feed_url, api_key = scraping_bee, budget = budget)
         else:
-            r = requests.get(feed_url)
-
+            r = budget.get(self.session, feed_url, proxies = proxies, headers = self.__conditional_headers(cached))
+            if r.status_code == 304 and cached is not None:
+                # Unchanged since the last fetch: no download and no parse
+                FETCH_STATS.add('not_modified')
+                self.cache.touch(feed_url)
+                return cached
 
         if 'https://news.google.com/rss/unsupported' in r.url:
             raise Exception('This feed is not available')
 
+        import feedparser  # imported on first fetch, not at app startup
         d = feedparser.parse(r.text)
+        FETCH_STATS.add('parses')
 
-        if not scraping_bee and not proxies and len(d['entries']) == 0:
-            d = feedparser.parse(feed_url)
+        if len(d['entries']) == 0:
+            # Let feedparser detect the encoding from the raw bytes we already
+            # downloaded instead of fetching the URL again
+            d = feedparser.parse(r.content, response_headers = {'content-type': r.headers.get('Content-Type', '')})
+            FETCH_STATS.add('fallback_parses')
 
-        return dict((k, d[k]) for k in ('feed', 'entries'))
+        feed = dict((k, d[k]) for k in ('feed', 'entries'))
+        return self.cache.put(feed_url, feed, r)
 
     def __search_helper(self, query):
         return urllib.parse.quote_plus(query)
 
     def __from_to_helper(self, validate=None):
+        from dateparser import parse as parse_date  # slow to import, only used by search
         try:
             validate = parse_date(validate).strftime('%Y-%m-%d')
             return str(validate)
@@ -95,38 +247,46 @@ class GoogleNews:
 
 
 
-    def top_news(self, proxies=None, scraping_bee = None):
+    def top_news(self, proxies=None, scraping_bee = None, sub_articles=True):
         """Return a list of all articles from the main page of Google News
-        given a country and a language"""
-        d = self.__parse_feed(self.BASE_URL + self.__ceid(), proxies=proxies, scraping_bee=scraping_bee)
-        d['entries'] = self.__add_sub_articles(d['entries'])
+        given a country and a language
+        :param bool sub_articles: When False the related articles listed in the
+            summary of each entry are not extracted"""
+        d = self.__feed(self.BASE_URL + self.__ceid(), proxies=proxies, scraping_bee=scraping_bee, sub_articles=sub_articles)
         return d
 
-    def topic_headlines(self, topic: str, proxies=None, scraping_bee=None):
+    def topic_headlines(self, topic: str, proxies=None, scraping_bee=None, sub_articles=True):
         """Return a list of all articles from the topic page of Google News
         given a country and a language"""
         #topic = topic.upper()
         if topic.upper() in ['WORLD', 'NATION', 'BUSINESS', 'TECHNOLOGY', 'ENTERTAINMENT', 'SCIENCE', 'SPORTS', 'HEALTH']:
-            d = self.__parse_feed(self.BASE_URL + '/headlines/section/topic/{}'.format(topic.upper()) + self.__ceid(), proxies = proxies, scraping_bee=scraping_bee)
+            d = self.__feed(self.BASE_URL + '/headlines/section/topic/{}'.format(topic.upper()) + self.__ceid(), proxies = proxies, scraping_bee=scraping_bee, sub_articles=sub_articles)
 
         else:
-            d = self.__parse_feed(self.BASE_URL + '/topics/{}'.format(topic) + self.__ceid(), proxies = proxies, scraping_bee=scraping_bee)
-
-        d['entries'] = self.__add_sub_articles(d['entries'])
+            d = self.__feed(self.BASE_URL + '/topics/{}'.format(topic) + self.__ceid(), proxies = proxies, scraping_bee=scraping_bee, sub_articles=sub_articles)
         if len(d['entries']) > 0:
             return d
         else:
             raise Exception('unsupported topic')
 
-    def geo_headlines(self, geo: str, proxies=None, scraping_bee=None):
+    def topics_headlines(self, topics, proxies=None, scraping_bee=None, sub_articles=True, max_workers=8):
+        """Return the topic_headlines of several topics, fetched concurrently,
+        as a dict keyed by topic"""
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(
+                lambda topic: self.topic_headlines(topic, proxies=proxies, scraping_bee=scraping_bee,
+                                                   sub_articles=sub_articles),
+                topics)
+            return dict(zip(topics, results))
+
+    def geo_headlines(self, geo: str, proxies=None, scraping_bee=None, sub_articles=True):
         """Return a list of all articles about a specific geolocation
         given a country and a language"""
-        d = self.__parse_feed(self.BASE_URL + '/headlines/section/geo/{}'.format(geo) + self.__ceid(), proxies = proxies, scraping_bee=scraping_bee)
-
-        d['entries'] = self.__add_sub_articles(d['entries'])
+        d = self.__feed(self.BASE_URL + '/headlines/section/geo/{}'.format(geo) + self.__ceid(), proxies = proxies, scraping_bee=scraping_bee, sub_articles=sub_articles)
         return d
 
-    def search(self, query: str, helper = True, when = None, from_ = None, to_ = None, proxies=None, scraping_bee=None):
+    def search(self, query: str, helper = True, when = None, from_ = None, to_ = None, proxies=None, scraping_bee=None,
+               sub_articles=True):
         """
         Return a list of all articles given a full-text search parameter,
         a country and a language
@@ -151,7 +311,5 @@ class GoogleNews:
         search_ceid = self.__ceid()
         search_ceid = search_ceid.replace('?', '&')
 
-        d = self.__parse_feed(self.BASE_URL + '/search?q={}'.format(query) + search_ceid, proxies = proxies, scraping_bee=scraping_bee)
-
-        d['entries'] = self.__add_sub_articles(d['entries'])
+        d = self.__feed(self.BASE_URL + '/search?q={}'.format(query) + search_ceid, proxies = proxies, scraping_bee=scraping_bee, sub_articles=sub_articles)
         return d
\ No newline at end of file
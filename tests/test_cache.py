@@ -0,0 +1,146 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import utils_cache
+from utils_cache import ApiCache, freeze
+
+
+def cached_frame():
+    cache = ApiCache()
+    calls = []
+
+    @cache.cached("docs", ttl=60)
+    def get_docs():
+        calls.append(1)
+        return pd.DataFrame(
+            {
+                "answer": ["a", "b", "c"],
+                "relevance": [1.0, 2.0, 3.0],
+                "topic": pd.Categorical(["x", "y", "x"]),
+                "date": pd.to_datetime(["2021-01-01", "2021-01-02", "2021-01-03"]),
+            }
+        )
+
+    return get_docs, calls
+
+
+@pytest.mark.parametrize(
+    "mutate",
+    [
+        lambda df: df.loc.__setitem__((0, "relevance"), 9.0),
+        lambda df: df.iloc.__setitem__((1, 0), "z"),
+        lambda df: df["relevance"].values.__setitem__(0, 9.0),
+        lambda df: df["topic"].cat.codes.values.__setitem__(0, 1),
+        lambda df: df["date"].values.__setitem__(0, np.datetime64("2000-01-01")),
+    ],
+)
+def test_cached_frame_values_are_read_only(mutate):
+    get_docs, _ = cached_frame()
+    expected = get_docs().copy()
+    with pytest.raises(ValueError):
+        mutate(get_docs())
+    pd.testing.assert_frame_equal(get_docs(), expected)
+
+
+def test_cached_frame_structure_changes_do_not_leak():
+    get_docs, calls = cached_frame()
+    expected = get_docs().copy()
+    df = get_docs()
+    df["new"] = 1
+    df.drop(columns="answer", inplace=True)
+    df.sort_values("relevance", ascending=False, inplace=True)
+    df.reset_index(drop=True, inplace=True)
+    pd.testing.assert_frame_equal(get_docs(), expected)
+    assert len(calls) == 1
+
+
+def test_mutable_copy_of_cached_frame():
+    get_docs, _ = cached_frame()
+    df = get_docs().copy()
+    df.loc[0, "relevance"] = 9.0
+    assert get_docs().loc[0, "relevance"] == 1.0
+
+
+def test_frozen_frame_arrays_are_read_only():
+    # freeze relies on the private `_mgr.arrays` of pandas, this fails loudly
+    # if a pandas upgrade changes how a frame holds its column arrays
+    df = pd.DataFrame(
+        {
+            "object": ["a", "b"],
+            "float": np.array([1.0, 2.0], dtype=np.float32),
+            "int": [1, 2],
+            "bool": [True, False],
+            "category": pd.Categorical(["x", "y"]),
+            "date": pd.to_datetime(["2021-01-01", "2021-01-02"]),
+            "date_utc": pd.to_datetime(["2021-01-01", "2021-01-02"], utc=True),
+        }
+    )
+    frozen = freeze(df)
+    assert hasattr(frozen._mgr, "arrays"), "pandas frames no longer expose _mgr.arrays"
+    for values in frozen._mgr.arrays:
+        array = getattr(values, "_ndarray", values)
+        assert isinstance(array, np.ndarray), f"unexpected column array {type(values)}"
+        assert not array.flags.writeable
+    # the values are shared with the input frame, not copied
+    assert np.shares_memory(frozen["float"].to_numpy(), df["float"].to_numpy())
+
+
+def test_lru_eviction_is_bounded_in_bytes():
+    array = np.zeros(100)
+    cache = ApiCache(max_bytes=3 * array.nbytes)
+    for key in "abc":
+        cache.put("docs", key, np.zeros(100), ttl=60)
+    assert cache.stats()["bytes"] == 3 * array.nbytes
+    # reading "a" makes "b" the least recently used
+    assert cache.get("docs", "a")[0]
+    cache.put("docs", "d", np.zeros(100), ttl=60)
+    assert [cache.get("docs", key)[0] for key in "abcd"] == [True, False, True, True]
+    # an entry larger than the cache is not stored and evicts nothing
+    cache.put("docs", "e", np.zeros(1000), ttl=60)
+    assert not cache.get("docs", "e")[0]
+    stats = cache.stats()
+    assert stats["entries"] == 3 and stats["bytes"] == 3 * array.nbytes
+    assert stats["endpoints"]["docs"]["evictions"] == 1
+    # replacing an entry doesn't count its old size twice
+    cache.put("docs", "a", np.zeros(50), ttl=60)
+    assert cache.stats()["bytes"] == 2.5 * array.nbytes
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(utils_cache.time, "monotonic", lambda: now[0])
+    cache = ApiCache()
+    cache.put("docs", "short", "a", ttl=10)
+    cache.put("docs", "long", "b", ttl=100)
+    now[0] += 10
+    assert cache.get("docs", "short") == (True, "a")
+    now[0] += 1
+    assert cache.get("docs", "short") == (False, None)
+    assert cache.get("docs", "long") == (True, "b")
+    stats = cache.stats()
+    assert stats["entries"] == 1 and stats["bytes"] == utils_cache.sizeof("b")
+    assert stats["endpoints"]["docs"] == {"hits": 2, "misses": 1, "evictions": 0, "expired": 1}
+
+
+def test_hit_and_miss_counters():
+    cache = ApiCache()
+    calls = []
+
+    @cache.cached("doc-count", ttl=60)
+    def doc_count(filters=None, index="document"):
+        calls.append(filters)
+        return len(filters or [])
+
+    assert doc_count([1, 2]) == 2
+    # the same call however the arguments are passed
+    assert doc_count(filters=[1, 2]) == 2
+    assert doc_count([1, 2], "document") == 2
+    assert doc_count() == 0
+    assert calls == [[1, 2], None]
+    assert cache.stats()["endpoints"] == {"doc-count": {"hits": 2, "misses": 2, "evictions": 0, "expired": 0}}
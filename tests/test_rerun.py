@@ -0,0 +1,150 @@
+"""Incremental reruns of webapp.py against the fake API.
+
+Streamlit 1.8 has no test harness to run the page script, so the wiring of
+webapp.py is read from its source, and the Free Query flow is rendered
+through page_pipeline the way webapp.py does, keeping the memo between
+runs like the session state.
+"""
+import ast
+import os
+import sys
+from datetime import date
+
+import pytest
+
+dirname = os.path.dirname(__file__)
+sys.path.append(os.path.join(dirname, "../"))
+sys.path.append(os.path.join(dirname, "../benchmarks"))
+
+WEBAPP = os.path.join(dirname, "../webapp.py")
+PARAMS = {
+    "filter_date": (date(2020, 1, 1), date(2022, 12, 31)),
+    "filter_category": [],
+    "filter_category_exclude": True,
+    "top_k_retriever": 100,
+    "umap_perc": 1,
+    "show_density": False,
+    "umap_selection": None,
+    "num_neighbours": 10,
+    "news_cat_options": [],
+    "question": "Bitcoin Crypto",
+    "timeline_freq": "D",
+    "selected_date_range": 0,
+}
+QUERY_STAGES = {
+    "retrieve", "timeline_df", "query_newsmap", "umap_query", "umap_figure", "umap_overlay",
+    "timeline_figure", "date_index", "date_groups", "printed_articles",
+}
+
+
+def webapp_calls(path=WEBAPP):
+    """Names passed to pipeline.set, pipeline.start and pipeline.get in the page"""
+    calls = {"set": set(), "start": set(), "get": set()}
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and isinstance(node.func.value, ast.Name)
+            and node.func.value.id == "pipeline"
+            and node.func.attr in calls
+        ):
+            names = node.args if node.func.attr == "start" else node.args[:1]
+            for arg in names:
+                if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+                    calls[node.func.attr].add(arg.value)
+    return calls
+
+
+@pytest.fixture(scope="module")
+def api():
+    from fake_api import make_server
+
+    server = make_server(20000).start()
+    # utils reads the endpoint when it is imported
+    os.environ["API_ENDPOINT"] = server.url
+    import utils
+
+    utils.api_client.base_url = server.url
+    yield utils
+    server.shutdown()
+
+
+def api_requests(utils):
+    return sum(s["count"] for s in utils.api_client.latency_stats().values())
+
+
+def render(utils, memo, params):
+    """One Free Query run of webapp.py, returns the stages it computed and the API requests"""
+    from utils_pipeline import page_pipeline
+
+    before = api_requests(utils)
+    pipeline = page_pipeline(memo)
+    pipeline.set("unique_topics", list(utils.topic_names()))
+    for name, value in params.items():
+        pipeline.set(name, value)
+    pipeline.start("doc_count", "umap_docs", "density", "umap_query")
+    pipeline.get("query_newsmap")
+    pipeline.get("umap_overlay")
+    pipeline.get("umap_highlight")
+    pipeline.get("timeline_figure")
+    pipeline.get("printed_articles")
+    return set(pipeline.computed), api_requests(utils) - before
+
+
+@pytest.fixture
+def memo(api):
+    """Memo of a first run, with query results spread over several date ranges"""
+    memo = {}
+    render(api, memo, PARAMS)
+    assert len(memo["date_groups"].value) > 1
+    return memo
+
+
+def test_webapp_wiring(api):
+    from utils_pipeline import page_pipeline
+
+    pipeline = page_pipeline()
+    inputs = {i for stage in pipeline.stages.values() for i in stage.inputs}
+    # parameters page_pipeline sets itself
+    params = inputs - set(pipeline.stages) - set(pipeline.params)
+    calls = webapp_calls()
+    assert params - calls["set"] == set(), "parameters never set"
+    assert calls["set"] - params == set(), "set but used by no stage"
+    assert (calls["start"] | calls["get"]) - set(pipeline.stages) - params == set()
+    assert {n for n in calls["start"] if not pipeline.stages[n].background} == set()
+
+
+def test_same_run_again(api, memo):
+    assert render(api, memo, PARAMS) == (set(), 0)
+
+
+def test_timeline_slider_sends_no_request(api, memo):
+    assert render(api, memo, dict(PARAMS, selected_date_range=1)) == ({"printed_articles"}, 0)
+
+
+def test_timeline_frequency(api, memo):
+    computed, requests = render(api, memo, dict(PARAMS, timeline_freq="W"))
+    assert computed == {"timeline_figure", "date_groups", "printed_articles"}
+    assert requests == 0
+
+
+def test_umap_click(api, memo):
+    computed, requests = render(api, memo, dict(PARAMS, umap_selection=("knn", 0.0, 0.0)))
+    assert computed == {"umap_highlight", "umap_overlay"}
+    assert requests == 0
+
+
+def test_new_query(api, memo):
+    computed, requests = render(api, memo, dict(PARAMS, question="vaccine"))
+    assert computed == QUERY_STAGES
+    assert requests > 0
+
+
+def test_expired_count(api, memo):
+    # the count is older than its max_age (the API cache may still answer it)
+    memo["doc_count"] = memo["doc_count"]._replace(computed_at=0)
+    computed, _ = render(api, memo, PARAMS)
+    assert computed == {"doc_count", "umap_docs", "spatial_index", "umap_highlight", "umap_figure",
+                        "umap_overlay"}
@@ -0,0 +1,93 @@
+import json
+import os
+import sys
+from collections import Counter
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+from utils_sampling import StratifiedSampler, allocate, sample_indices, sample_stream
+
+COUNTS = {"big": 9000, "medium": 900, "small": 90, "tiny": 10}
+
+
+def doc_line(i, topic, answer="text"):
+    return json.dumps({"answer": answer, "meta": {"topic_label": topic, "id": i}}).encode("utf-8")
+
+
+def stream(counts=COUNTS, seed=0):
+    topics = [topic for topic, n in counts.items() for _ in range(n)]
+    np.random.default_rng(seed).shuffle(topics)
+    return [doc_line(i, topic) for i, topic in enumerate(topics)]
+
+
+def test_allocate_is_proportional_with_a_minimum_per_stratum():
+    alloc = allocate(COUNTS, 100)
+    assert sum(alloc.values()) == 100
+    # one item each, then largest remainder of the 96 left split proportionally
+    assert alloc == {"big": 87, "medium": 10, "small": 2, "tiny": 1}
+    assert allocate(COUNTS, 100, min_per_stratum=5)["tiny"] == 5
+
+
+def test_allocate_small_samples():
+    assert allocate(COUNTS, 20000) == COUNTS
+    assert allocate(COUNTS, 2) == {"big": 1, "medium": 1, "small": 0, "tiny": 0}
+    assert sum(allocate(COUNTS, 0).values()) == 0
+
+
+@pytest.mark.parametrize("size", [1, 10, 100, 1000])
+def test_stratified_sampler_counts_per_topic(size):
+    topics = [json.loads(line)["meta"]["topic_label"] for line in stream()]
+    sampler = StratifiedSampler(size, seed=0)
+    for i, topic in enumerate(topics):
+        sampler.offer(topic, i)
+    sample = sampler.sample()
+    counts = Counter(topics[i] for i in sample)
+    expected = allocate(COUNTS, size)
+    assert counts == Counter({topic: n for topic, n in expected.items() if n})
+    # in stream order, without duplicates
+    assert sample == sorted(set(sample))
+
+
+def test_sampler_memory_is_bounded():
+    sampler = StratifiedSampler(100, seed=0)
+    for i, line in enumerate(stream()):
+        sampler.offer(json.loads(line)["meta"]["topic_label"], i)
+        assert sum(len(kept) for kept in sampler.strata.values()) < 400
+
+
+@pytest.mark.parametrize("method", ["reservoir", "stratified"])
+def test_sample_stream(method):
+    lines = stream()
+    # documents without an answer are dropped before sampling
+    lines.insert(5, doc_line(-1, "tiny", answer=""))
+    lines.insert(7, b"")
+    sample = sample_stream(iter(lines), 100, method=method, seed=0)
+    assert len(sample) == 100
+    assert all(json.loads(line)["answer"] for line in sample)
+    if method == "stratified":
+        topics = Counter(json.loads(line)["meta"]["topic_label"] for line in sample)
+        assert topics == Counter(allocate(COUNTS, 100))
+
+
+@pytest.mark.parametrize("method", ["reservoir", "stratified"])
+def test_sample_size_zero_does_not_read_the_stream(method):
+    lines = iter(stream())
+    assert sample_stream(lines, 0, method=method, seed=0) == []
+    assert next(lines, None) is not None
+
+
+@pytest.mark.parametrize("method", ["head", "reservoir", "stratified"])
+def test_sample_indices(method):
+    lines = stream()
+    codes = np.array([sorted(COUNTS).index(json.loads(line)["meta"]["topic_label"]) for line in lines])
+    rows = sample_indices(codes, 100, method=method, seed=0)
+    assert len(rows) == 100 and len(set(rows.tolist())) == 100
+    assert (np.diff(rows) > 0).all()
+    if method == "stratified":
+        counts = Counter(sorted(COUNTS)[code] for code in codes[rows].tolist())
+        assert counts == Counter(allocate(COUNTS, 100))
+    assert len(sample_indices(codes, 0, method=method, seed=0)) == 0
+    assert len(sample_indices(codes, None, method=method)) == len(codes)
@@ -0,0 +1,91 @@
+import json
+import os
+import sys
+
+import numpy as np
+import plotly.graph_objects as go
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+from vis_components.spatial import DOCUMENTS, GridIndex, OverlayFigure, highlight_trace, selection_query
+
+
+def clustered_points(n=5000, seed=0):
+    """UMAP-like clusters of very different densities, with some NaN points"""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-10, 10, size=(8, 2))
+    scales = np.array([0.05, 0.1, 0.3, 0.5, 1, 1, 2, 4])
+    which = rng.integers(0, len(centers), n)
+    points = centers[which] + rng.normal(size=(n, 2)) * scales[which, None]
+    points[rng.choice(n, 50, replace=False)] = np.nan
+    return points[:, 0], points[:, 1]
+
+
+def distances(x, y, qx, qy):
+    d2 = (x - qx) ** 2 + (y - qy) ** 2
+    return np.where(np.isnan(d2), np.inf, d2)
+
+
+QUERIES = [(0.0, 0.0), (-10.0, 10.0), (50.0, -50.0), (3.3, -1.7)]
+
+
+@pytest.mark.parametrize("k", [1, 5, 10, 100, 4000])
+@pytest.mark.parametrize("query", QUERIES)
+def test_knn_matches_brute_force(query, k):
+    x, y = clustered_points()
+    index = GridIndex(x, y)
+    d2 = distances(x, y, *query)
+    found = index.knn(*query, k)
+    assert len(found) == k == len(set(found.tolist()))
+    assert np.isfinite(d2[found]).all()
+    # nearest first, and the same distances as the k nearest (ties may swap points)
+    assert (np.diff(d2[found]) >= 0).all()
+    np.testing.assert_array_equal(d2[found], np.sort(d2)[:k])
+
+
+def test_knn_more_than_the_points():
+    x, y = clustered_points(100)
+    index = GridIndex(x, y)
+    found = index.knn(0.0, 0.0, 1000)
+    assert sorted(found.tolist()) == np.flatnonzero(np.isfinite(x)).tolist()
+    assert len(index.knn(0.0, 0.0, 0)) == 0
+    assert len(GridIndex([], []).knn(0.0, 0.0, 10)) == 0
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_radius_and_box_match_brute_force(query):
+    x, y = clustered_points()
+    index = GridIndex(x, y)
+    d2 = distances(x, y, *query)
+    assert sorted(index.radius(*query, 2.0).tolist()) == np.flatnonzero(d2 <= 4.0).tolist()
+    qx, qy = query
+    with np.errstate(invalid="ignore"):
+        inside = (x >= qx - 1) & (x <= qx + 3) & (y >= qy - 2) & (y <= qy + 0.5)
+    assert sorted(index.box(qx - 1, qx + 3, qy - 2, qy + 0.5).tolist()) == np.flatnonzero(inside).tolist()
+
+
+def test_selection_query():
+    click = [{"x": 1.5, "y": -2, "curveNumber": 0, "pointNumber": 3}]
+    assert selection_query(None) is None
+    assert selection_query("[]") is None
+    assert selection_query(click) == ("knn", 1.5, -2.0)
+    # plotly_events keeps the value in the session state as JSON
+    assert selection_query(json.dumps(click)) == ("knn", 1.5, -2.0)
+    # clicks on the query marker or the density aren't documents
+    assert selection_query(click, document_curves=[1, 2]) is None
+    points = click + [{"x": 0, "y": 4, "curveNumber": 1}]
+    assert selection_query(points) == ("box", 0.0, 1.5, -2.0, 4.0)
+    selection = {"points": points, "range": {"x": [3, -1], "y": [0, 2]}}
+    assert selection_query(selection) == ("box", -1.0, 3.0, 0.0, 2.0)
+
+
+def test_overlay_figure_document_curves():
+    fig = go.Figure([go.Scattergl(x=[0], y=[0], meta=DOCUMENTS), go.Scattergl(x=[1], y=[1], name="Query")])
+    base = OverlayFigure(fig)
+    overlaid = base.overlay(highlight_trace([0], [0]))
+    assert base.document_curves == [0]
+    assert overlaid.document_curves == [0, 2]
+    plotly_json = json.loads(overlaid.to_json())
+    assert [trace.get("name") for trace in plotly_json["data"]] == [None, "Query", "Neighbours"]
+    assert len(json.loads(base.to_json())["data"]) == 2
@@ -0,0 +1,33 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../benchmarks"))
+
+from profile_startup import LAZY_MODULES, MODULES, profile
+
+# Seconds the cold start of webapp.py's imports may take
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET", 5.0))
+
+
+@pytest.fixture(scope="module")
+def startup():
+    missing = [m for m in MODULES if importlib.util.find_spec(m.split(".")[0]) is None]
+    if missing:
+        pytest.skip(f"not installed: {', '.join(missing)}")
+    return profile(MODULES)
+
+
+def test_cold_start_within_budget(startup):
+    elapsed, rows, _ = startup
+    slowest = ", ".join(
+        f"{name.strip()} {cumulative / 1e6:.2f} s" for cumulative, _, name in sorted(rows)[-5:]
+    )
+    assert elapsed <= STARTUP_BUDGET, f"cold start {elapsed:.2f} s, slowest imports: {slowest}"
+
+
+def test_lazy_modules_not_imported_at_startup(startup):
+    _, _, loaded = startup
+    assert [m for m in LAZY_MODULES if m in loaded] == []
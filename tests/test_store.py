@@ -0,0 +1,164 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import utils_store
+from utils_store import CorpusStore
+
+TOPICS = ["0_bitcoin", "1_vaccine", "2_election"]
+
+
+def make_docs(ids, topics=None, dates=None, answer="text"):
+    ids = list(ids)
+    return pd.DataFrame(
+        {
+            "answer": [f"{answer} {i}" for i in ids],
+            "source": ["reuters" if i % 2 else "bbc-news" for i in ids],
+            "publishedat": dates or [f"2021-01-{1 + i % 28:02d}T12:00:00Z" for i in ids],
+            "topic": topics or [TOPICS[i % len(TOPICS)] for i in ids],
+            "url": [f"https://example.com/{i}" for i in ids],
+            "image_url": [None if i % 3 else f"https://example.com/{i}.jpg" for i in ids],
+            "umap_embeddings_x": np.arange(len(ids), dtype=np.float32),
+            "umap_embeddings_y": -np.arange(len(ids), dtype=np.float32),
+            "document_id": [f"doc-{i}" for i in ids],
+        }
+    )
+
+
+def api_lines(docs):
+    """all-docs-generator chunks of docs"""
+    for doc in docs.to_dict("records"):
+        yield json.dumps(
+            {
+                "answer": doc["answer"],
+                "document_id": doc["document_id"],
+                "meta": {
+                    "source": doc["source"],
+                    "publishedat": doc["publishedat"],
+                    "topic_label": doc["topic"],
+                    "url": doc["url"],
+                    "urltoimage": doc["image_url"],
+                    "umap_embeddings": [float(doc["umap_embeddings_x"]), float(doc["umap_embeddings_y"])],
+                },
+            }
+        ).encode("utf-8")
+
+
+def stored(store, filters=None):
+    """Documents of the store matching filters, by document_id"""
+    docs = store.select(filters)
+    return docs.astype({"source": object, "topic": object}).set_index("document_id").sort_index()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = CorpusStore(str(tmp_path / "corpus"))
+    store.write(make_docs(range(30)))
+    store.load()
+    return store
+
+
+def test_round_trip(store):
+    docs = make_docs(range(30))
+    pd.testing.assert_frame_equal(stored(store), docs.set_index("document_id").sort_index())
+    assert len(store) == store.count() == 30
+
+
+@pytest.mark.parametrize(
+    "filters, expected",
+    [
+        ([{"terms": {"topic_label": ["1_vaccine"]}}], lambda i: i % 3 == 1),
+        ([{"terms": {"topic_label": ["1_vaccine", "unknown"]}}], lambda i: i % 3 == 1),
+        ([{"terms": {"source": ["reuters"]}}], lambda i: i % 2 == 1),
+        ([{"range": {"publishedat": {"gte": "2021-01-10", "lte": "2021-01-12"}}}], lambda i: 9 <= i % 28 <= 11),
+        ([{"range": {"publishedat": {"gt": "2021-01-10", "lt": "2021-01-12"}}}], lambda i: i % 28 == 10),
+        (
+            [{"terms": {"topic_label": ["0_bitcoin"]}}, {"range": {"publishedat": {"lte": "2021-01-04T12:00:00Z"}}}],
+            lambda i: i % 3 == 0 and i % 28 <= 3,
+        ),
+    ],
+)
+def test_filter_masks(store, filters, expected):
+    ids = [i for i in range(30) if expected(i)]
+    assert np.flatnonzero(store.mask(filters)).tolist() == ids
+    assert store.count(filters) == len(ids)
+    assert stored(store, filters).index.tolist() == sorted(f"doc-{i}" for i in ids)
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [
+        [{"terms": {"url": ["x"]}}],
+        [{"range": {"score": {"gte": 1}}}],
+        [{"range": {"publishedat": {"eq": "2021-01-01"}}}],
+        [{"exists": {"field": "url"}}],
+    ],
+)
+def test_unsupported_filters_raise(store, filters):
+    with pytest.raises(ValueError):
+        store.mask(filters)
+
+
+def test_append_replaces_documents_and_switches_version(store):
+    before = store.state
+    first_version = os.path.realpath(store.path)
+    store.append(make_docs([28, 29, 30, 31], topics=["3_climate"] * 4, answer="updated"))
+    assert os.path.realpath(store.path) != first_version
+    # the switch is seen once the version is loaded
+    assert store.state is before
+    store.load()
+    assert [info["name"] for info in store.meta["segments"]] == ["s0", "s1"]
+    assert len(store) == store.count() == 32
+    docs = stored(store)
+    assert docs.loc["doc-29", "answer"] == "updated 29"
+    assert docs.loc["doc-27", "answer"] == "text 27"
+    # new topics get new codes, the stored codes stay valid
+    assert store.meta["categories"]["topic"] == TOPICS + ["3_climate"]
+    assert store.count([{"terms": {"topic_label": ["3_climate"]}}]) == 4
+    assert store.count([{"terms": {"topic_label": ["2_election"]}}]) == 9
+    # a reader of the previous version still sees it whole
+    assert int(store.mask(state=before).sum()) == 30
+    assert store.frame([29], before)["answer"].tolist() == ["text 29"]
+
+
+def test_merge_deduplicates_by_document_id(store):
+    merged = store.merge(make_docs([5, 40], answer="new"))
+    assert len(merged) == 31
+    assert merged["document_id"].is_unique
+    assert merged.set_index("document_id").loc["doc-5", "answer"] == "new 5"
+
+
+def test_compaction(store, monkeypatch):
+    monkeypatch.setattr(utils_store, "MAX_SEGMENTS", 3)
+    for start in (30, 40, 50):
+        store.append(make_docs(range(start - 1, start + 10)))
+        store.load()
+    # the third append compacts into one segment
+    assert [info["name"] for info in store.meta["segments"]] == ["s0"]
+    assert len(store) == 60
+    assert stored(store).index.tolist() == sorted(f"doc-{i}" for i in range(60))
+    # older versions are removed, the current one and the one before it are kept
+    assert len(store.versions()) == 2
+
+
+def test_refresh_fetches_newer_documents(store):
+    requests = []
+
+    def fetch_lines(filters):
+        requests.append(filters)
+        newer = make_docs([29, 100], dates=["2021-01-02T12:00:00Z", "2021-02-01T00:00:00Z"], answer="new")
+        return api_lines(newer)
+
+    assert store.refresh(fetch_lines, force=True) == 2
+    assert requests == [[{"range": {"publishedat": {"gte": "2021-01-28T12:00:00"}}}]]
+    assert store.max_publishedat == "2021-02-01T00:00:00"
+    assert len(store) == 31
+    assert not store.is_stale()
+    assert store.refresh(fetch_lines) == 0
+    assert len(requests) == 1
@@ -0,0 +1,90 @@
+import os
+import sys
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+from vis_components.timelines import DailyCounts, DateIndex
+
+# 2021-12-27 and 2022-01-03 are mondays, 2022-01-02 a sunday
+DATES = ["2022-01-03", "2021-12-31", "2022-01-02", "2021-12-27", "2022-01-31", "2022-02-01", "2022-01-02"]
+
+
+def date_index(dates=DATES):
+    data = pd.DataFrame({"date": [date.fromisoformat(d) for d in dates], "id": range(len(dates))})
+    return DateIndex(data)
+
+
+def test_slice_is_half_open():
+    index = date_index()
+    assert index.slice("2022-01-02", "2022-01-03")["id"].tolist() == [2, 6]
+    assert index.slice(date(2021, 12, 27), date(2022, 1, 3))["id"].tolist() == [3, 1, 2, 6]
+    assert index.slice("2022-02-01", "2022-03-01")["id"].tolist() == [5]
+    assert len(index.slice("2022-01-04", "2022-01-31")) == 0
+
+
+def test_week_buckets_start_on_monday():
+    buckets = date_index().buckets(freq="W")
+    # only weeks with articles start a bucket, a bucket runs to the next one
+    assert buckets["range"].tolist() == [
+        ("2021-12-27", "2022-01-03"),
+        ("2022-01-03", "2022-01-31"),
+        ("2022-01-31", "2022-02-07"),
+    ]
+    assert buckets["from"].tolist() == [np.datetime64("2021-12-27"), np.datetime64("2022-01-03"), np.datetime64("2022-01-31")]
+
+
+def test_month_buckets_cross_the_year():
+    buckets = date_index().buckets(freq="M")
+    assert buckets["range"].tolist() == [
+        ("2021-12-01", "2022-01-01"),
+        ("2022-01-01", "2022-02-01"),
+        ("2022-02-01", "2022-03-01"),
+    ]
+
+
+def test_buckets_of_size():
+    index = date_index()
+    # every third article starts a bucket, the last one ends after the last date
+    assert index.buckets(size=3)["range"].tolist() == [
+        ("2021-12-27", "2022-01-02"),
+        ("2022-01-02", "2022-02-01"),
+        ("2022-02-01", "2022-02-02"),
+    ]
+    assert index.buckets(size=100)["range"].tolist() == [("2021-12-27", "2022-02-02")]
+
+
+@pytest.mark.parametrize("freq", [None, "W", "M"])
+def test_buckets_cover_every_article_once(freq):
+    index = date_index()
+    sizes = [len(index.slice(*bounds)) for bounds in index.buckets(freq=freq, size=2)["range"]]
+    assert sum(sizes) == len(DATES)
+
+
+def test_buckets_of_no_articles():
+    index = date_index([])
+    assert len(index) == 0
+    assert len(index.buckets(freq="W")) == 0
+    with pytest.raises(ValueError):
+        date_index().buckets(freq="Y")
+
+
+def test_daily_counts_rollup():
+    counts = DailyCounts(DATES[:4]).add(DATES[4:])
+    days, per_day = counts.rollup("D")
+    assert days[0] == np.datetime64("2021-12-27") and days[-1] == np.datetime64("2022-02-01")
+    assert per_day.sum() == len(DATES) and per_day[days == np.datetime64("2022-01-02")].tolist() == [2]
+    weeks, per_week = counts.rollup("W")
+    assert weeks.astype(str).tolist() == ["2021-12-27", "2022-01-03", "2022-01-10", "2022-01-17", "2022-01-24", "2022-01-31"]
+    assert per_week.tolist() == [4, 1, 0, 0, 0, 2]
+    months, per_month = counts.rollup("M")
+    assert months.astype(str).tolist() == ["2021-12-01", "2022-01-01", "2022-02-01"]
+    assert per_month.tolist() == [2, 4, 1]
+    # dates before the first day grow the range backwards
+    counts.add(["2021-11-30"])
+    months, per_month = counts.rollup("M")
+    assert per_month.tolist() == [1, 2, 4, 1]
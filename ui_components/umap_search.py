@@ -1,31 +1,50 @@
-from textwrap import wrap
-
-from pandas import DataFrame
+from pandas import DataFrame, concat
 
+from utils_metrics import metrics
 from vis_components.umap import umap_plot
 
+# Characters of the title and of the content shown when hovering a document
+HOVER_TITLE_CHARS = 100
+HOVER_CONTENT_CHARS = 200
+
+
+def hover_data(documents: DataFrame):
+    """Short title and content snippet of every document.
 
-def umap_page(documents: DataFrame, query: dict, unique_topics: list):
+    Only a snippet of the content is sent to the browser, the documents
+    near a click are listed below the UMAP with their full title and url.
+    """
+    parts = documents["answer"].fillna("").str.partition("#SEPTAG#")
+    title = parts[0].str.slice(0, HOVER_TITLE_CHARS)
+    content = parts[2].str.replace("#SEPTAG#", " ", regex=False)
+    snippet = content.str.slice(0, HOVER_CONTENT_CHARS)
+    snippet = snippet.where(content.str.len() <= HOVER_CONTENT_CHARS, snippet.str.rstrip() + "...")
+    # Line breaks at the last space before every 100 characters
+    snippet = snippet.str.replace(r"(?=.{101})(.{1,100})\s+", r"\1<br>", regex=True)
+    return DataFrame({0: title, 1: snippet})
+
+
+@metrics.timed("umap_page")
+def umap_page(documents: DataFrame, query: dict, unique_topics: list, density=None, highlight=None):
     # Set custom data
-    custom_data = documents["answer"].str.split("#SEPTAG#", expand=True, n=1)
-    custom_data = custom_data.applymap(
-        lambda t: "<br>".join(wrap(t.replace("#SEPTAG#", " "), width=100)) if t else ""
-    )
+    custom_data = hover_data(documents)
 
     # Set query row
     if query:
         query_label = query["query_text"]
         if len(query_label) > 40:
             query_label = query_label[:40] + "..."
-        documents = documents.append(
-            {
-                "answer": query["query_text"],
-                "umap_embeddings_x": query["query_umap"][0],
-                "umap_embeddings_y": query["query_umap"][1],
-                "topic": query_label,
-            },
-            ignore_index=True,
+        query_row = DataFrame(
+            [
+                {
+                    "answer": query["query_text"],
+                    "umap_embeddings_x": query["query_umap"][0],
+                    "umap_embeddings_y": query["query_umap"][1],
+                    "topic": query_label,
+                }
+            ]
         )
+        documents = concat([documents, query_row], ignore_index=True)
     else:
         query_label = "Query"
 
@@ -35,6 +54,8 @@ def umap_page(documents: DataFrame, query: dict, unique_topics: list):
         unique_topics=unique_topics,
         query_label=query_label,
         custom_data=custom_data,
+        density=density,
+        highlight=highlight,
     )
 
     return p, config
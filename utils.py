@@ -1,9 +1,16 @@
-import json
 import logging
 import os
+import threading
+from contextlib import closing
 
-import requests
-import streamlit as st
+from utils_cache import ApiCache
+from utils_columnar import decode_doc_stream
+from utils_http import ApiClient
+from utils_metrics import metrics, serve_metrics
+from utils_projection import QueryProjector
+from utils_sampling import sample_stream
+from utils_store import CorpusStore
+from vis_components.density import DensityGrid
 
 API_ENDPOINT = os.getenv("API_ENDPOINT", "http://34.175.73.238:8000")
 DOC_REQUEST = "query"
@@ -12,23 +19,74 @@ DOC_REQUEST_GENERATOR = "all-docs-generator"
 UMAP_QUERY = "umap-query"
 TOPIC_NAMES = "topic-names"
 NUM_DOCS = "doc-count"
+# Not an API endpoint: density grids computed from the corpus
+DENSITY = "density"
+# Send the sample size to all-docs-generator (only for APIs that support it)
+SAMPLING_HINT = os.getenv("API_SAMPLING_HINT", "false").lower() == "true"
+# Local copy of the corpus, disabled unless a directory is given
+CORPUS_STORE_DIR = os.getenv("CORPUS_STORE_DIR")
+CORPUS_REFRESH_SECONDS = int(os.getenv("CORPUS_REFRESH_SECONDS", "600"))
+CORPUS_BATCH_SIZE = 10000
+# Documents sampled for the density layer when there is no corpus store
+DENSITY_SAMPLE_SIZE = int(os.getenv("DENSITY_SAMPLE_SIZE", 50000))
+# Fitted UMAP reducer (and embedder) projecting the queries in process
+# instead of calling umap-query, disabled unless a file is given
+UMAP_REDUCER_PATH = os.getenv("UMAP_REDUCER_PATH")
+UMAP_QUERY_EMBEDDER = os.getenv("UMAP_QUERY_EMBEDDER")
+UMAP_REDUCER_EMBEDDER = os.getenv("UMAP_REDUCER_EMBEDDER", "false").lower() == "true"
+
+# Seconds a response stays cached, per endpoint
+CACHE_TTL = {
+    DOC_REQUEST: 600,
+    DOC_REQUEST_GENERATOR: 1800,
+    UMAP_QUERY: 3600,
+    NUM_DOCS: 600,
+    TOPIC_NAMES: 3600,
+    DENSITY: 1800,
+}
 
 logger = logging.getLogger(__name__)
+api_client = ApiClient(
+    API_ENDPOINT,
+    connect_timeout=float(os.getenv("API_CONNECT_TIMEOUT", 3.05)),
+    read_timeout=float(os.getenv("API_READ_TIMEOUT", 60)),
+    retries=int(os.getenv("API_RETRIES", 3)),
+    gzip_requests=os.getenv("API_GZIP_REQUESTS", "false").lower() == "true",
+    no_retry=[DOC_FEEDBACK],
+)
+api_cache = ApiCache(max_bytes=int(os.getenv("API_CACHE_MAX_BYTES", 512 * 2 ** 20)))
+metrics.register_gauge(
+    "cache_requests",
+    lambda: {
+        (("endpoint", endpoint), ("result", result)): count
+        for endpoint, counters in api_cache.stats()["endpoints"].items()
+        for result, count in counters.items()
+    },
+)
+metrics.register_gauge("cache_bytes", lambda: {(): api_cache.stats()["bytes"]})
+metrics.register_gauge(
+    "api_decoded_bytes",
+    lambda: {(("endpoint", k),): v["decoded_bytes"] for k, v in api_client.latency_stats().items()},
+)
+_metrics_server = None
+_corpus_store = None
+_query_projector = None
+# Stages started together all ask for the singletons on a cold start
+_singletons_lock = threading.Lock()
 
 
-@st.cache(
-    show_spinner=False
-)  # If the input parameters didn't change then streamlit doesn't execute the function again
+# If the input parameters didn't change then the API is not queried again
+@metrics.timed("retrieve_doc")
+@api_cache.cached(DOC_REQUEST, ttl=CACHE_TTL[DOC_REQUEST])
 def retrieve_doc(query, filters=None, top_k_reader=10, top_k_retriever=100):
     # Query Haystack API
-    url = f"{API_ENDPOINT}/{DOC_REQUEST}"
     req = {
         "query": query,
         "filters": filters,
         "top_k_retriever": top_k_retriever,
         "top_k_reader": top_k_reader,
     }
-    response_raw = requests.post(url, json=req).json()
+    response_raw = api_client.post(DOC_REQUEST, req).json()
 
     # Format response
     result = []
@@ -62,84 +120,186 @@ def retrieve_doc(query, filters=None, top_k_reader=10, top_k_retriever=100):
     return result, response_raw
 
 
-@st.cache(show_spinner=False)
-def get_all_docs(filters=None, batch_size=None, sample_size=None):
-    # Query Haystack API
-    url = f"{API_ENDPOINT}/{DOC_REQUEST_GENERATOR}"
+def stream_docs(filters=None, batch_size=None, sample=None):
+    """Raw `#SEP#` chunks of the all-docs-generator stream, close() releases the connection"""
     req = {"filters": filters, "batch_size": batch_size}
-    response_generator = requests.get(url, json=req, stream=True).iter_lines(
-        delimiter=b"#SEP#"
+    if sample is not None:
+        req["sample"] = sample
+    return api_client.stream_lines(DOC_REQUEST_GENERATOR, req, delimiter=b"#SEP#")
+
+
+def metrics_server():
+    """Serve the Prometheus metrics on METRICS_PORT, once per process (None if unset)"""
+    global _metrics_server
+    port = os.getenv("METRICS_PORT")
+    with _singletons_lock:
+        if port and _metrics_server is None:
+            _metrics_server = serve_metrics(metrics, int(port))
+    return _metrics_server
+
+
+def corpus_store():
+    """Local corpus store, refreshed from the API when stale (None if disabled)"""
+    global _corpus_store
+    if CORPUS_STORE_DIR is None:
+        return None
+    with _singletons_lock:
+        if _corpus_store is None:
+            _corpus_store = CorpusStore(CORPUS_STORE_DIR, refresh_interval=CORPUS_REFRESH_SECONDS)
+    if _corpus_store.is_stale():
+        fetch_lines = lambda filters: stream_docs(filters=filters, batch_size=CORPUS_BATCH_SIZE)
+        if _corpus_store.meta is None:
+            # nothing to serve yet: the first download is waited for, refresh
+            # serializes concurrent callers and the later ones find it fresh
+            _corpus_store.refresh(fetch_lines)
+        else:
+            # new documents are appended in the background, the current
+            # version answers meanwhile
+            _corpus_store.refresh_async(fetch_lines)
+    return _corpus_store
+
+
+def query_projector():
+    """Local projector of the queries, loading in the background (None if disabled)"""
+    global _query_projector
+    if UMAP_REDUCER_PATH is None:
+        return None
+    with _singletons_lock:
+        if _query_projector is None:
+            _query_projector = QueryProjector(
+                UMAP_REDUCER_PATH,
+                embedder=UMAP_QUERY_EMBEDDER,
+                bundled_embedder=UMAP_REDUCER_EMBEDDER,
+                cache=api_cache,
+            ).load_async()
+    return _query_projector
+
+
+@metrics.timed("get_all_docs")
+@api_cache.cached(DOC_REQUEST_GENERATOR, ttl=CACHE_TTL[DOC_REQUEST_GENERATOR])
+def get_all_docs(
+    filters=None, batch_size=None, sample_size=None, sampling="head", sample_seed=None
+):
+    """Get the documents matching filters, optionally sampled.
+
+    sampling: "head" keeps the first sample_size documents of the stream,
+    "reservoir" a uniform sample and "stratified" a sample stratified by topic.
+    """
+    # Answer the filters locally when the corpus store is enabled
+    store = corpus_store()
+    if store is not None:
+        try:
+            docs = store.select(
+                filters, sample_size=sample_size, sampling=sampling, sample_seed=sample_seed
+            )
+            metrics.count("rows_from_store", len(docs))
+            return docs
+        except ValueError as e:
+            logger.info(f"Corpus store can't answer the filters ({e}), querying the API.")
+
+    # Query Haystack API
+    sample = None
+    if SAMPLING_HINT and sample_size is not None:
+        # Let the API sample server side, the client sampler is then a no-op
+        sample = {"size": sample_size, "method": sampling, "seed": sample_seed}
+    # Closed as soon as the sample is complete, not when garbage collected
+    stream = stream_docs(filters=filters, batch_size=batch_size, sample=sample)
+    with closing(stream) as response_generator:
+        # Sample the raw chunks so only the kept documents are decoded
+        logger.info(f"Begin generator.")
+        if sample_size is not None and sampling != "head":
+            response_generator = sample_stream(
+                response_generator, sample_size, method=sampling, seed=sample_seed
+            )
+
+        # Decode the stream straight into typed column buffers
+        docs = decode_doc_stream(
+            response_generator, sample_size=sample_size, log_every=batch_size, logger=logger
+        )
+    metrics.count("rows_decoded", len(docs))
+    return docs
+
+
+@metrics.timed("corpus_density")
+@api_cache.cached(DENSITY, ttl=CACHE_TTL[DENSITY])
+def corpus_density(filters=None, bins=128):
+    """Per-topic density grid of the UMAP embeddings of every document matching filters.
+
+    Without a corpus store the grid is estimated from a uniform sample of
+    DENSITY_SAMPLE_SIZE documents, so only the sample is decoded and kept.
+    """
+    store = corpus_store()
+    if store is not None:
+        try:
+            x, y, codes, topics = store.embeddings(filters)
+            return DensityGrid.from_points(x, y, codes, topics, bins=bins)
+        except ValueError as e:
+            logger.info(f"Corpus store can't answer the filters ({e}), querying the API.")
+    num_docs = doc_count(filters)
+    docs = get_all_docs(
+        filters=filters,
+        batch_size=CORPUS_BATCH_SIZE,
+        sample_size=DENSITY_SAMPLE_SIZE,
+        sampling="reservoir",
+        sample_seed=0,
     )
+    topics = docs["topic"].astype("category")
+    return DensityGrid.from_points(
+        docs["umap_embeddings_x"].to_numpy(dtype="float32", na_value=float("nan")),
+        docs["umap_embeddings_y"].to_numpy(dtype="float32", na_value=float("nan")),
+        topics.cat.codes.to_numpy(),
+        topics.cat.categories.tolist(),
+        bins=bins,
+        scale=num_docs / len(docs) if len(docs) else 1.0,
+    )
+
+
+@metrics.timed("umap_query")
+def umap_query(query, embedding=None):
+    """Text and 2D UMAP coordinates of the query, projected in process when a
+    reducer is configured and by the API otherwise. None while the reducer is
+    loading, the UMAP is drawn without the query marker then.
+    embedding: query embedding returned with the search results, if any"""
+    projector = query_projector()
+    if projector is not None:
+        try:
+            return projector.project(query, embedding=embedding)
+        except Exception as e:
+            logger.warning(f"Local query projection failed ({e}), querying the API.")
+    return fetch_umap_query(query)
 
-    if sample_size is None:
-        sample_size = float("inf")
-
-    final_docs = []
-    i = 0
-    for line in response_generator:
-        if i % batch_size == 0:
-            if i == 0:
-                logger.info(f"Begin generator.")
-            else:
-                logger.info(f"Iteration done: {i}.")
-        # Filter out keep-alive new lines
-        if line:
-            doc = json.loads(line.decode("utf-8"))
-            answer = doc["answer"]
-            if answer:
-                meta_source = doc["meta"].get("source", None)
-                meta_publishedat = doc["meta"].get("publishedat", None)
-                meta_topic = doc["meta"].get("topic_label", None)
-                meta_url = doc["meta"].get("url", None)
-                meta_imageurl = doc["meta"].get("urltoimage", None)
-                meta_umapembeddings = doc["meta"].get("umap_embeddings", None)
-                meta_umapembeddingsx = (
-                    None if meta_umapembeddings is None else meta_umapembeddings[0]
-                )
-                meta_umapembeddingsy = (
-                    None if meta_umapembeddings is None else meta_umapembeddings[1]
-                )
-                document_id = doc["document_id"]
-                final_docs.append(
-                    {
-                        "answer": answer,
-                        "source": meta_source,
-                        "publishedat": meta_publishedat,
-                        "topic": meta_topic,
-                        "url": meta_url,
-                        "image_url": meta_imageurl,
-                        "umap_embeddings_x": meta_umapembeddingsx,
-                        "umap_embeddings_y": meta_umapembeddingsy,
-                        "document_id": document_id,
-                    }
-                )
-                i += 1
-        # Exit the loop when we reach sample_size
-        if i == sample_size:
-            logger.info(f"Final iteration number: {i}")
-            break
-    return final_docs
-
-
-@st.cache(show_spinner=False)
-def umap_query(query):
-    url = f"{API_ENDPOINT}/{UMAP_QUERY}"
+
+@api_cache.cached(UMAP_QUERY, ttl=CACHE_TTL[UMAP_QUERY])
+def fetch_umap_query(query):
     req = {"query": query}
-    response_raw = requests.post(url, json=req).json()
+    response_raw = api_client.post(UMAP_QUERY, req).json()
     return response_raw
 
 
+def query_embedding(response_raw):
+    """Query embedding of a query response, when the API returns it"""
+    embedding = response_raw.get("query_embedding")
+    return None if embedding is None else list(embedding)
+
+
+@metrics.timed("topic_names")
+@api_cache.cached(TOPIC_NAMES, ttl=CACHE_TTL[TOPIC_NAMES])
 def topic_names():
-    url = f"{API_ENDPOINT}/{TOPIC_NAMES}"
-    response_raw = requests.get(url, json={}).json()
+    response_raw = api_client.get(TOPIC_NAMES, {}).json()
     return response_raw["topic_names"]
 
 
-@st.cache(show_spinner=False)
+@metrics.timed("doc_count")
+@api_cache.cached(NUM_DOCS, ttl=CACHE_TTL[NUM_DOCS])
 def doc_count(filters=None):
-    url = f"{API_ENDPOINT}/{NUM_DOCS}"
+    store = corpus_store()
+    if store is not None:
+        try:
+            return store.count(filters)
+        except ValueError as e:
+            logger.info(f"Corpus store can't answer the filters ({e}), querying the API.")
     req = {"filters": filters}
-    response_raw = requests.get(url, json=req).json()
+    response_raw = api_client.get(NUM_DOCS, req).json()
     return response_raw["num_documents"]
 
 
@@ -147,7 +307,6 @@ def feedback_doc(
     question, answer, document_id, model_id, is_correct_answer, is_correct_document
 ):
     # Feedback Haystack API
-    url = f"{API_ENDPOINT}/{DOC_FEEDBACK}"
     req = {
         "question": question,
         "answer": answer,
@@ -156,5 +315,5 @@ def feedback_doc(
         "is_correct_answer": is_correct_answer,
         "is_correct_document": is_correct_document,
     }
-    response_raw = requests.post(url, json=req).json()
+    response_raw = api_client.post(DOC_FEEDBACK, req).json()
     return response_raw
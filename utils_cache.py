@@ -0,0 +1,148 @@
+import functools
+import inspect
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from types import MappingProxyType
+
+import numpy as np
+import pandas as pd
+
+
+def canonical_key(fn, args, kwargs):
+    """Cache key for a call, independent of how the arguments were passed"""
+    bound = inspect.signature(fn).bind(*args, **kwargs)
+    bound.apply_defaults()
+    return json.dumps(bound.arguments, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def freeze(value):
+    """Read-only view of a result so it can be shared without hashing it again.
+
+    Lists become tuples, dicts become mappingproxies and NumPy arrays are
+    flagged read-only. DataFrames become shallow copies over read-only
+    arrays: writing their values raises, and `thaw` gives every caller its
+    own frame so adding or dropping columns doesn't reach the cache.
+    """
+    if isinstance(value, pd.DataFrame):
+        frozen = value.copy(deep=False)
+        for values in frozen._mgr.arrays:
+            # categorical and datetime columns wrap an ndarray
+            array = getattr(values, "_ndarray", values)
+            if isinstance(array, np.ndarray):
+                array.flags.writeable = False
+        return frozen
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    return value
+
+
+def thaw(value):
+    """Value handed to a caller: frozen DataFrames are shallow copied, so the
+    cached frame keeps its columns and index whatever the caller does"""
+    if isinstance(value, pd.DataFrame):
+        return value.copy(deep=False)
+    return value
+
+
+def sizeof(value):
+    """Approximate size in bytes of a cached result"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (dict, MappingProxyType)):
+        return sys.getsizeof(value) + sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class ApiCache:
+    """Thread-safe LRU cache for the API client, bounded in bytes.
+
+    Entries expire after the TTL of their endpoint. Results are stored frozen,
+    so a hit is a dictionary lookup: neither the arguments nor the result are
+    hashed beyond the canonical key.
+    """
+
+    def __init__(self, max_bytes=512 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = defaultdict(
+            lambda: {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+        )
+
+    def get(self, endpoint, key):
+        """Return (True, value) on a hit and (False, None) on a miss"""
+        with self.lock:
+            entry = self.entries.get((endpoint, key))
+            if entry is not None and entry[2] < time.monotonic():
+                self.remove((endpoint, key))
+                self.counters[endpoint]["expired"] += 1
+                entry = None
+            if entry is None:
+                self.counters[endpoint]["misses"] += 1
+                return False, None
+            self.entries.move_to_end((endpoint, key))
+            self.counters[endpoint]["hits"] += 1
+            return True, entry[0]
+
+    def put(self, endpoint, key, value, ttl):
+        size = sizeof(value)
+        with self.lock:
+            if (endpoint, key) in self.entries:
+                self.remove((endpoint, key))
+            if size > self.max_bytes:
+                return
+            self.entries[(endpoint, key)] = (value, size, time.monotonic() + ttl)
+            self.bytes += size
+            # Evict least recently used entries until we are under the bound
+            while self.bytes > self.max_bytes:
+                (evicted_endpoint, _), (_, evicted_size, _) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.counters[evicted_endpoint]["evictions"] += 1
+
+    def remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Hit/miss/eviction counters per endpoint plus the cache size"""
+        with self.lock:
+            return {
+                "bytes": self.bytes,
+                "entries": len(self.entries),
+                "endpoints": {k: dict(v) for k, v in self.counters.items()},
+            }
+
+    def cached(self, endpoint, ttl):
+        """Decorator caching an API client function under `endpoint`"""
+
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                key = canonical_key(fn, args, kwargs)
+                hit, value = self.get(endpoint, key)
+                if hit:
+                    return thaw(value)
+                value = freeze(fn(*args, **kwargs))
+                self.put(endpoint, key, value, ttl)
+                return thaw(value)
+
+            return wrapper
+
+        return decorator
@@ -0,0 +1,126 @@
+import json
+from array import array
+
+import numpy as np
+import pandas as pd
+
+# Columns produced by the document decoder, in output order
+DOC_COLUMNS = [
+    "answer",
+    "source",
+    "publishedat",
+    "topic",
+    "url",
+    "image_url",
+    "umap_embeddings_x",
+    "umap_embeddings_y",
+    "document_id",
+]
+
+
+class CategoryColumn:
+    """Categorical column stored as integer codes (-1 for missing values)"""
+
+    def __init__(self):
+        self.categories = {}
+        self.codes = array("i")
+
+    def append(self, value):
+        if value is None:
+            self.codes.append(-1)
+        else:
+            categories = self.categories
+            self.codes.append(categories.setdefault(value, len(categories)))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def to_categorical(self):
+        return pd.Categorical.from_codes(
+            np.frombuffer(self.codes, dtype=np.int32), categories=list(self.categories)
+        )
+
+
+class ColumnarDocs:
+    """Typed column buffers for the documents returned by the Haystack API.
+
+    Documents are appended one at a time straight from the decoded JSON, so no
+    intermediate per-row dict is kept around:
+    - umap coordinates go to float32 arrays
+    - topic and source are stored as categorical codes
+    - text columns keep a reference to the string decoded by `json.loads`
+    `to_frame` builds the DataFrame from the buffers once the stream is consumed.
+    """
+
+    def __init__(self):
+        self.answer = []
+        self.publishedat = []
+        self.url = []
+        self.image_url = []
+        self.document_id = []
+        self.source = CategoryColumn()
+        self.topic = CategoryColumn()
+        self.umap_embeddings_x = array("f")
+        self.umap_embeddings_y = array("f")
+
+    def __len__(self):
+        return len(self.document_id)
+
+    def append(self, doc):
+        """Append a raw API document. Returns False if the document has no answer"""
+        answer = doc["answer"]
+        if not answer:
+            return False
+        meta = doc["meta"]
+        get = meta.get
+        umap_embeddings = get("umap_embeddings", None) or (np.nan, np.nan)
+        self.answer.append(answer)
+        self.publishedat.append(get("publishedat", None))
+        self.url.append(get("url", None))
+        self.image_url.append(get("urltoimage", None))
+        self.document_id.append(doc["document_id"])
+        self.source.append(get("source", None))
+        self.topic.append(get("topic_label", None))
+        self.umap_embeddings_x.append(umap_embeddings[0])
+        self.umap_embeddings_y.append(umap_embeddings[1])
+        return True
+
+    def append_line(self, line):
+        """Decode a `#SEP#` delimited chunk of the document stream and append it"""
+        return self.append(json.loads(line))
+
+    def to_frame(self):
+        data = {}
+        for column in DOC_COLUMNS:
+            buffer = getattr(self, column)
+            if isinstance(buffer, CategoryColumn):
+                data[column] = buffer.to_categorical()
+            elif isinstance(buffer, array):
+                data[column] = np.frombuffer(buffer, dtype=np.float32)
+            else:
+                data[column] = buffer
+        return pd.DataFrame(data, columns=DOC_COLUMNS)
+
+
+def decode_doc_stream(lines, sample_size=None, log_every=None, logger=None):
+    """Decode a stream of `#SEP#` delimited documents into a DataFrame.
+
+    Stops after `sample_size` documents with an answer have been decoded.
+    """
+    if sample_size is None:
+        sample_size = float("inf")
+
+    docs = ColumnarDocs()
+    if sample_size <= 0:
+        return docs.to_frame()
+    for line in lines:
+        # Filter out keep-alive new lines
+        if line and docs.append_line(line):
+            if logger and log_every and len(docs) % log_every == 0:
+                logger.info(f"Iteration done: {len(docs)}.")
+            # Exit the loop when we reach sample_size
+            if len(docs) >= sample_size:
+                break
+    if logger:
+        logger.info(f"Final iteration number: {len(docs)}")
+    return docs.to_frame()
@@ -0,0 +1,38 @@
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared by every session of the Streamlit process
+executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="fanout")
+# Location of the script run context helpers across Streamlit versions
+SCRIPT_RUN_CTX_MODULES = [
+    "streamlit.scriptrunner",
+    "streamlit.script_run_context",
+    "streamlit.runtime.scriptrunner",
+]
+
+
+def script_run_ctx_wrapper(fn):
+    """Run fn with the Streamlit script context of the calling thread.
+
+    Needed for functions that use Streamlit (e.g. st.cache) from a worker
+    thread; a no-op outside Streamlit.
+    """
+    for module_name in SCRIPT_RUN_CTX_MODULES:
+        try:
+            module = importlib.import_module(module_name)
+            break
+        except ImportError:
+            continue
+    else:
+        return fn
+    add_script_run_ctx = module.add_script_run_ctx
+    ctx = module.get_script_run_ctx()
+    if ctx is None:
+        return fn
+
+    def wrapper(*args, **kwargs):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return fn(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,173 @@
+import gzip
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def make_retry(total, backoff_factor, methods):
+    """urllib3 Retry with backoff on connection errors and 502/503/504"""
+    kwargs = dict(
+        total=total,
+        backoff_factor=backoff_factor,
+        status_forcelist=(502, 503, 504),
+        raise_on_status=False,
+    )
+    try:
+        return Retry(allowed_methods=methods, **kwargs)
+    except TypeError:  # urllib3 < 1.26
+        return Retry(method_whitelist=methods, **kwargs)
+
+
+class LatencyStats:
+    """Latency of the last `window` requests per endpoint, and the bytes of
+    their bodies once decompressed (not the bytes on the wire)"""
+
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(lambda: deque(maxlen=window))
+        self.counts = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.decoded_bytes = defaultdict(int)
+
+    def record(self, endpoint, seconds, error=False):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            self.counts[endpoint] += 1
+            if error:
+                self.errors[endpoint] += 1
+
+    def add_bytes(self, endpoint, num_bytes):
+        with self.lock:
+            self.decoded_bytes[endpoint] += num_bytes
+
+    def summary(self):
+        """Request count, errors, decoded bytes and latency percentiles (ms) per endpoint"""
+        with self.lock:
+            latencies = {k: np.array(v) * 1000 for k, v in self.latencies.items()}
+            counts, errors = dict(self.counts), dict(self.errors)
+            num_bytes = dict(self.decoded_bytes)
+        return {
+            endpoint: {
+                "count": counts[endpoint],
+                "errors": errors.get(endpoint, 0),
+                "decoded_bytes": num_bytes.get(endpoint, 0),
+                "mean_ms": round(float(values.mean()), 1),
+                "p50_ms": round(float(np.percentile(values, 50)), 1),
+                "p95_ms": round(float(np.percentile(values, 95)), 1),
+                "p99_ms": round(float(np.percentile(values, 99)), 1),
+            }
+            for endpoint, values in latencies.items()
+            if len(values)
+        }
+
+
+class StreamedLines:
+    """Lines of a streamed response, their size added to the decoded bytes of
+    the endpoint. close() closes the response, also when the lines were never
+    iterated or only partly"""
+
+    def __init__(self, response, stats, endpoint, delimiter=None):
+        self.response = response
+        self.stats = stats
+        self.endpoint = endpoint
+        self.delimiter = delimiter
+        self.num_bytes = 0
+        self.closed = False
+
+    def __iter__(self):
+        for line in self.response.iter_lines(delimiter=self.delimiter):
+            self.num_bytes += len(line)
+            yield line
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.response.close()
+            self.stats.add_bytes(self.endpoint, self.num_bytes)
+
+
+class ApiClient:
+    """Shared HTTP client for the Haystack API.
+
+    One pooled keep-alive session for every endpoint, with connect/read
+    timeouts, bounded retries with exponential backoff and compressed
+    responses. Endpoints listed in `no_retry` (e.g. feedback) are never
+    retried since they are not idempotent.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        connect_timeout=3.05,
+        read_timeout=60,
+        retries=3,
+        backoff_factor=0.5,
+        pool_size=20,
+        gzip_requests=False,
+        no_retry=(),
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.gzip_requests = gzip_requests
+        self.stats = LatencyStats()
+        self.session = requests.Session()
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        retry = make_retry(retries, backoff_factor, frozenset(["GET", "POST"]))
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # The longest matching prefix wins, so these endpoints skip the retries
+        no_retry_adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=0
+        )
+        for endpoint in no_retry:
+            self.session.mount(self.url(endpoint), no_retry_adapter)
+
+    def url(self, endpoint):
+        return f"{self.base_url}/{endpoint}"
+
+    def request(self, method, endpoint, json_body=None, stream=False):
+        kwargs = {"timeout": self.timeout, "stream": stream}
+        if json_body is not None:
+            if self.gzip_requests:
+                kwargs["data"] = gzip.compress(json.dumps(json_body).encode("utf-8"))
+                kwargs["headers"] = {
+                    "Content-Type": "application/json",
+                    "Content-Encoding": "gzip",
+                }
+            else:
+                kwargs["json"] = json_body
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.url(endpoint), **kwargs)
+            response.raise_for_status()
+        except requests.RequestException:
+            self.stats.record(endpoint, time.perf_counter() - start, error=True)
+            raise
+        # For streamed responses this is the time to the response headers
+        self.stats.record(endpoint, time.perf_counter() - start)
+        if not stream:
+            self.stats.add_bytes(endpoint, len(response.content))
+        return response
+
+    def stream_lines(self, endpoint, json_body=None, delimiter=None):
+        """StreamedLines of a GET request, the request is sent before returning"""
+        response = self.get(endpoint, json_body=json_body, stream=True)
+        return StreamedLines(response, self.stats, endpoint, delimiter=delimiter)
+
+    def get(self, endpoint, json_body=None, stream=False):
+        return self.request("GET", endpoint, json_body=json_body, stream=stream)
+
+    def post(self, endpoint, json_body=None):
+        return self.request("POST", endpoint, json_body=json_body)
+
+    def latency_stats(self):
+        return self.stats.summary()
@@ -0,0 +1,170 @@
+import contextlib
+import functools
+import io
+import json
+import os
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils_http import LatencyStats
+
+
+class Metrics:
+    """Span timers and counters of the page renders.
+
+    Spans keep the latency of their last runs like the API latency stats,
+    and every finished span is appended to a JSONL trace file when one is
+    configured. Gauges registered with `register_gauge` (e.g. the cache
+    stats) are read when the metrics are exported.
+    """
+
+    def __init__(self, prefix="newsintel", trace_file=None):
+        self.prefix = prefix
+        self.trace_file = trace_file
+        self.spans = LatencyStats()
+        self.counters = Counter()
+        self.gauges = {}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, error)
+
+    def timed(self, name):
+        """Decorator running the function in a span"""
+
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def record(self, name, seconds, error=False):
+        self.spans.record(name, seconds, error=error)
+        if self.trace_file:
+            self.trace({"span": name, "seconds": round(seconds, 6), "error": error})
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def trace(self, record):
+        """Append a record to the JSONL trace file"""
+        record = dict(ts=round(time.time(), 3), thread=threading.current_thread().name, **record)
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock:
+            with open(self.trace_file, "a") as f:
+                f.write(line)
+
+    def register_gauge(self, name, fn):
+        """fn returns the current values of the gauge as {label tuple: value}"""
+        self.gauges[name] = fn
+
+    def summary(self):
+        with self.lock:
+            counters = dict(self.counters)
+        return {"spans": self.spans.summary(), "counters": counters}
+
+    def prometheus_text(self):
+        """The metrics in the Prometheus text exposition format"""
+        lines = []
+        name = f"{self.prefix}_span_milliseconds"
+        spans = self.spans.summary()
+        lines.append(f"# TYPE {name} summary")
+        for span, stats in spans.items():
+            for quantile, key in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+                lines.append(f'{name}{{span="{span}",quantile="{quantile}"}} {stats[key]}')
+            lines.append(f'{name}_count{{span="{span}"}} {stats["count"]}')
+        # every metric family after its TYPE line, not interleaved with another
+        lines.append(f"# TYPE {self.prefix}_span_errors_total counter")
+        for span, stats in spans.items():
+            lines.append(f'{self.prefix}_span_errors_total{{span="{span}"}} {stats["errors"]}')
+        with self.lock:
+            counters = dict(self.counters)
+        for counter, value in sorted(counters.items()):
+            lines.append(f"# TYPE {self.prefix}_{counter}_total counter")
+            lines.append(f"{self.prefix}_{counter}_total {value}")
+        for gauge, fn in self.gauges.items():
+            lines.append(f"# TYPE {self.prefix}_{gauge} gauge")
+            for labels, value in fn().items():
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{self.prefix}_{gauge}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Shared by the API client functions and the visualization builders
+metrics = Metrics(trace_file=os.getenv("METRICS_TRACE_FILE"))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = self.server.metrics.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(metrics, port, host="0.0.0.0"):
+    """Expose the metrics on http://host:port/metrics from a daemon thread"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+class RenderProfiler:
+    """Profile of one script run, with pyinstrument when installed, else cProfile"""
+
+    def __init__(self):
+        try:
+            from pyinstrument import Profiler
+
+            self.profiler = Profiler()
+            self.kind = "pyinstrument"
+        except ImportError:
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+            self.kind = "cProfile"
+
+    def start(self):
+        if self.kind == "pyinstrument":
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+        return self
+
+    def stop(self, limit=40):
+        """Stop profiling and return the report as text"""
+        if self.kind == "pyinstrument":
+            self.profiler.stop()
+            return self.profiler.output_text(unicode=True)
+        import pstats
+
+        self.profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
@@ -0,0 +1,333 @@
+import hashlib
+import itertools
+import json
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+from utils_fanout import executor, script_run_ctx_wrapper
+from utils_metrics import metrics
+
+Stage = namedtuple("Stage", ["name", "fn", "inputs", "background", "max_age"])
+# Memoized value of a stage: the key of its inputs, the epoch of the computation
+MemoEntry = namedtuple("MemoEntry", ["inputs_key", "epoch", "value", "computed_at"])
+# Epochs of the computations, unique in the process
+epochs = itertools.count()
+
+
+class Pipeline:
+    """Stages of a page render with declared inputs, memoized on them.
+
+    Inputs are parameters (widget values, set with `set`) or other stages. A
+    stage is keyed on the keys of its inputs, so a value is never hashed: a
+    parameter is keyed on its JSON or on the key given with it, and a stage
+    on a hash of its name, its input keys and the epoch of its computation.
+    The last value of every stage is kept in `memo`, e.g. the Streamlit
+    session state, and a rerun only recomputes the stages downstream of a
+    parameter that changed or of a stage older than its `max_age`: a new
+    computation gets a new epoch, so the keys of its dependents change too.
+
+    Background stages are computed concurrently on the fan-out executor once
+    `start`ed, other stages when their value is first needed.
+    """
+
+    def __init__(self, memo=None, executor=executor):
+        self.memo = memo if memo is not None else {}
+        self.executor = executor
+        self.stages = {}
+        self.params = {}
+        self.keys = {}
+        self.reused = {}
+        self.futures = {}
+        self.computed = []
+        self.lock = threading.RLock()
+
+    def stage(self, name, inputs=(), background=False, max_age=None):
+        """Decorator registering fn(*input values) as a stage.
+        max_age: seconds after which the memoized value is recomputed"""
+
+        def decorator(fn):
+            self.stages[name] = Stage(name, fn, tuple(inputs), background, max_age)
+            return fn
+
+        return decorator
+
+    def set(self, name, value, key=None):
+        """Set a parameter for this run, keyed on key or on its JSON"""
+        if key is None:
+            key = json.dumps(value, sort_keys=True, default=str)
+        self.params[name] = (value, str(key))
+
+    def key(self, name):
+        if name in self.params:
+            return self.params[name][1]
+        if name not in self.stages:
+            raise KeyError(f"{name} is neither a parameter nor a stage")
+        if name not in self.keys:
+            stage = self.stages[name]
+            parts = [name] + [self.key(i) for i in stage.inputs]
+            inputs_key = hashlib.sha1(json.dumps(parts).encode("utf-8")).hexdigest()
+            entry = self.memo.get(name)
+            if (
+                entry is not None
+                and entry.inputs_key == inputs_key
+                and (stage.max_age is None or time.time() - entry.computed_at < stage.max_age)
+            ):
+                self.reused[name] = entry
+                epoch = entry.epoch
+            else:
+                epoch = next(epochs)
+            self.keys[name] = (inputs_key, epoch)
+        inputs_key, epoch = self.keys[name]
+        return f"{inputs_key}:{epoch}"
+
+    def start(self, *names):
+        """Start computing the background stages whose inputs changed"""
+        for name in names:
+            self.future(name)
+
+    def get(self, name):
+        """Value of a parameter or a stage, waiting for it if needed"""
+        if name in self.params:
+            return self.params[name][0]
+        return self.future(name).result()
+
+    def future(self, name):
+        stage = self.stages[name]
+        with self.lock:
+            if name in self.futures:
+                return self.futures[name]
+            self.key(name)
+            future = self.futures[name] = Future()
+        if name in self.reused:
+            metrics.count("stages_reused")
+            future.set_result(self.reused[name].value)
+        elif stage.background:
+            self.executor.submit(script_run_ctx_wrapper(self.compute), stage, future)
+        else:
+            self.compute(stage, future)
+        return future
+
+    def compute(self, stage, future):
+        try:
+            with metrics.span(f"stage_{stage.name}"):
+                value = stage.fn(*[self.get(i) for i in stage.inputs])
+        except Exception as e:
+            future.set_exception(e)
+            return
+        inputs_key, epoch = self.keys[stage.name]
+        self.memo[stage.name] = MemoEntry(inputs_key, epoch, value, time.time())
+        self.computed.append(stage.name)
+        metrics.count("stages_computed")
+        future.set_result(value)
+
+
+def build_filters(filter_date, filter_category, filter_category_exclude, unique_topics):
+    """API filters of the sidebar options and the topics they keep"""
+    filters = []
+    if filter_category:
+        filter_topics = list(map(lambda x: x.lower(), filter_category))
+
+        # If filters should be excluded
+        if filter_category_exclude:
+            filter_topics = list(set(unique_topics).difference(set(filter_topics)))
+
+        # Sort filters
+        filter_topics.sort(key=lambda x: int(x.split("_")[0]))
+
+        filters.append({"terms": {"topic_label": filter_topics}})
+    else:
+        filter_topics = list(unique_topics)
+
+    filters.append(
+        {
+            "range": {
+                "publishedat": {
+                    "gte": filter_date[0].strftime("%Y-%m-%d"),
+                    "lte": filter_date[1].strftime("%Y-%m-%d"),
+                }
+            }
+        }
+    )
+    return filters, filter_topics
+
+
+def page_pipeline(memo=None, batch_size=10000, sampling="stratified", sample_seed=42):
+    """Stages of webapp.py:
+
+    filters -> doc_count -> umap_docs, density -> umap_figure -> umap_overlay
+    umap_docs -> spatial_index + umap_selection -> umap_highlight -> umap_overlay
+    question -> retrieve -> timeline_df -> timeline_figure, date_index -> date_groups
+    date_index + date_groups + selected_date_range -> printed_articles
+    headlines + categories -> headlines_newsmap, timeline_df -> query_newsmap
+
+    Parameters: filter_date, filter_category, filter_category_exclude,
+    unique_topics, top_k_retriever, umap_perc, show_density,
+    umap_selection (see vis_components.spatial.selection_query),
+    num_neighbours, headlines, news_cat_options, question, timeline_freq and
+    selected_date_range. projector_ready is set here.
+    """
+    import numpy as np
+
+    from ui_components.umap_search import hover_data, umap_page
+    from utils import (
+        CACHE_TTL,
+        DENSITY,
+        DOC_REQUEST,
+        DOC_REQUEST_GENERATOR,
+        NUM_DOCS,
+        UMAP_QUERY,
+        corpus_density,
+        doc_count,
+        get_all_docs,
+        query_embedding,
+        query_projector,
+        retrieve_doc,
+        umap_query,
+    )
+    from utils_tree import newsmap_figure
+    from vis_components.spatial import GridIndex, OverlayFigure, highlight_trace
+    from vis_components.timelines import DateIndex, pre_processing_timeline, timeline_plot
+
+    pipeline = Pipeline(memo)
+    stage = pipeline.stage
+
+    stage("filters", ["filter_date", "filter_category", "filter_category_exclude", "unique_topics"])(
+        build_filters
+    )
+
+    @stage("doc_count", ["filters"], background=True, max_age=CACHE_TTL[NUM_DOCS])
+    def count_stage(filters):
+        return doc_count(filters[0])
+
+    @stage(
+        "umap_docs",
+        ["filters", "doc_count", "umap_perc"],
+        background=True,
+        max_age=CACHE_TTL[DOC_REQUEST_GENERATOR],
+    )
+    def umap_docs_stage(filters, doc_num, umap_perc):
+        # Sampling the docs and passing them to the UMAP plot
+        # sample_size = int(umap_perc / 100 * doc_num) #normal size
+        sample_size = int(umap_perc / 500 * doc_num)  # reduced size to increase performance
+        return get_all_docs(
+            filters=filters[0],
+            batch_size=batch_size,
+            sample_size=sample_size,
+            sampling=sampling,
+            sample_seed=sample_seed,
+        )
+
+    @stage("density", ["filters", "show_density"], background=True, max_age=CACHE_TTL[DENSITY])
+    def density_stage(filters, show_density):
+        return corpus_density(filters[0]) if show_density else None
+
+    projector = query_projector()
+    # the query is projected again once the local reducer is loaded
+    pipeline.set("projector_ready", projector is not None and projector.ready)
+    if projector is not None and not projector.has_embedder:
+        # the local reducer projects the query embedding of the search results
+        @stage(
+            "umap_query",
+            ["question", "retrieve", "projector_ready"],
+            background=True,
+            max_age=CACHE_TTL[UMAP_QUERY],
+        )
+        def umap_query_stage(question, retrieved, projector_ready):
+            return umap_query(question, embedding=query_embedding(retrieved[1]))
+
+    else:
+
+        @stage(
+            "umap_query", ["question", "projector_ready"], background=True, max_age=CACHE_TTL[UMAP_QUERY]
+        )
+        def umap_query_stage(question, projector_ready):
+            return umap_query(question)
+
+    @stage("spatial_index", ["umap_docs"])
+    def spatial_index_stage(umap_docs):
+        # built once per loaded sample, clicks and selections only query it
+        return GridIndex(umap_docs["umap_embeddings_x"], umap_docs["umap_embeddings_y"])
+
+    @stage("umap_highlight", ["spatial_index", "umap_selection", "num_neighbours"])
+    def umap_highlight_stage(index, selection, num_neighbours):
+        if selection is None:
+            return None
+        if selection[0] == "knn":
+            return index.knn(selection[1], selection[2], num_neighbours)
+        return index.box(*selection[1:])
+
+    @stage("umap_figure", ["umap_docs", "umap_query", "filters", "density"])
+    def umap_figure_stage(umap_docs, query, filters, density):
+        fig, config = umap_page(
+            documents=umap_docs,
+            query=query,
+            unique_topics=filters[1],
+            density=density,
+        )
+        # serialized once, a click only adds the highlight to the JSON
+        return OverlayFigure(fig), config
+
+    @stage("umap_overlay", ["umap_figure", "umap_docs", "umap_highlight"])
+    def umap_overlay_stage(umap_figure, umap_docs, highlight):
+        figure, config = umap_figure
+        if highlight is None or not len(highlight):
+            return figure, config
+        highlighted = umap_docs.iloc[highlight]
+        trace = highlight_trace(
+            highlighted["umap_embeddings_x"].to_numpy(dtype=np.float32),
+            highlighted["umap_embeddings_y"].to_numpy(dtype=np.float32),
+            hover_data(highlighted).to_numpy(),
+        )
+        return figure.overlay(trace), config
+
+    @stage("retrieve", ["question", "filters", "top_k_retriever"], max_age=CACHE_TTL[DOC_REQUEST])
+    def retrieve_stage(question, filters, top_k_retriever):
+        return retrieve_doc(
+            query=question,
+            filters=filters[0],
+            # top_k_reader=top_k_reader,
+            top_k_reader=100,  # for timeline developing purpose
+            top_k_retriever=top_k_retriever,
+        )
+
+    @stage("timeline_df", ["retrieve"])
+    def timeline_df_stage(retrieved):
+        return pre_processing_timeline(retrieved[0])
+
+    @stage("timeline_figure", ["timeline_df", "timeline_freq"])
+    def timeline_figure_stage(tl_df, timeline_freq):
+        return timeline_plot(tl_df, freq=timeline_freq)
+
+    stage("date_index", ["timeline_df"])(DateIndex)
+
+    @stage("date_groups", ["date_index", "timeline_freq"])
+    def date_groups_stage(date_index, timeline_freq):
+        # by week or month when the timeline is, otherwise by groups of about 15 articles
+        return date_index.buckets(freq=timeline_freq if timeline_freq != "D" else None)
+
+    @stage("printed_articles", ["date_index", "date_groups", "selected_date_range"])
+    def printed_articles_stage(date_index, date_groups, selected_date_range):
+        from_date, to_date = date_groups.iloc[selected_date_range, 1]
+        return date_index.slice(from_date, to_date)
+
+    @stage("headlines_newsmap", ["headlines", "news_cat_options"])
+    def headlines_newsmap_stage(headlines, news_cat_options):
+        return newsmap_figure(
+            headlines.data,
+            filter_list=news_cat_options,
+            fingerprint=("headlines", headlines.version),
+        )
+
+    @stage("query_newsmap", ["timeline_df"])
+    def query_newsmap_stage(tl_df):
+        return newsmap_figure(
+            tl_df,
+            filter_list=tl_df.category.unique(),
+            date_col="date",
+            value_col="relevance",
+            num_articles=20,
+        )
+
+    return pipeline
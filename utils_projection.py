@@ -0,0 +1,117 @@
+import logging
+import re
+import threading
+
+import numpy as np
+
+from utils_cache import ApiCache
+
+# Key of the projections in the cache
+PROJECTION = "projection"
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query):
+    """Cache key of a query: case and whitespace don't change its projection"""
+    return re.sub(r"\s+", " ", query).strip().casefold()
+
+
+class QueryProjector:
+    """2D UMAP coordinates of queries, computed in process.
+
+    reducer_path: fitted UMAP reducer serialized with joblib, or a dict with
+    the reducer under "reducer" and the text embedder under "embedder"
+    embedder: name or path of the sentence-transformers model that embeds the
+    queries like the indexed documents
+    bundled_embedder: whether the file at reducer_path holds an embedder.
+    Without an embedder (in the file or here) only the query embeddings
+    returned by the API can be projected.
+
+    Nothing is loaded until the first projection or `load_async`, and
+    projections don't wait for the load: they return None until it is done.
+    Projections are cached in an LRU keyed by the normalized query text.
+    """
+
+    def __init__(self, reducer_path, embedder=None, bundled_embedder=False, cache=None):
+        self.reducer_path = reducer_path
+        self.embedder_name = embedder
+        self.bundled_embedder = bundled_embedder
+        self.cache = cache if cache is not None else ApiCache(max_bytes=4 * 2 ** 20)
+        self.ttl = float("inf")  # the reducer doesn't change while the process runs
+        self.reducer = None
+        self.embedder = None
+        self.loader = None
+        self.error = None
+        self.lock = threading.Lock()
+
+    @property
+    def has_embedder(self):
+        """Whether queries can be embedded locally, known from the configuration
+        without loading anything"""
+        return self.embedder_name is not None or self.bundled_embedder
+
+    @property
+    def ready(self):
+        """Whether the reducer is loaded and projections are computed"""
+        return self.reducer is not None
+
+    def load(self):
+        with self.lock:
+            if self.reducer is not None:
+                return
+            import joblib
+
+            reducer = joblib.load(self.reducer_path)
+            if isinstance(reducer, dict):
+                self.embedder = reducer.get("embedder")
+                reducer = reducer["reducer"]
+            if self.bundled_embedder and self.embedder is None:
+                logger.warning(f"No embedder in {self.reducer_path}, queries need an API embedding.")
+            if self.embedder is None and self.embedder_name is not None:
+                from sentence_transformers import SentenceTransformer
+
+                self.embedder = SentenceTransformer(self.embedder_name)
+            self.reducer = reducer
+
+    def load_async(self):
+        """Load the reducer and the embedder from a daemon thread, once"""
+
+        def run():
+            try:
+                self.load()
+            except Exception as e:
+                logger.warning(f"Could not load the UMAP reducer {self.reducer_path}: {e}")
+                self.error = e
+
+        with self.lock:
+            if self.loader is None:
+                self.loader = threading.Thread(target=run, name="umap-reducer", daemon=True)
+                self.loader.start()
+        return self
+
+    def embed(self, query):
+        return self.embedder.encode([query])
+
+    def project(self, query, embedding=None):
+        """umap-query response of the query: its text and its 2D coordinates,
+        None while the reducer is loading (raises the error if loading failed).
+        embedding: query embedding returned by the API, embedded locally when None"""
+        key = normalize_query(query)
+        hit, value = self.cache.get(PROJECTION, key)
+        if hit:
+            return {"query_text": query, "query_umap": value}
+        if self.reducer is None:
+            if self.error is not None:
+                raise self.error
+            self.load_async()
+            return None
+        if embedding is None:
+            if self.embedder is None:
+                raise ValueError("No query embedding and no embedder to compute it")
+            embedding = self.embed(query)
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        point = self.reducer.transform(embedding)[0]
+        value = (float(point[0]), float(point[1]))
+        self.cache.put(PROJECTION, key, value, ttl=self.ttl)
+        return {"query_text": query, "query_umap": value}
@@ -0,0 +1,216 @@
+import json
+import random
+import re
+
+import numpy as np
+
+# Cheap extraction of the topic label from a raw stream chunk, so stratified
+# sampling doesn't have to decode the article bodies of the skipped documents
+TOPIC_LABEL_RE = re.compile(rb'"topic_label"\s*:\s*"((?:[^"\\]|\\.)*)"')
+# Chunks that may have an empty answer, confirmed by decoding them
+EMPTY_ANSWER_RE = re.compile(rb'"answer"\s*:\s*(?:null|"")')
+
+
+def topic_label(line):
+    """Return the topic_label of a raw `#SEP#` chunk (None if it has none)"""
+    match = TOPIC_LABEL_RE.search(line)
+    if match:
+        return json.loads(b'"' + match.group(1) + b'"')
+    return json.loads(line)["meta"].get("topic_label", None)
+
+
+def has_answer(line):
+    """Whether a raw `#SEP#` chunk has a non empty answer (the decoder drops the others)"""
+    if not line:
+        return False
+    if EMPTY_ANSWER_RE.search(line) is None:
+        return True
+    return bool(json.loads(line)["answer"])
+
+
+def allocate(counts, size, min_per_stratum=1):
+    """Split a sample of `size` items over strata with the given counts.
+
+    Allocation is proportional to the stratum sizes, with at least
+    `min_per_stratum` items per stratum so small strata stay visible.
+    """
+    total = sum(counts.values())
+    if total <= size:
+        return dict(counts)
+    # Guarantee a minimum per stratum, then split the rest proportionally
+    floor = min(min_per_stratum, size // len(counts))
+    if floor == 0:
+        # More strata than sample slots: keep the largest strata
+        keys = set(sorted(counts, key=counts.get, reverse=True)[:size])
+        return {key: int(key in keys) for key in counts}
+    alloc = {key: min(n, floor) for key, n in counts.items()}
+    remaining = size - sum(alloc.values())
+    left = {key: counts[key] - alloc[key] for key in counts}
+    left_total = sum(left.values())
+    shares = {key: remaining * n / left_total for key, n in left.items()}
+    for key, share in shares.items():
+        alloc[key] += int(share)
+    # Largest remainder for the slots lost to rounding
+    missing = size - sum(alloc.values())
+    by_remainder = sorted(shares, key=lambda k: shares[k] - int(shares[k]), reverse=True)
+    for key in by_remainder:
+        if missing <= 0:
+            break
+        if alloc[key] < counts[key]:
+            alloc[key] += 1
+            missing -= 1
+    return alloc
+
+
+class ReservoirSampler:
+    """Single-pass uniform sample of `size` items from a stream (Algorithm R)"""
+
+    def __init__(self, size, seed=None):
+        self.size = size
+        self.rng = random.Random(seed)
+        self.seen = 0
+        self.reservoir = []
+
+    def offer(self, item):
+        if len(self.reservoir) < self.size:
+            self.reservoir.append((self.seen, item))
+        else:
+            j = self.rng.randrange(self.seen + 1)
+            if j < self.size:
+                self.reservoir[j] = (self.seen, item)
+        self.seen += 1
+
+    def sample(self):
+        """Sampled items in stream order"""
+        return [item for _, item in sorted(self.reservoir, key=lambda x: x[0])]
+
+
+class StratifiedSampler:
+    """Single-pass sample of `size` items stratified by a key, in bounded memory.
+
+    Every item gets a random priority and every stratum keeps the items of
+    priority below its threshold, a uniform sample of the stratum. A stratum
+    holding more than its proportional share of `size` (plus `margin`) is
+    cut to its share by lowering its threshold, so at most about
+    (1 + margin) * size items are kept whatever the number of strata. Once
+    the stream is consumed the sample is split between strata with
+    `allocate`, and the slots of a stratum that was cut below its final
+    allocation go to the other strata.
+    """
+
+    def __init__(self, size, min_per_stratum=1, seed=None, margin=0.25):
+        self.size = size
+        self.min_per_stratum = min_per_stratum
+        self.margin = margin
+        self.rng = random.Random(seed)
+        self.seen = 0
+        self.counts = {}
+        self.strata = {}  # key -> [(priority, position, item)]
+        self.thresholds = {}
+
+    def cap(self, key):
+        """Items kept for a stratum: its share of the stream so far, plus the margin"""
+        share = self.size * self.counts[key] / max(self.seen, 1)
+        return self.min_per_stratum + int(share * (1 + self.margin)) + 1
+
+    def cut(self, key, cap):
+        kept = sorted(self.strata[key], key=lambda x: x[0])
+        self.thresholds[key] = kept[cap][0]
+        self.strata[key] = kept[:cap]
+
+    def offer(self, key, item):
+        if key not in self.strata:
+            self.strata[key], self.counts[key], self.thresholds[key] = [], 0, 1.0
+        self.counts[key] += 1
+        self.seen += 1
+        priority = self.rng.random()
+        if priority < self.thresholds[key]:
+            kept = self.strata[key]
+            kept.append((priority, self.seen, item))
+            cap = self.cap(key)
+            # cut with some slack so the sort is amortized over many offers
+            if len(kept) > cap + cap // 4 + 1:
+                self.cut(key, cap)
+        if self.seen % max(self.size, 1) == 0:
+            # strata that stopped receiving items shrink with their share
+            for other, kept in self.strata.items():
+                cap = self.cap(other)
+                if len(kept) > cap:
+                    self.cut(other, cap)
+
+    def allocation(self):
+        """Number of items drawn from each stratum"""
+        alloc = allocate(self.counts, self.size, self.min_per_stratum)
+        drawn = {key: min(n, len(self.strata[key])) for key, n in alloc.items()}
+        missing = sum(alloc.values()) - sum(drawn.values())
+        for key in sorted(drawn, key=self.counts.get, reverse=True):
+            if missing <= 0:
+                break
+            extra = min(len(self.strata[key]) - drawn[key], missing)
+            drawn[key] += extra
+            missing -= extra
+        return drawn
+
+    def sample(self):
+        """Sampled items in stream order"""
+        selected = []
+        for key, n in self.allocation().items():
+            selected.extend(sorted(self.strata[key], key=lambda x: x[0])[:n])
+        return [item for _, _, item in sorted(selected, key=lambda x: x[1])]
+
+
+def sample_stream(lines, sample_size, method="reservoir", seed=None, min_per_topic=1):
+    """Sample raw `#SEP#` chunks of the document stream in a single pass.
+
+    method:
+    - "head": the first `sample_size` chunks, stops reading the stream early
+    - "reservoir": uniform sample over the whole stream
+    - "stratified": sample stratified by topic_label
+    Chunks without an answer are dropped before sampling, so the sample has
+    sample_size documents when the stream has enough of them. Only the
+    sampled chunks need to be decoded afterwards.
+    """
+    if method == "head":
+        return lines
+    if sample_size <= 0:
+        # nothing to keep, don't read the stream
+        return []
+    if method == "reservoir":
+        sampler = ReservoirSampler(sample_size, seed=seed)
+        for line in lines:
+            # Filter out keep-alive new lines and documents without an answer
+            if has_answer(line):
+                sampler.offer(line)
+    elif method == "stratified":
+        sampler = StratifiedSampler(sample_size, min_per_stratum=min_per_topic, seed=seed)
+        for line in lines:
+            if has_answer(line):
+                sampler.offer(topic_label(line), line)
+    else:
+        raise ValueError(f"Unknown sampling method: {method}")
+    return sampler.sample()
+
+
+def sample_indices(codes, sample_size, method="reservoir", seed=None, min_per_topic=1):
+    """Sample row positions of an in-memory corpus given its topic codes.
+
+    Same methods as `sample_stream`, vectorized over the code array.
+    """
+    n = len(codes)
+    if sample_size is None or sample_size >= n:
+        return np.arange(n)
+    if method == "head":
+        return np.arange(sample_size)
+    rng = np.random.default_rng(seed)
+    if method == "reservoir":
+        return np.sort(rng.choice(n, sample_size, replace=False))
+    if method != "stratified":
+        raise ValueError(f"Unknown sampling method: {method}")
+    order = np.argsort(codes, kind="stable")
+    topics, starts, counts = np.unique(codes[order], return_index=True, return_counts=True)
+    alloc = allocate(dict(zip(topics.tolist(), counts.tolist())), sample_size, min_per_topic)
+    picks = [
+        rng.choice(order[start : start + count], alloc[topic], replace=False)
+        for topic, start, count in zip(topics.tolist(), starts, counts)
+    ]
+    return np.sort(np.concatenate(picks)) if picks else np.arange(0)
@@ -0,0 +1,518 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+from utils_columnar import DOC_COLUMNS, ColumnarDocs
+from utils_sampling import sample_indices
+
+logger = logging.getLogger(__name__)
+
+STRING_COLUMNS = ["answer", "publishedat", "url", "image_url", "document_id"]
+CATEGORY_COLUMNS = ["source", "topic"]
+FLOAT_COLUMNS = ["umap_embeddings_x", "umap_embeddings_y"]
+META_FILE = "meta.json"
+STORE_VERSION = 2
+# Segments written before the store is compacted into one
+MAX_SEGMENTS = 8
+# Memory-mapped columns of a segment, its mask of live rows (None if all are)
+# and its first row in the store
+Segment = namedtuple("Segment", ["columns", "live", "start"])
+# Segments and meta.json of one version of the store
+StoreState = namedtuple("StoreState", ["segments", "meta"])
+
+
+def to_datetime64(values):
+    """Parse publishedat strings to naive UTC datetime64[s] (NaT if missing)"""
+    parsed = pd.to_datetime(pd.Series(values, dtype=object), utc=True, errors="coerce")
+    return parsed.dt.tz_convert(None).values.astype("datetime64[s]")
+
+
+def encode_strings(values):
+    """Pack strings into one utf-8 buffer plus offsets and a mask of None values"""
+    encoded = [b"" if v is None else v.encode("utf-8") for v in values]
+    lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded))
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    nulls = np.fromiter((v is None for v in values), dtype=bool, count=len(values))
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return data, offsets, nulls
+
+
+def decode_strings(data, offsets, nulls, rows):
+    """Decode the strings at `rows` from a packed buffer"""
+    starts = offsets[rows].tolist()
+    ends = offsets[rows + 1].tolist()
+    # Copy the whole buffer once if we read a large part of it anyway
+    buffer = data.tobytes() if len(rows) > len(nulls) // 4 else data
+    values = [
+        bytes(buffer[start:end]).decode("utf-8") for start, end in zip(starts, ends)
+    ]
+    for i in np.flatnonzero(nulls[rows]).tolist():
+        values[i] = None
+    return values
+
+
+def hash_ids(values):
+    """uint64 hashes of document ids, to find replaced documents without decoding"""
+    return pd.util.hash_array(np.asarray(values, dtype=object))
+
+
+def link_tree(src, dst):
+    """Hard link the files of src into dst (copies where links aren't supported)"""
+    os.makedirs(dst)
+    for name in os.listdir(src):
+        try:
+            os.link(os.path.join(src, name), os.path.join(dst, name))
+        except OSError:
+            shutil.copy2(os.path.join(src, name), os.path.join(dst, name))
+
+
+def write_segment(path, docs, categories):
+    """Write docs as the column files of a segment directory.
+
+    categories: categories of the store per category column, extended with
+    the new values (existing codes stay valid). Returns the extended ones.
+    """
+    os.makedirs(path)
+    categories = dict(categories)
+    for column in CATEGORY_COLUMNS:
+        known = categories.get(column, [])
+        values = docs[column].astype(object)
+        new = sorted(set(values.dropna()) - set(known))
+        categories[column] = known + new
+        codes = pd.Categorical(values, categories=categories[column]).codes
+        np.save(os.path.join(path, f"{column}.npy"), codes.astype(np.int32))
+    for column in FLOAT_COLUMNS:
+        np.save(
+            os.path.join(path, f"{column}.npy"),
+            docs[column].to_numpy(dtype=np.float32, na_value=np.nan),
+        )
+    for column in STRING_COLUMNS:
+        data, offsets, nulls = encode_strings(docs[column].tolist())
+        np.save(os.path.join(path, f"{column}.data.npy"), data)
+        np.save(os.path.join(path, f"{column}.offsets.npy"), offsets)
+        np.save(os.path.join(path, f"{column}.nulls.npy"), nulls)
+    np.save(os.path.join(path, "document_id.hash.npy"), hash_ids(docs["document_id"]))
+    np.save(os.path.join(path, "publishedat_ts.npy"), to_datetime64(docs["publishedat"].tolist()))
+    return categories
+
+
+def max_date(*values):
+    """Latest of datetime strings in the store format, None if all are None"""
+    values = [v for v in values if v is not None]
+    return max(values) if values else None
+
+
+def date_bound(value, inclusive_end):
+    """Convert a range filter value to datetime64.
+
+    Date-only upper bounds are extended to the end of the day, like the
+    missing date components of an Elasticsearch range query.
+    """
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert(None)
+    bound = np.datetime64(timestamp.to_datetime64(), "s")
+    if inclusive_end and len(str(value)) == 10:
+        bound += np.timedelta64(1, "D") - np.timedelta64(1, "s")
+    return bound
+
+
+class CorpusStore:
+    """Local, memory-mapped copy of the document corpus.
+
+    A version of the store is a directory next to `path`, and `path` is a
+    symlink to the current version. A version holds segments, each a
+    directory with every column as a NumPy `.npy` file:
+    - float32 umap coordinates
+    - int32 codes for topic and source (categories in meta.json)
+    - datetime64 publishedat for range filters
+    - string columns as one utf-8 buffer plus offsets
+    - uint64 hashes of the document ids
+    Documents are keyed by document_id. `refresh` only fetches documents
+    published after the stored maximum and appends them as a new segment:
+    the older segments are hard linked into the new version, and the rows
+    replaced by a new document are masked out (`<segment>.live.npy`). After
+    MAX_SEGMENTS segments the store is compacted into one. `select`
+    answers the topic and date filters built in webapp.py with vectorized
+    masks. Rows are numbered across the segments, masked rows included.
+
+    The segments and meta of a version are published together as one
+    StoreState, and every query reads `state` once, so a refresh never
+    mixes two versions in one answer.
+    """
+
+    def __init__(self, path, refresh_interval=600):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.refresher = None
+        self.state = None
+        self.load()
+
+    def __len__(self):
+        state = self.state
+        return 0 if state is None else state.meta["num_docs"]
+
+    @property
+    def meta(self):
+        return None if self.state is None else self.state.meta
+
+    @property
+    def max_publishedat(self):
+        state = self.state
+        return None if state is None else state.meta["max_publishedat"]
+
+    @property
+    def refreshed_at(self):
+        state = self.state
+        return 0.0 if state is None else state.meta["refreshed_at"]
+
+    def load(self):
+        """Memory-map the stored columns (no-op if the store is empty)"""
+        # resolve the symlink once, a write may swap it while we read
+        path = os.path.realpath(self.path)
+        meta_path = os.path.join(path, META_FILE)
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("version") != STORE_VERSION:
+            logger.info(f"Ignoring corpus store with version {meta.get('version')}.")
+            return
+        segments = []
+        start = 0
+        for info in meta["segments"]:
+            segment_path = os.path.join(path, info["name"])
+            columns = {
+                name[: -len(".npy")]: np.load(os.path.join(segment_path, name), mmap_mode="r")
+                for name in os.listdir(segment_path)
+                if name.endswith(".npy")
+            }
+            live = None
+            if info["num_live"] < info["num_rows"]:
+                live = np.load(os.path.join(path, f"{info['name']}.live.npy"), mmap_mode="r")
+            segments.append(Segment(columns, live, start))
+            start += info["num_rows"]
+        self.state = StoreState(segments, meta)
+
+    def is_stale(self):
+        return self.state is None or time.time() - self.refreshed_at > self.refresh_interval
+
+    def refresh(self, fetch_lines, force=False):
+        """Fetch documents newer than the stored max publishedat.
+
+        fetch_lines: callable taking Haystack filters and returning a
+        generator of the raw `#SEP#` chunks of the all-docs-generator stream,
+        closed once read.
+        """
+        with self.lock:
+            if not force and not self.is_stale():
+                return 0
+            filters = None
+            if self.max_publishedat is not None:
+                # gte and not gt: documents published in the same second as the
+                # stored maximum are deduplicated by document_id when appended
+                filters = [{"range": {"publishedat": {"gte": self.max_publishedat}}}]
+            docs = ColumnarDocs()
+            with closing(fetch_lines(filters)) as lines:
+                for line in lines:
+                    # Filter out keep-alive new lines
+                    if line:
+                        docs.append_line(line)
+            logger.info(f"Fetched {len(docs)} documents since {self.max_publishedat}.")
+            if self.state is None:
+                self.write(docs.to_frame())
+                self.load()
+            elif len(docs):
+                self.append(docs.to_frame())
+                self.load()
+            else:
+                self.touch()
+            return len(docs)
+
+    def refresh_async(self, fetch_lines):
+        """Refresh from a daemon thread, the current version is served meanwhile"""
+
+        def run():
+            try:
+                self.refresh(fetch_lines)
+            except Exception:
+                logger.exception("Corpus store refresh failed, keeping the current version")
+
+        with self.lock:
+            if self.refresher is None or not self.refresher.is_alive():
+                self.refresher = threading.Thread(target=run, name="corpus-refresh", daemon=True)
+                self.refresher.start()
+        return self.refresher
+
+    def touch(self):
+        """Mark the store as refreshed without rewriting the columns"""
+        state = self.state
+        meta = dict(state.meta, refreshed_at=time.time())
+        path = os.path.realpath(self.path)
+        tmp_path = os.path.join(path, META_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(path, META_FILE))
+        self.state = StoreState(state.segments, meta)
+
+    def merge(self, new_docs):
+        """Stored documents updated with new_docs, deduplicated by document_id"""
+        state = self.state
+        if state is None:
+            return new_docs
+        as_object = {c: object for c in CATEGORY_COLUMNS}
+        old_docs = self.frame(np.flatnonzero(self.live(state)), state).astype(as_object)
+        merged = pd.concat([old_docs, new_docs.astype(as_object)], ignore_index=True)
+        return merged[~merged["document_id"].duplicated(keep="last")].reset_index(drop=True)
+
+    def versions(self):
+        """Version directories of the store, oldest first"""
+        parent, base = os.path.split(os.path.abspath(self.path))
+        prefix = base + ".v"
+        names = [n for n in os.listdir(parent) if n.startswith(prefix) and n[len(prefix):].isdigit()]
+        names.sort(key=lambda n: int(n[len(prefix):]))
+        return [os.path.join(parent, n) for n in names]
+
+    def number(self, tmp_path):
+        """Rename a written version directory to the next free version number.
+        Another writer may take a number first: renaming a directory onto a
+        non-empty one fails, and the next number is tried."""
+        while True:
+            versions = self.versions()
+            number = int(versions[-1].rsplit(".v", 1)[1]) + 1 if versions else 0
+            version_path = f"{os.path.abspath(self.path)}.v{number}"
+            try:
+                os.rename(tmp_path, version_path)
+                return version_path
+            except OSError:
+                if not os.path.exists(version_path):
+                    raise
+
+    def new_version(self):
+        """Directory to write a version in, under a unique name until published"""
+        parent, base = os.path.split(os.path.abspath(self.path))
+        os.makedirs(parent, exist_ok=True)
+        return tempfile.mkdtemp(prefix=f"{base}.tmp", dir=parent)
+
+    def publish(self, version_path, meta):
+        """Write meta.json and switch `path` to the version atomically"""
+        with open(os.path.join(version_path, META_FILE), "w") as f:
+            json.dump(meta, f)
+        version_path = self.number(version_path)
+        number = version_path.rsplit(".v", 1)[1]
+        if os.path.isdir(self.path) and not os.path.islink(self.path):
+            # store written before the version directories: a directory can't
+            # be replaced by a symlink atomically, move it aside once
+            os.replace(self.path, f"{os.path.abspath(self.path)}.v{number}-old")
+        # Replacing the symlink is atomic, readers see the old or the new version
+        link_path = f"{os.path.abspath(self.path)}.link{number}"
+        os.symlink(os.path.basename(version_path), link_path)
+        os.replace(link_path, self.path)
+        shutil.rmtree(f"{os.path.abspath(self.path)}.v{number}-old", ignore_errors=True)
+        # Keep the current version, the one before it for readers still
+        # loading it, and the ones other writers may be switching to
+        versions = self.versions()
+        current = os.path.realpath(self.path)
+        if current in versions:
+            for old_path in versions[: max(versions.index(current) - 1, 0)]:
+                shutil.rmtree(old_path, ignore_errors=True)
+
+    def write(self, docs):
+        """Write docs as a new version of one segment (replacing the stored ones)"""
+        version_path = self.new_version()
+        categories = write_segment(os.path.join(version_path, "s0"), docs, {})
+        valid = to_datetime64(docs["publishedat"].tolist())
+        valid = valid[~np.isnat(valid)]
+        self.publish(
+            version_path,
+            {
+                "version": STORE_VERSION,
+                "num_docs": len(docs),
+                "num_rows": len(docs),
+                "max_publishedat": str(valid.max()) if len(valid) else None,
+                "categories": categories,
+                "segments": [{"name": "s0", "num_rows": len(docs), "num_live": len(docs)}],
+                "refreshed_at": time.time(),
+            },
+        )
+
+    def append(self, docs):
+        """Write a new version with docs appended as a segment.
+
+        The stored segments are hard linked, not rewritten: only the new
+        documents are encoded, and the stored documents they replace (same
+        document_id) are masked out. Compacts into one segment instead once
+        there are MAX_SEGMENTS.
+        """
+        state = self.state
+        if len(state.segments) >= MAX_SEGMENTS:
+            self.write(self.merge(docs))
+            return
+        docs = docs[~docs["document_id"].duplicated(keep="last")].reset_index(drop=True)
+        new_hashes = hash_ids(docs["document_id"])
+        current = os.path.realpath(self.path)
+        version_path = self.new_version()
+        segments = []
+        for info, segment in zip(state.meta["segments"], state.segments):
+            link_tree(os.path.join(current, info["name"]), os.path.join(version_path, info["name"]))
+            live = ~np.isin(segment.columns["document_id.hash"], new_hashes)
+            if segment.live is not None:
+                live &= segment.live
+            num_live = int(live.sum())
+            if num_live < info["num_rows"]:
+                np.save(os.path.join(version_path, f"{info['name']}.live.npy"), live)
+            segments.append(dict(info, num_live=num_live))
+        name = f"s{max(int(info['name'][1:]) for info in segments) + 1}"
+        categories = write_segment(os.path.join(version_path, name), docs, state.meta["categories"])
+        segments.append({"name": name, "num_rows": len(docs), "num_live": len(docs)})
+        valid = to_datetime64(docs["publishedat"].tolist())
+        valid = valid[~np.isnat(valid)]
+        self.publish(
+            version_path,
+            {
+                "version": STORE_VERSION,
+                "num_docs": sum(info["num_live"] for info in segments),
+                "num_rows": sum(info["num_rows"] for info in segments),
+                "max_publishedat": max_date(
+                    state.meta["max_publishedat"], str(valid.max()) if len(valid) else None
+                ),
+                "categories": categories,
+                "segments": segments,
+                "refreshed_at": time.time(),
+            },
+        )
+
+    def live(self, state=None):
+        """Mask of the rows that weren't replaced by a newer document"""
+        segments, meta = state or self.state
+        return np.concatenate(
+            [
+                np.ones(info["num_rows"], dtype=bool) if segment.live is None else segment.live
+                for info, segment in zip(meta["segments"], segments)
+            ]
+        )
+
+    def column(self, name, state=None):
+        """A column of every row, as one array"""
+        segments, _ = state or self.state
+        if len(segments) == 1:
+            return segments[0].columns[name]
+        return np.concatenate([segment.columns[name] for segment in segments])
+
+    def __by_segment(self, segments, rows):
+        """(segment, positions in rows, rows in the segment) of the segments holding rows"""
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = np.array([segment.start for segment in segments])
+        which = np.searchsorted(starts, rows, side="right") - 1
+        for i, segment in enumerate(segments):
+            pos = np.flatnonzero(which == i)
+            if len(pos):
+                yield segment, pos, rows[pos] - segment.start
+
+    def gather(self, name, rows, state=None):
+        """Values of a numeric column at rows"""
+        segments, _ = state or self.state
+        if len(segments) == 1:
+            return np.asarray(segments[0].columns[name][rows])
+        values = np.empty(len(rows), dtype=segments[0].columns[name].dtype)
+        for segment, pos, local in self.__by_segment(segments, rows):
+            values[pos] = segment.columns[name][local]
+        return values
+
+    def __strings(self, column, rows, segments):
+        values = np.empty(len(rows), dtype=object)
+        for segment, pos, local in self.__by_segment(segments, rows):
+            columns = segment.columns
+            values[pos] = decode_strings(
+                columns[f"{column}.data"],
+                columns[f"{column}.offsets"],
+                columns[f"{column}.nulls"],
+                local,
+            )
+        return values.tolist()
+
+    def mask(self, filters=None, state=None):
+        """Boolean mask of the live documents matching Haystack `terms`/`range` filters"""
+        state = state or self.state
+        meta = state.meta
+        mask = self.live(state)
+        for f in filters or []:
+            if "terms" in f:
+                for field, values in f["terms"].items():
+                    column = {"topic_label": "topic", "source": "source"}.get(field)
+                    if column is None:
+                        raise ValueError(f"Unsupported terms filter on {field}")
+                    categories = meta["categories"][column]
+                    lookup = {c: i for i, c in enumerate(categories)}
+                    codes = [lookup[v] for v in values if v in lookup]
+                    mask &= np.isin(self.column(column, state), codes)
+            elif "range" in f:
+                for field, bounds in f["range"].items():
+                    if field != "publishedat":
+                        raise ValueError(f"Unsupported range filter on {field}")
+                    dates = self.column("publishedat_ts", state)
+                    for op, value in bounds.items():
+                        bound = date_bound(value, inclusive_end=op in ("lte", "gt"))
+                        if op == "gte":
+                            mask &= dates >= bound
+                        elif op == "gt":
+                            mask &= dates > bound
+                        elif op == "lte":
+                            mask &= dates <= bound
+                        elif op == "lt":
+                            mask &= dates < bound
+                        else:
+                            raise ValueError(f"Unsupported range operator {op}")
+            else:
+                raise ValueError(f"Unsupported filter {f}")
+        return mask
+
+    def frame(self, rows, state=None):
+        """Materialize the documents at `rows` as a DataFrame"""
+        state = state or self.state
+        data = {}
+        for column in DOC_COLUMNS:
+            if column in CATEGORY_COLUMNS:
+                data[column] = pd.Categorical.from_codes(
+                    self.gather(column, rows, state), categories=state.meta["categories"][column]
+                )
+            elif column in FLOAT_COLUMNS:
+                data[column] = self.gather(column, rows, state)
+            else:
+                data[column] = self.__strings(column, rows, state.segments)
+        return pd.DataFrame(data, columns=DOC_COLUMNS)
+
+    def embeddings(self, filters=None):
+        """umap coordinates and topic codes of the documents matching filters,
+        without decoding the string columns"""
+        state = self.state
+        rows = np.flatnonzero(self.mask(filters, state))
+        return (
+            self.gather("umap_embeddings_x", rows, state),
+            self.gather("umap_embeddings_y", rows, state),
+            self.gather("topic", rows, state),
+            state.meta["categories"]["topic"],
+        )
+
+    def count(self, filters=None):
+        return int(self.mask(filters).sum())
+
+    def select(self, filters=None, sample_size=None, sampling="head", sample_seed=None):
+        """Documents matching filters, sampled like `utils.get_all_docs`"""
+        state = self.state
+        rows = np.flatnonzero(self.mask(filters, state))
+        sample = sample_indices(
+            self.gather("topic", rows, state), sample_size, method=sampling, seed=sample_seed
+        )
+        return self.frame(rows[sample], state)
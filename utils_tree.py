@@ -1,19 +1,32 @@
 
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 import textwrap
-from newsapi import NewsApiClient
+from collections import namedtuple
 from googleNews import GoogleNews
 from pandas import json_normalize
 from time import mktime
+from utils_cache import ApiCache
+from utils_metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 @st.cache
 def fetch_data_newsapi(api_key, categories):
+    from newsapi import NewsApiClient  # only needed for the NewsAPI source
     # genrate NewsApiClient
     newsapi = NewsApiClient(api_key=api_key)
     cols = ['source', 'author', 'title', 'description', 'url', 'urlToImage', 'publishedAt', 'content', 'category']
-    final_data_frame = pd.DataFrame(columns=cols)
+    data_frames = []
     for category in categories:
         top_headlines = newsapi.get_top_headlines(q=None,
                                             category=category,
@@ -23,16 +36,30 @@ def fetch_data_newsapi(api_key, categories):
         # add category to title
         data_frame['title'] = data_frame['title'] + ' | ' + category
         data_frame['category'] = category
-        final_data_frame =final_data_frame.append(data_frame)
-    return final_data_frame
+        data_frames.append(data_frame)
+    if not data_frames:
+        return pd.DataFrame(columns=cols)
+    return pd.concat(data_frames)
+
+GGNEWS_TOPICS = ['sports', 'health', 'technology', 'science', 'entertainment','business', 'world']
+# Headlines shown until the first background refresh completes
+SEED_HEADLINES = os.path.join(os.path.dirname(__file__), 'data', 'top_headlines.csv')
 
 @st.cache
-def fetch_data_ggnews(topics = ['sports', 'health', 'technology', 'science', 'entertainment','business', 'world']):
-    news = GoogleNews()
-    cols = ['title', 'link', 'published', 'publishedAt', 'category']
-    final_data_frame = pd.DataFrame(columns=cols)
+def fetch_data_ggnews(topics = GGNEWS_TOPICS):
+    return load_data_ggnews(topics)
+
+@metrics.timed('fetch_data_ggnews')
+def load_data_ggnews(topics = GGNEWS_TOPICS, news = None):
+    """Fetch the headlines of the Google News topics (not cached)"""
+    news = news or GoogleNews()
+    cols = ['title', 'url', 'published', 'publishedAt', 'category']
+    # fetch all topics concurrently, unchanged feeds are served from cache
+    # sub_articles are not used by the treemap, skip parsing the summaries
+    results = news.topics_headlines(topics, sub_articles=False)
+    data_frames = []
     for topic in topics:
-        result = news.topic_headlines(topic)
+        result = results[topic]
         df = json_normalize(result['entries'])
         df = df[['title','link','published','published_parsed']]
         df['title'] = df['title'] + ' | ' + topic
@@ -40,13 +67,105 @@ def fetch_data_ggnews(topics = ['sports', 'health', 'technology', 'science', 'en
         df['published_parsed']=df['published_parsed'].map(mktime)
         df.rename(columns={'published_parsed':'publishedAt'},inplace=True)
         df.rename(columns={'link':'url'},inplace=True)
-        final_data_frame =final_data_frame.append(df)
-    return final_data_frame
+        data_frames.append(df[cols])
+    if not data_frames:
+        return pd.DataFrame(columns=cols)
+    return pd.concat(data_frames)
+
+# version 0 is the seed file, fetched_at then is the time of its newest headline
+HeadlineSnapshot = namedtuple('HeadlineSnapshot', ['data', 'fetched_at', 'version'])
+
+class HeadlineRefresher():
+    def __init__(self, interval=300, topics=GGNEWS_TOPICS, seed_path=SEED_HEADLINES):
+        """
+        Refresh the Google News headlines in a background thread every `interval` seconds
+        into a shared snapshot, so page renders never wait on the feeds and the feeds are
+        fetched once per interval whatever the number of sessions.
+        """
+        self.interval = interval
+        self.topics = topics
+        # revalidate the feeds on every refresh (conditional GETs)
+        self.news = GoogleNews(cache_ttl=0)
+        self.lock = threading.Lock()
+        self.thread = None
+        if os.path.exists(seed_path):
+            data = pd.read_csv(seed_path, index_col=0)
+            # the seed is as old as its most recent headline
+            seed_time = float(data['publishedAt'].max())
+        else:
+            data, seed_time = pd.DataFrame(columns=['title', 'url', 'published', 'publishedAt', 'category']), 0.0
+        self._snapshot = HeadlineSnapshot(data, seed_time, 0)
+        self._fingerprint = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.__run, name='headline-refresher', daemon=True)
+                self.thread.start()
+        return self
+
+    def refresh(self):
+        """Fetch the feeds, the version only changes when the headlines did (not when every feed
+        answered 304), so the treemap built for the previous version stays valid"""
+        data = load_data_ggnews(self.topics, news=self.news)
+        fingerprint = frame_fingerprint(data)
+        with self.lock:
+            if self._snapshot.version > 0 and fingerprint == self._fingerprint:
+                self._snapshot = self._snapshot._replace(fetched_at=time.time())
+            else:
+                self._snapshot = HeadlineSnapshot(data, time.time(), self._snapshot.version + 1)
+                self._fingerprint = fingerprint
+
+    def __run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('Headline refresh failed, keeping the previous snapshot')
+            time.sleep(self.interval)
+
+    def snapshot(self):
+        """Latest headlines, never blocks on the network"""
+        with self.lock:
+            return self._snapshot
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+def headline_refresher(interval=int(os.getenv('HEADLINE_REFRESH_SECONDS', 300))):
+    """The HeadlineRefresher of the process, started on first use"""
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = HeadlineRefresher(interval=interval).start()
+    return _refresher
 
 def custom_wrap(s, width=15):
     """Insert line break for long text"""
     return "<br>".join(textwrap.wrap(s,width=width))
 
+Point = namedtuple('Point', ['title', 'url', 'category'])
+
+class PointIndex():
+    def __init__(self, df_trees):
+        """
+        Query title, url and category of every treemap tile, aligned to the plotly
+        point numbers (the rows of df_trees). Category tiles query the category and
+        have no url, the root tile has neither.
+        """
+        leaf = ~df_trees['parent'].isin(['total', '']).to_numpy()
+        root = (df_trees['parent'] == '').to_numpy()
+        self.title = np.where(leaf, df_trees['query'].fillna(''), np.where(root, '', df_trees['id'])).astype(object)
+        self.url = np.where(leaf, df_trees['url'].fillna(''), '').astype(object)
+        self.category = np.where(leaf, df_trees['parent'], np.where(root, '', df_trees['id'])).astype(object)
+    def __len__(self):
+        return len(self.title)
+    def resolve(self, point_number):
+        """Point of a clicked tile, None if the point number is unknown"""
+        if point_number is None or not 0 <= point_number < len(self):
+            return None
+        return Point(self.title[point_number], self.url[point_number], self.category[point_number])
+
 class Newsmap():
     def __init__(self, input_data, date_col = 'publishedAt', filter_col = 'category', value_col = 'treeRank', num_articles=10):
         """
@@ -78,18 +197,12 @@ class Newsmap():
         return df.loc[df[column].isin(filter_list),:]
     def __rank_data_generator(self, num_sequence):
         """Generate a slowly decreasing sequence for the box size in treemap"""
-        seq=[]
+        return self.__rank_sizes(np.arange(num_sequence)).tolist()
+    def __rank_sizes(self, ranks):
+        """Box size of the articles given their rank in their category"""
         n = 120
-        for i in range(num_sequence):
-            if i<2:
-                seq.append(n/2)
-            elif i<5:
-                seq.append(n/3)
-            elif i<9:
-                seq.append(n/4)
-            else:
-                seq.append(n/5)
-        return seq
+        sizes = np.array([n/2]*2 + [n/3]*3 + [n/4]*4)
+        return np.where(ranks < len(sizes), sizes[np.minimum(ranks, len(sizes)-1)], n/5)
     def __trim_data(self, newsapi=None):
         """To convert json datetime format into shorter version of number for easily comparing
         Then cut of the top most recent articles"""
@@ -98,60 +211,60 @@ class Newsmap():
             self.df[self.value_col] = self.df[self.date_col].str.replace('[^0-9]+', '').str.slice(start=2, stop=12, step=None).astype(int)
         # assign value as date if using normal tree rank by published date
         if self.value_col=="treeRank":
-            self.df[self.value_col] = self.df[self.date_col]   
-        categories=self.df[self.filter_col].unique()
-        trim_df = pd.DataFrame(columns=self.df.columns)
-        for i in categories:
-            temp_df = self.df[self.df[self.filter_col]==i].sort_values(self.value_col, ascending=False).head(self.num_articles)  
-            if self.value_col=="treeRank":
-                temp_df[self.value_col] = self.__rank_data_generator(num_sequence=len(temp_df))    #assign the list as value
-                trim_df = trim_df.append(temp_df)
-            elif self.value_col=="relevance":
-                trim_df = trim_df.append(temp_df)
-            else:
-                raise Exception('Value to rank tree data not found')             
-        return trim_df
+            self.df[self.value_col] = self.df[self.date_col]
+        elif self.value_col!="relevance":
+            raise Exception('Value to rank tree data not found')
+        # top articles of every category, grouped by category in order of appearance
+        categories = pd.Categorical(self.df[self.filter_col], categories=self.df[self.filter_col].dropna().unique())
+        trim_df = self.df.assign(_category=categories.codes).loc[categories.codes >= 0]
+        trim_df = trim_df.sort_values(self.value_col, ascending=False, kind='mergesort')
+        trim_df = trim_df.sort_values('_category', kind='mergesort')
+        trim_df = trim_df.groupby('_category', sort=False).head(self.num_articles)
+        if self.value_col=="treeRank":
+            ranks = trim_df.groupby('_category', sort=False).cumcount().to_numpy()
+            trim_df[self.value_col] = self.__rank_sizes(ranks)    #assign the rank sizes as value
+        return trim_df.drop(columns='_category')
 
     def __build_hierarchy_tree_data(self, data, levels = ['title','category'], add_cols = ['hover_text','url']):
         """Build dataframe to fit input for treemap"""
-        if len(add_cols) >= 1:
-            df_all_trees = pd.DataFrame(columns=['id', 'parent', 'value'] + add_cols)
-            for i, level in enumerate(levels):
-                df_tree = pd.DataFrame(columns=['id', 'parent', 'value'] + add_cols)
-                # assign id values
-                if i == 0: # Effort to generate full text in hover  
-                    dfg = data.groupby(levels[i:]+add_cols).sum().reset_index()
-                    df_tree['id'] = dfg[level].copy()
-                    df_tree[add_cols] = dfg[add_cols].copy()
-                else:
-                    dfg = data.groupby(levels[i:]).sum().reset_index()
-                    df_tree['id'] = dfg[level].copy()
-                    for column in add_cols:
-                        df_tree[column] = df_tree['id']
-                # assign parent values
-                if i < len(levels) - 1:
-                    df_tree['parent'] = dfg[levels[i+1]].copy()
-                else:
-                    df_tree['parent'] = 'total'
-                # assign value values
-                df_tree['value'] = dfg[self.value_col]
-                # all trees df
-                df_all_trees = df_all_trees.append(df_tree, ignore_index=True)
-            total = pd.Series(dict(id='total', parent='',
-                                    value=data[self.value_col].sum()))
-            df_all_trees = df_all_trees.append(total, ignore_index=True)     
-        return df_all_trees
+        df_trees = []
+        for i, level in enumerate(levels):
+            # assign id values
+            if i == 0: # Effort to generate full text in hover
+                dfg = data.groupby(levels[i:]+add_cols)[self.value_col].sum().reset_index()
+                df_tree = pd.DataFrame({'id': dfg[level]})
+                for column in add_cols:
+                    df_tree[column] = dfg[column]
+            else:
+                dfg = data.groupby(levels[i:])[self.value_col].sum().reset_index()
+                df_tree = pd.DataFrame({'id': dfg[level]})
+                for column in add_cols:
+                    df_tree[column] = dfg[level]
+            # assign parent values
+            df_tree['parent'] = dfg[levels[i+1]] if i < len(levels) - 1 else 'total'
+            # assign value values
+            df_tree['value'] = dfg[self.value_col]
+            df_trees.append(df_tree)
+        total = pd.DataFrame(dict(id=['total'], parent=[''], value=[data[self.value_col].sum()]))
+        df_trees.append(total)
+        # all trees df
+        return pd.concat(df_trees, ignore_index=True)[['id', 'parent', 'value'] + add_cols]
 
+    @metrics.timed('newsmap_pre_processing')
     def pre_processing(self, filter_list):
         """Pre-processing input data to generate dataframe for Plotly Treemap
         """
         df_trees = self.__trim_data()
+        # title without publisher and category, used as query when the tile is clicked
+        df_trees['query'] = df_trees['title'].str.partition(' | ')[0].str.partition(' - ')[0]
         # wrap break line for title
         df_trees['title'] = df_trees['title'].map(self.__custom_wrap)
         df_trees['hover_text'] = df_trees['title']
         # cut string if longer than 50 chars 
         #df_new['title'] = df_new['title'].map(self.__cut_string)
-        self.df_trees = self.__build_hierarchy_tree_data(data=self.__filter_out_data(df_trees, self.filter_col, filter_list))   
+        self.df_trees = self.__build_hierarchy_tree_data(data=self.__filter_out_data(df_trees, self.filter_col, filter_list),
+                                                         add_cols=['hover_text', 'url', 'query'])
+        self.point_index = PointIndex(self.df_trees)
     def tree_map(self):
         df_treemap = self.df_trees
         """Create a plotly Treemap object"""
@@ -196,4 +309,49 @@ class Newsmap():
         config= {
         "displaylogo": False,
         }
-        return fig, config
\ No newline at end of file
+        return fig, config
+NewsmapFigure = namedtuple('NewsmapFigure', ['figure', 'config', 'df_trees', 'point_index'])
+
+class PrebuiltFigure():
+    """A plotly figure serialized once, for consumers that only call
+    to_json/to_dict on it such as plotly_events"""
+    def __init__(self, fig):
+        self.json = fig.to_json()
+    def to_json(self):
+        return self.json
+    def to_dict(self):
+        return json.loads(self.json)
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sys.getsizeof(self.json)
+
+# Treemaps already built, so reruns that don't change the headlines or the
+# selected categories (e.g. a click on a tile) skip pre-processing and serialization
+figure_cache = ApiCache(max_bytes=int(os.getenv('NEWSMAP_CACHE_MAX_BYTES', 64 * 2 ** 20)))
+FIGURE_TTL = 3600
+metrics.register_gauge('figure_cache_requests', lambda: {
+    (('result', result),): count for result, count in figure_cache.stats()['endpoints'].get('newsmap', {}).items()})
+
+def frame_fingerprint(df):
+    """Content hash of a dataframe"""
+    return hashlib.sha1(pd.util.hash_pandas_object(df, index=False).values).hexdigest()
+
+@metrics.timed('newsmap_figure')
+def newsmap_figure(data, filter_list, fingerprint=None, **kwargs):
+    """Treemap figure, config, df_trees and point index of `data`, memoized on (fingerprint, filter_list)
+    and the Newsmap arguments.
+    fingerprint: identifies the content of data (e.g. the headline snapshot version),
+    hashed from data when not given
+    kwargs: Newsmap arguments (date_col, filter_col, value_col, num_articles)"""
+    if fingerprint is None:
+        fingerprint = frame_fingerprint(data)
+    key = (fingerprint, tuple(filter_list), tuple(sorted(kwargs.items())))
+    hit, value = figure_cache.get('newsmap', key)
+    if hit:
+        return value
+    # Newsmap writes its value column into the input, don't touch the shared data
+    newsmap = Newsmap(data.copy(), **kwargs)
+    newsmap.pre_processing(filter_list=filter_list)
+    fig, config = newsmap.tree_map()
+    value = NewsmapFigure(PrebuiltFigure(fig), config, newsmap.df_trees, newsmap.point_index)
+    figure_cache.put('newsmap', key, value, ttl=FIGURE_TTL)
+    return value
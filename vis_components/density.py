@@ -0,0 +1,88 @@
+import numpy as np
+import plotly.graph_objects as go
+
+
+class DensityGrid:
+    """Per-topic 2D histogram of the UMAP embeddings of a whole corpus.
+
+    The counts are binned once with a single bincount over (topic, cell),
+    so the plotted payload is bounded by the number of non empty cells
+    whatever the number of documents.
+    """
+
+    def __init__(self, counts, topics, x_edges, y_edges, scale=1.0):
+        self.counts = counts  # (topics, x bins, y bins)
+        self.topics = list(topics)
+        self.x_edges = x_edges
+        self.y_edges = y_edges
+        self.scale = scale  # documents per binned point, above 1 for a sample
+
+    @classmethod
+    def from_points(cls, x, y, codes, topics, bins=128, scale=1.0):
+        """Bin float32 coordinates and int topic codes (-1 for no topic).
+        scale: documents represented by every point, e.g. the inverse sampling rate"""
+        x = np.asarray(x, dtype=np.float32)
+        y = np.asarray(y, dtype=np.float32)
+        codes = np.asarray(codes)
+        keep = np.isfinite(x) & np.isfinite(y) & (codes >= 0)
+        x, y, codes = x[keep], y[keep], codes[keep].astype(np.int64)
+        if len(x) == 0:
+            edges = np.linspace(0, 1, bins + 1)
+            return cls(np.zeros((len(topics), bins, bins), np.int32), topics, edges, edges, scale)
+        x_edges = np.linspace(x.min(), x.max(), bins + 1)
+        y_edges = np.linspace(y.min(), y.max(), bins + 1)
+        # searchsorted on the edges, the max lands in the last bin
+        xi = np.clip(np.searchsorted(x_edges, x, side="right") - 1, 0, bins - 1)
+        yi = np.clip(np.searchsorted(y_edges, y, side="right") - 1, 0, bins - 1)
+        flat = (codes * bins + xi) * bins + yi
+        counts = np.bincount(flat, minlength=len(topics) * bins * bins)
+        return cls(
+            counts.astype(np.int32).reshape(len(topics), bins, bins), topics, x_edges, y_edges, scale
+        )
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + self.counts.nbytes
+
+    @property
+    def num_docs(self):
+        return int(round(self.counts.sum() * self.scale))
+
+    def cells(self):
+        """Center, (estimated) document count and dominant topic of the non empty cells"""
+        total = self.counts.sum(axis=0)
+        xi, yi = np.nonzero(total)
+        x_centers = (self.x_edges[:-1] + self.x_edges[1:]) / 2
+        y_centers = (self.y_edges[:-1] + self.y_edges[1:]) / 2
+        dominant = self.counts[:, xi, yi].argmax(axis=0)
+        count = total[xi, yi]
+        if self.scale != 1:
+            count = np.rint(count * self.scale).astype(np.int64)
+        return x_centers[xi], y_centers[yi], count, dominant
+
+
+def density_trace(grid, colors, max_size=14):
+    """Scattergl layer of the grid cells, colored by their dominant topic.
+
+    colors: dict of topic to color, topics without a color are drawn grey
+    """
+    x, y, count, dominant = grid.cells()
+    topics = np.array(grid.topics, dtype=object)[dominant]
+    # cell area grows with the log of its document count
+    size = 3 + (max_size - 3) * np.log1p(count) / np.log1p(count.max() if len(count) else 1)
+    return go.Scattergl(
+        mode="markers",
+        x=x,
+        y=y,
+        customdata=np.stack([count, topics], axis=-1),
+        marker=dict(
+            size=size,
+            color=[colors.get(t, "#7f7f7f") for t in topics],
+            opacity=0.35,
+            symbol="square",
+            line=dict(width=0),
+        ),
+        name=f"All documents ({grid.num_docs})",
+        hovertemplate="<b>%{customdata[0]} documents</b><br>"
+        + "<b>Mostly</b>: %{customdata[1]}"
+        + "<extra></extra>",
+    )
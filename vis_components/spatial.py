@@ -0,0 +1,188 @@
+import json
+
+import numpy as np
+import plotly.graph_objects as go
+from plotly.io.json import to_json_plotly
+
+# meta of the traces whose points are documents, see selection_query
+DOCUMENTS = "documents"
+
+
+class GridIndex:
+    """Uniform grid over the 2D UMAP embeddings of the loaded documents.
+
+    The points are sorted once by cell (row major), so the points of a row
+    of cells are one contiguous slice: a box query reads one slice per row
+    of cells it overlaps and only filters those candidates exactly. Radius
+    and k-nearest queries are box queries followed by a distance sort.
+
+    Queries return positions in the indexed arrays (e.g. iloc positions of
+    the documents), points with NaN coordinates are never returned.
+    """
+
+    def __init__(self, x, y, points_per_cell=8):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        keep = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+        x, y = x[keep], y[keep]
+        if len(keep):
+            self.x0, self.y0 = x.min(), y.min()
+            width, height = max(x.max() - self.x0, 1e-9), max(y.max() - self.y0, 1e-9)
+        else:
+            self.x0 = self.y0 = 0.0
+            width = height = 1.0
+        # about points_per_cell points per cell on square cells
+        self.cell = max(np.sqrt(width * height * points_per_cell / max(len(keep), 1)), 1e-9)
+        self.nx = int(np.ceil(width / self.cell)) + 1
+        self.ny = int(np.ceil(height / self.cell)) + 1
+        cells = self.__row(y) * self.nx + self.__col(x)
+        order = np.argsort(cells, kind="stable")
+        self.x, self.y, self.ids = x[order], y[order], keep[order]
+        # start of every cell in the sorted points, plus the end
+        self.starts = np.searchsorted(cells[order], np.arange(self.nx * self.ny + 1))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __sizeof__(self):
+        arrays = (self.x, self.y, self.ids, self.starts)
+        return object.__sizeof__(self) + sum(a.nbytes for a in arrays)
+
+    def __col(self, x):
+        return np.clip(((np.asarray(x) - self.x0) // self.cell).astype(np.int64), 0, self.nx - 1)
+
+    def __row(self, y):
+        return np.clip(((np.asarray(y) - self.y0) // self.cell).astype(np.int64), 0, self.ny - 1)
+
+    def __candidates(self, x_min, x_max, y_min, y_max):
+        """Sorted positions of the points in the cells overlapping the box"""
+        c0, c1 = int(self.__col(x_min)), int(self.__col(x_max))
+        rows = np.arange(int(self.__row(y_min)), int(self.__row(y_max)) + 1)
+        starts = self.starts[rows * self.nx + c0]
+        stops = self.starts[rows * self.nx + c1 + 1]
+        if len(rows) == 1:
+            return np.arange(starts[0], stops[0])
+        return np.concatenate([np.arange(a, b) for a, b in zip(starts, stops)])
+
+    def box(self, x_min, x_max, y_min, y_max):
+        """Points with x_min <= x <= x_max and y_min <= y <= y_max"""
+        if len(self) == 0 or x_min > x_max or y_min > y_max:
+            return np.empty(0, dtype=np.int64)
+        pos = self.__candidates(x_min, x_max, y_min, y_max)
+        px, py = self.x[pos], self.y[pos]
+        inside = (px >= x_min) & (px <= x_max) & (py >= y_min) & (py <= y_max)
+        return self.ids[pos[inside]]
+
+    def __nearest(self, x, y, r):
+        """Positions and squared distances of the points within r, nearest first"""
+        pos = self.__candidates(x - r, x + r, y - r, y + r)
+        d2 = (self.x[pos] - x) ** 2 + (self.y[pos] - y) ** 2
+        within = d2 <= r * r
+        pos, d2 = pos[within], d2[within]
+        order = np.argsort(d2, kind="stable")
+        return pos[order], d2[order]
+
+    def radius(self, x, y, r):
+        """Points within distance r of (x, y), nearest first"""
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64)
+        pos, _ = self.__nearest(x, y, r)
+        return self.ids[pos]
+
+    def knn(self, x, y, k):
+        """The k points nearest to (x, y), nearest first"""
+        k = min(k, len(self))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        # grow the searched square until it holds k points within its inscribed circle
+        r = self.cell * max(np.sqrt(k / 8), 1)
+        while True:
+            pos, _ = self.__nearest(x, y, r)
+            if len(pos) >= k:
+                return self.ids[pos[:k]]
+            # scale the area by the missing points, at least doubling the radius
+            r *= max(np.sqrt(k / max(len(pos), 1)), 2)
+
+
+def highlight_trace(x, y, customdata=None, name="Neighbours"):
+    """Scattergl of highlighted points, drawn as rings above the topic traces.
+    customdata: optional (points, 2) array of title and content shown on hover"""
+    hovertemplate = "<extra></extra>"
+    if customdata is not None:
+        hovertemplate = (
+            "<b>%{customdata[0]}</b><br><br>" + "<b>Content</b>: %{customdata[1]}" + hovertemplate
+        )
+    return go.Scattergl(
+        mode="markers",
+        x=x,
+        y=y,
+        customdata=customdata,
+        marker=dict(size=11, color="rgba(0,0,0,0)", line=dict(color="black", width=2)),
+        name=name,
+        hovertemplate=hovertemplate,
+        meta=DOCUMENTS,
+    )
+
+
+class OverlayFigure:
+    """Plotly figure serialized once, with small overlay traces added to its
+    JSON instead of rebuilding the figure.
+
+    Has the `to_json` of a plotly Figure, which is all plotly_events uses.
+    document_curves: numbers of the traces whose points are documents.
+    """
+
+    def __init__(self, fig=None, data=None, layout=None, document_curves=()):
+        if fig is not None:
+            plotly_json = fig.to_plotly_json()
+            traces = plotly_json["data"]
+            data = [to_json_plotly(trace) for trace in traces]
+            layout = to_json_plotly(plotly_json["layout"])
+            document_curves = [i for i, t in enumerate(traces) if t.get("meta") == DOCUMENTS]
+        self.data = data
+        self.layout = layout
+        self.document_curves = list(document_curves)
+
+    def overlay(self, *traces):
+        """Copy of the figure with the traces drawn above the others"""
+        data = self.data + [to_json_plotly(trace.to_plotly_json()) for trace in traces]
+        curves = self.document_curves + [
+            len(self.data) + i for i, trace in enumerate(traces) if trace.meta == DOCUMENTS
+        ]
+        return OverlayFigure(data=data, layout=self.layout, document_curves=curves)
+
+    def to_json(self):
+        return f'{{"data": [{", ".join(self.data)}], "layout": {self.layout}}}'
+
+
+def selection_query(event, document_curves=None):
+    """Spatial query of a plotly_events event: the neighbours of a clicked
+    document or the box of a selection, None without event.
+
+    event: list of the clicked or selected points, or a plotly selection with
+    "points" and its "range", or their JSON (plotly_events keeps its value in
+    the session state as JSON)
+    document_curves: numbers of the traces whose points are documents, the
+    other points (the query marker, the density) are ignored
+    """
+    if isinstance(event, str):
+        event = json.loads(event)
+    if isinstance(event, dict):
+        selected_range = event.get("range")
+        if selected_range and "x" in selected_range and "y" in selected_range:
+            (x_min, x_max), (y_min, y_max) = sorted(selected_range["x"]), sorted(selected_range["y"])
+            return ("box", float(x_min), float(x_max), float(y_min), float(y_max))
+        event = event.get("points")
+    points = event or []
+    if document_curves is not None:
+        points = [p for p in points if p.get("curveNumber") in document_curves]
+    coords = [(p.get("x"), p.get("y")) for p in points]
+    coords = [c for c in coords if None not in c]
+    if not coords:
+        return None
+    if len(coords) == 1:
+        return ("knn",) + tuple(float(v) for v in coords[0])
+    # without the range, the box of the selected documents: the other loaded
+    # documents in it are inside the selection too
+    x, y = np.array(coords, dtype=np.float64).T
+    return ("box", float(x.min()), float(x.max()), float(y.min()), float(y.max()))
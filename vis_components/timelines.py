@@ -1,28 +1,94 @@
 import os
 import sys
-from datetime import date, timedelta, datetime
+from datetime import date, timedelta
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 import plotly.graph_objects as go
 
+from utils_metrics import metrics
 
+
+TIMELINE_COLUMNS = ['title', 'url', 'category', 'relevance', 'text', 'date', 'id']
+
+
+@metrics.timed('pre_processing_timeline')
 def pre_processing_timeline(results):  
-    data=[dict(
-        title=result["answer"].split("#SEPTAG#")[0].split(" - ")[0],
-        url=result['url'],
-        category=result['category'],
-        relevance=result['relevance'],
-        text=result["answer"].split("#SEPTAG#")[1], 
-        date=datetime.strptime(result['publishedat'][:10], '%Y-%m-%d').date(),
-        id=result['document_id']) 
-                for result in results]
-    df=pd.DataFrame(data)
+    if len(results) == 0:
+        return pd.DataFrame(columns=TIMELINE_COLUMNS)
+    results = pd.DataFrame(list(results))
+    answer = results['answer'].str.partition('#SEPTAG#')
+    df = pd.DataFrame(dict(
+        title=answer[0].str.partition(' - ')[0],
+        url=results['url'],
+        category=results['category'],
+        relevance=results['relevance'],
+        text=answer[2].str.partition('#SEPTAG#')[0],
+        # parse the yyyy-mm-dd prefix of all the dates at once
+        date=pd.to_datetime(results['publishedat'].str.slice(0, 10), format='%Y-%m-%d').dt.date,
+        id=results['document_id']))
     # Only return articles with relevance score >=0
     return df[df.relevance>=0]
 
-def timeline_plot(df):
-    plot_df = df.groupby('date').count()['id'].reset_index()
+class DailyCounts():
+    def __init__(self, dates=None):
+        """
+        Number of articles per day, kept in an array indexed by days since the first day.
+        Dates can be added as the results stream in and the counts rolled up by
+        week or month without grouping the articles again.
+        """
+        self.start = None
+        self.counts = np.zeros(0, dtype=np.int64)
+        if dates is not None:
+            self.add(dates)
+    def add(self, dates):
+        """Count dates (dates, strings or datetime64), growing the day range if needed"""
+        days = np.asarray(pd.to_datetime(pd.Series(dates, dtype=object)).dropna().values, dtype='datetime64[D]')
+        if len(days) == 0:
+            return self
+        first, last = days.min(), days.max()
+        if self.start is None:
+            self.start = first
+        if first < self.start:
+            shift = int((self.start - first) / np.timedelta64(1, 'D'))
+            self.counts = np.concatenate([np.zeros(shift, dtype=np.int64), self.counts])
+            self.start = first
+        size = int((last - self.start) / np.timedelta64(1, 'D')) + 1
+        if size > len(self.counts):
+            self.counts = np.concatenate([self.counts, np.zeros(size - len(self.counts), dtype=np.int64)])
+        index = ((days - self.start) / np.timedelta64(1, 'D')).astype(np.int64)
+        self.counts += np.bincount(index, minlength=len(self.counts))
+        return self
+    @property
+    def days(self):
+        return self.start + np.arange(len(self.counts))
+    def rollup(self, freq='D'):
+        """(first day, count) of every day 'D', week 'W' (starting on monday) or month 'M',
+        summed with reduceat over the bucket boundaries"""
+        days = self.days
+        if len(days) == 0:
+            return days, self.counts
+        if freq == 'D':
+            return days, self.counts
+        if freq == 'W':
+            # 1970-01-01 was a thursday
+            buckets = (days.astype(np.int64) + 3) // 7
+            starts = (buckets * 7 - 3).astype('datetime64[D]')
+        elif freq == 'M':
+            starts = days.astype('datetime64[M]').astype('datetime64[D]')
+            buckets = starts.astype(np.int64)
+        else:
+            raise ValueError(f'Unsupported frequency {freq}')
+        bounds = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        return starts[bounds], np.add.reduceat(self.counts, bounds)
+
+@metrics.timed('timeline_plot')
+def timeline_plot(df, freq='D'):
+    dates, counts = DailyCounts(df['date']).rollup(freq)
+    # only the periods with articles
+    plot_df = pd.DataFrame({'date': dates, 'id': counts})
+    plot_df = plot_df[plot_df['id'] > 0]
     fig = go.Figure(
                 layout=dict(
                     autosize=True,
@@ -56,20 +122,44 @@ def timeline_plot(df):
     )
     return fig
 
-def date_filter(data, from_date, to_date):
-    if type(from_date) is str:
-        from_date = datetime.strptime(from_date, '%Y-%m-%d').date()
-    if type(to_date) is str:
-        to_date = datetime.strptime(to_date, '%Y-%m-%d').date()
-    return data[(data['date'] >= from_date) & (data['date'] < to_date)]
-
-def group_by_date(date_list, step=15):
-    groups=[]
-    marks=date_list[::step].values
-    for i in range(len(marks)):
-        if i == (len(marks)-1):
-            groups.append((marks[i].strftime(format='%Y-%m-%d'), date_list.max().strftime(format='%Y-%m-%d')))
+class DateIndex():
+    def __init__(self, data, date_col='date'):
+        """
+        Timeline data sorted once by date. Ranges of dates are found with searchsorted
+        and returned as slices of the sorted data, without scanning or copying it.
+        """
+        dates = np.asarray(pd.to_datetime(pd.Series(data[date_col], dtype=object)).values, dtype='datetime64[D]')
+        order = np.argsort(dates, kind='stable')
+        self.data = data.iloc[order]
+        self.dates = dates[order]
+    def __len__(self):
+        return len(self.dates)
+    def __date(self, value):
+        return np.datetime64(str(value)[:10], 'D')
+    def slice(self, from_date, to_date):
+        """Rows with from_date <= date < to_date, dates as date objects or yyyy-mm-dd strings"""
+        start = np.searchsorted(self.dates, self.__date(from_date), side='left')
+        stop = np.searchsorted(self.dates, self.__date(to_date), side='left')
+        return self.data.iloc[start:stop]
+    def buckets(self, freq=None, size=15):
+        """Date ranges to browse the data: a 'from' date and a (from, to) range of
+        yyyy-mm-dd strings, to excluded.
+        freq: 'W' for weeks starting on monday, 'M' for months, None for buckets
+        of about `size` articles (bounds on distinct dates)"""
+        if len(self.dates) == 0:
+            return pd.DataFrame({'from': [], 'range': []})
+        if freq == 'W':
+            # 1970-01-01 was a thursday
+            starts = np.unique((self.dates.astype(np.int64) + 3) // 7 * 7 - 3).astype('datetime64[D]')
+            end = starts[-1] + 7
+        elif freq == 'M':
+            months = np.unique(self.dates.astype('datetime64[M]'))
+            starts, end = months.astype('datetime64[D]'), (months[-1] + 1).astype('datetime64[D]')
+        elif freq is None:
+            starts = np.unique(self.dates[::size])
+            end = self.dates[-1] + 1
         else:
-            groups.append((marks[i].strftime(format='%Y-%m-%d'),marks[i+1].strftime(format='%Y-%m-%d')))
-    return pd.DataFrame({'from':marks,'range':groups})
-
+            raise ValueError(f'Unsupported frequency {freq}')
+        bounds = np.r_[starts, end].astype(str)
+        return pd.DataFrame({'from': starts.astype(object),
+                             'range': list(zip(bounds[:-1], bounds[1:]))})
@@ -1,9 +1,13 @@
+import numpy as np
+import pandas as pd
 import plotly.graph_objects as go
 
+from vis_components.density import density_trace
+from vis_components.spatial import DOCUMENTS, highlight_trace
 from vis_components.utils import cat_to_color
 
 
-def umap_plot(documents, unique_topics, query_label, custom_data):
+def umap_plot(documents, unique_topics, query_label, custom_data, density=None, highlight=None):
     # Initialize the figure
     fig = go.Figure(
         layout=dict(
@@ -19,32 +23,32 @@ def umap_plot(documents, unique_topics, query_label, custom_data):
         )
     )
 
+    # Add the density of the whole corpus below the sampled points
+    if density is not None:
+        colors = dict(zip(unique_topics, cat_to_color(unique_topics)))
+        fig.add_trace(density_trace(density, colors))
+
     # Add traces for each topic
-    for c, topic in zip(cat_to_color(unique_topics), unique_topics):
-        # Get data for the selected topic
-        ix_mask = documents["topic"] == topic
-        data = documents.loc[ix_mask]
-        customd = custom_data.loc[ix_mask]
+    points = documents.iloc[: len(custom_data)]  # without the query row
+    x = points["umap_embeddings_x"].to_numpy(dtype=np.float32)
+    y = points["umap_embeddings_y"].to_numpy(dtype=np.float32)
+    customdata = custom_data.to_numpy()
+    traces = topic_traces(
+        x=x,
+        y=y,
+        codes=pd.Categorical(points["topic"], categories=unique_topics).codes,
+        topics=unique_topics,
+        colors=cat_to_color(unique_topics),
+        customdata=customdata,
+    )
+    # clicks and selections are only read on the documents
+    for trace in traces:
+        trace.meta = DOCUMENTS
+    fig.add_traces(traces)
 
-        # Add topics traces
-        fig.add_trace(
-            go.Scattergl(
-                mode="markers",
-                x=data["umap_embeddings_x"],
-                y=data["umap_embeddings_y"],
-                text=data["topic"],
-                customdata=customd,
-                opacity=0.7,  # trace opacity
-                marker=dict(
-                    size=4, color=c, opacity=0.7, symbol="circle"  # marker opacity
-                ),
-                name=topic,
-                hovertemplate="<b>%{customdata[0]}</b><br><br>"
-                + "<b>Topic</b>: %{text}<br>"
-                + "<b>Content</b>: %{customdata[1]}"
-                + "<extra></extra>",
-            )
-        )
+    # Ring the highlighted documents (positions in documents, e.g. the neighbours of a click)
+    if highlight is not None and len(highlight):
+        fig.add_trace(highlight_trace(x[highlight], y[highlight], customdata[highlight]))
 
     # Add query trace (last so the marker is in front)
     ix_mask = documents["topic"] == query_label
@@ -76,12 +80,91 @@ def umap_plot(documents, unique_topics, query_label, custom_data):
         "scrollZoom": True,
         "displaylogo": False,
         "modeBarButtonsToRemove": [
-            "select2d",
             "lasso2d",
             "autoScale2d",
             "toggleSpikelines",
             "hoverCompareCartesian",
         ],
     }
+    # plotly_events doesn't take a config, keep what the layout can carry
+    # (scroll zoom and the logo can only be set in the config)
+    fig.update_layout(dragmode="zoom", modebar_remove=config["modeBarButtonsToRemove"])
 
     return fig, config
+
+
+def topic_traces(x, y, codes, topics, colors, customdata=None, single_trace=False):
+    """Scattergl traces of the points of every topic, built from arrays.
+
+    x, y: float32 coordinates
+    codes: int index of the topic of every point in `topics` (-1 to skip the point)
+    colors: color of every topic
+    customdata: optional (points, 2) array of title and content shown on hover
+
+    The points are sorted once by topic code and every trace gets a
+    contiguous slice. With single_trace all points go in one trace colored
+    per point, and empty traces keep one legend entry per topic.
+    """
+    codes = np.asarray(codes)
+    order = np.argsort(codes, kind="stable")
+    order = order[np.searchsorted(codes[order], 0):]  # drop the points without a topic
+    x, y, codes = np.asarray(x)[order], np.asarray(y)[order], codes[order]
+    if customdata is not None:
+        customdata = np.asarray(customdata)[order]
+    hovertemplate = (
+        "<b>%{customdata[0]}</b><br><br>"
+        + "<b>Topic</b>: %{text}<br>"
+        + "<b>Content</b>: %{customdata[1]}"
+        + "<extra></extra>"
+    )
+    topics = np.asarray(topics, dtype=object)
+    marker = dict(size=4, opacity=0.7, symbol="circle")  # marker opacity
+
+    if single_trace:
+        # numeric colors on a stepped colorscale, one step per topic
+        n = max(len(topics), 1)
+        colorscale = [[step / n, c] for i, c in enumerate(colors) for step in (i, i + 1)]
+        traces = [
+            go.Scattergl(
+                mode="markers",
+                x=x,
+                y=y,
+                text=topics[codes],
+                customdata=customdata,
+                opacity=0.7,  # trace opacity
+                marker=dict(
+                    marker, color=codes, colorscale=colorscale, cmin=-0.5, cmax=n - 0.5
+                ),
+                name="Topics",
+                showlegend=False,
+                hovertemplate=hovertemplate,
+            )
+        ]
+        # legend proxies, one empty trace per topic
+        for c, topic in zip(colors, topics):
+            traces.append(
+                go.Scattergl(
+                    mode="markers", x=[None], y=[None], marker=dict(marker, color=c), name=topic
+                )
+            )
+        return traces
+
+    # boundaries of the slice of every topic code
+    bounds = np.searchsorted(codes, np.arange(len(topics) + 1))
+    traces = []
+    for i, (c, topic) in enumerate(zip(colors, topics)):
+        points = slice(bounds[i], bounds[i + 1])
+        traces.append(
+            go.Scattergl(
+                mode="markers",
+                x=x[points],
+                y=y[points],
+                text=topic,
+                customdata=None if customdata is None else customdata[points],
+                opacity=0.7,  # trace opacity
+                marker=dict(marker, color=c),
+                name=topic,
+                hovertemplate=hovertemplate,
+            )
+        )
+    return traces
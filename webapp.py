@@ -1,5 +1,7 @@
+import json
 import os
 import sys
+import time
 from datetime import date, timedelta
 
 import pandas as pd
@@ -9,28 +11,24 @@ import streamlit.components.v1 as components
 dirname = os.path.dirname(__file__)
 #sys.path.append(os.path.join(dirname, "../"))
 
-from ui_components.umap_search import umap_page
+from vis_components.spatial import selection_query
 from utils import (
-    doc_count,
+    CORPUS_STORE_DIR,
+    SAMPLING_HINT,
+    api_cache,
+    api_client,
     feedback_doc,
-    get_all_docs,
-    retrieve_doc,
+    metrics_server,
     topic_names,
-    umap_query,
 )
+from utils_metrics import RenderProfiler, metrics
+from utils_pipeline import page_pipeline
 # Treemap components
 from streamlit_plotly_events import plotly_events
 from utils_tree import (
-    fetch_data_ggnews,
+    headline_refresher,
     custom_wrap,
-    Newsmap
-)
-# Timeline components
-from vis_components.timelines import (
-    pre_processing_timeline,
-    timeline_plot,
-    date_filter,
-    group_by_date
+    figure_cache
 )
 
 
@@ -38,292 +36,328 @@ from vis_components.timelines import (
 # will execute even if we didn't finish selecting the value we want. A temporary solution
 # is to wrap the sliders inside a form component. The ideal solution would be to create
 # a custom slider component that only updates the value when we release the mouse.
-# TODO: When selecting a point in the UMAP, show the KNN points highlighted on the plot
-# and the listed below (the action of selecting the point will call the query endpoint)
 # TODO: Create a function to parse the query and allow search operators like "term" to
 # restrict the query to documents that contain "term"
 
 # Init variables
-default_question = "Bitcoin Crypto "
-unique_topics = topic_names()
-debug = False
-batch_size = 10000
-filters = []
-# treemap variables
-articles_categories = ['sports', 'health', 'technology', 'science', 'entertainment','business', 'general']
-news_api_key = '99ca995c8d9349848711d2942b0c0d72'
-
-# Set page configuration
-st.set_page_config(page_title="NewsIntel App", layout="wide")
-
-# UI sidebar
-with st.sidebar:
-    st.header("Options:")
-    with st.form(key="options_form"):
-        end_of_week = date.today() + timedelta(6 - date.today().weekday())
-        _, mid, _ = st.columns([1, 10, 1])
-        with mid:  # Use columns to avoid slider labels being off-window
-            filter_date = st.slider(
-                "Date range",
-                min_value=date(2020, 1, 1),
-                value=(date(2020, 1, 1), end_of_week),
-                step=timedelta(7),
-                format="DD-MM-YY",
-            )
-        with st.expander("Query Options"):
-            filter_category = st.multiselect(
-                "Category", options=unique_topics, default=None
-            )
-            filter_category_exclude = st.checkbox("Exclude", value=True)
-        with st.expander("Results Options"):
-            top_k_reader = st.slider(
-                "Number of returned documents",
-                min_value=1,
-                max_value=20,
-                value=10,
-                step=1,
-            )
-            top_k_retriever = st.slider(
-                "Number of candidate documents",
-                min_value=1,
-                max_value=200,
-                value=100,
-                step=1,
-            )
-        with st.expander("Visualization Options"):
-            umap_perc = st.slider(
-                "Percentage of documents displayed",
-                min_value=1,
-                max_value=100,
-                value=1,
-                step=1,
-                help="Display a randomly sampled percentage of the documents to improve performance",
-            )
-        with st.expander("Treemap Options"):
-            a_cnt = st.slider(
-                label="Number of articles",
-                min_value=10,
-                max_value=20,
-                step=2,
-                value=10
-            )
-            # Select categories to display in the treemap
-            news_cat_options = st.multiselect(
-                label="Categories",
-                options=articles_categories,
-                #default=['general', 'health', 'sports', 'business']
-                default=articles_categories
-            )       
-        st.form_submit_button(label="Submit")
-
-# Prepare filters
-if filter_category:
-    filter_topics = list(map(lambda x: x.lower(), filter_category))
+render_start = time.perf_counter()
+debug = os.getenv("UI_DEBUG", "false").lower() == "true"
+# Profile this run if it was requested from the debug panel of the previous one
+profiler = RenderProfiler().start() if debug and st.session_state.pop("profile_next_run", False) else None
+# Stopped however the run ends, also when it raises or reruns
+try:
+    metrics_server()
+    default_question = "Bitcoin Crypto "
+    unique_topics = list(topic_names())  # cached, no request on reruns
+    # Stages of the page memoized on their inputs in the session: a rerun only
+    # recomputes what depends on the widgets that changed
+    pipeline = page_pipeline(
+        st.session_state.setdefault("pipeline_memo", {}),
+        batch_size=10000,
+        # stratified keeps small topics visible in the UMAP sample, but drawn
+        # client side it streams the whole corpus: the first documents are
+        # kept instead unless the store or the API draws the sample
+        sampling="stratified" if CORPUS_STORE_DIR is not None or SAMPLING_HINT else "head",
+        sample_seed=42,
+    )
+    # treemap variables
+    articles_categories = ['sports', 'health', 'technology', 'science', 'entertainment','business', 'general']
+    news_api_key = '99ca995c8d9349848711d2942b0c0d72'
 
-    # If filters should be excluded
-    if filter_category_exclude:
-        filter_topics = list(set(unique_topics).difference(set(filter_topics)))
+    # Set page configuration
+    st.set_page_config(page_title="NewsIntel App", layout="wide")
 
-    # Sort filters
-    filter_topics.sort(key=lambda x: int(x.split("_")[0]))
+    # UI sidebar
+    with st.sidebar:
+        st.header("Options:")
+        with st.form(key="options_form"):
+            end_of_week = date.today() + timedelta(6 - date.today().weekday())
+            _, mid, _ = st.columns([1, 10, 1])
+            with mid:  # Use columns to avoid slider labels being off-window
+                filter_date = st.slider(
+                    "Date range",
+                    min_value=date(2020, 1, 1),
+                    value=(date(2020, 1, 1), end_of_week),
+                    step=timedelta(7),
+                    format="DD-MM-YY",
+                )
+            with st.expander("Query Options"):
+                filter_category = st.multiselect(
+                    "Category", options=unique_topics, default=None
+                )
+                filter_category_exclude = st.checkbox("Exclude", value=True)
+            with st.expander("Results Options"):
+                top_k_reader = st.slider(
+                    "Number of returned documents",
+                    min_value=1,
+                    max_value=20,
+                    value=10,
+                    step=1,
+                )
+                top_k_retriever = st.slider(
+                    "Number of candidate documents",
+                    min_value=1,
+                    max_value=200,
+                    value=100,
+                    step=1,
+                )
+            with st.expander("Visualization Options"):
+                umap_perc = st.slider(
+                    "Percentage of documents displayed",
+                    min_value=1,
+                    max_value=100,
+                    value=1,
+                    step=1,
+                    help="Display a randomly sampled percentage of the documents to improve performance",
+                )
+                show_density = st.checkbox(
+                    "Show the density of all documents",
+                    # without a local corpus store the density needs the whole corpus streamed
+                    value=CORPUS_STORE_DIR is not None,
+                    help="Draw every document as a density layer below the sampled points "
+                    "(estimated from a sample when there is no local corpus store)",
+                )
+                num_neighbours = st.slider(
+                    "Neighbours of a clicked document",
+                    min_value=1,
+                    max_value=50,
+                    value=10,
+                    step=1,
+                    help="Documents highlighted and listed when clicking a point of the UMAP",
+                )
+            with st.expander("Treemap Options"):
+                a_cnt = st.slider(
+                    label="Number of articles",
+                    min_value=10,
+                    max_value=20,
+                    step=2,
+                    value=10
+                )
+                # Select categories to display in the treemap
+                news_cat_options = st.multiselect(
+                    label="Categories",
+                    options=articles_categories,
+                    #default=['general', 'health', 'sports', 'business']
+                    default=articles_categories
+                )       
+            st.form_submit_button(label="Submit")
 
-    filters.append({"terms": {"topic_label": filter_topics}})
-else:
-    filter_topics = unique_topics
+    # Prepare filters
+    pipeline.set("filter_date", filter_date)
+    pipeline.set("filter_category", filter_category)
+    pipeline.set("filter_category_exclude", filter_category_exclude)
+    pipeline.set("unique_topics", unique_topics)
+    pipeline.set("top_k_retriever", top_k_retriever)
+    pipeline.set("umap_perc", umap_perc)
+    pipeline.set("show_density", show_density)
+    # Last click or box selection on the UMAP, answered by the spatial index of the loaded documents
+    pipeline.set(
+        "umap_selection",
+        selection_query(st.session_state.get("umap_events"), st.session_state.get("umap_curves")),
+    )
+    pipeline.set("num_neighbours", num_neighbours)
+    pipeline.set("news_cat_options", news_cat_options)
 
-filters.append(
-    {
-        "range": {
-            "publishedat": {
-                "gte": filter_date[0].strftime("%Y-%m-%d"),
-                "lte": filter_date[1].strftime("%Y-%m-%d"),
-            }
-        }
-    }
-)
+    # Issue the independent API calls concurrently, the page then waits for the
+    # slowest call instead of the sum of all of them
+    pipeline.start("doc_count", "umap_docs", "density")
 
-# Sampling the docs and passing them to the UMAP plot
-doc_num = doc_count(filters)
-# sample_size = int(umap_perc / 100 * doc_num) #normal size
-sample_size = int(umap_perc / 500 * doc_num) # reduced size to increase performance
+    # Title
+    st.title("News Intel Application")
 
-# Title
-st.title("News Intel Application")
+    #df = fetch_data(news_api_key, value)
+    #df = pd.read_csv("data/top_headlines.csv")
+    # Headlines are refreshed in the background, reading them never blocks
+    headlines = headline_refresher().snapshot()
+    pipeline.set("headlines", headlines, key=headlines.version)
 
-# Create a text element and let the reader know the data is loading.
-data_load_state = st.text('Loading data...')
 
-#df = fetch_data(news_api_key, value)
-#df = pd.read_csv("data/top_headlines.csv")
-df = fetch_data_ggnews()
+    # LAYING OUT THE TOP SECTION OF THE APP
+    row1_1, row1_2 = st.columns((3, 3))
+    with row1_1:
+        st.write(
+            """
+            ##
+            Exploring the lastest news in the internet in different categories \n
+            Or using free query to explore our news database
+            """
+        )
+    with row1_2:
+        st.subheader("")
+        ## Newsmap
+        query_methods=['Lastest News', 'Free Query']
+        query_method=st.radio(
+            label='Select exploring method:',
+            options=query_methods,
+            )
 
-data_load_state.text('Data loaded!')
-cached_df = df.copy()
+    def clicked_point(newsmap, selected_points):
+        """Point of the clicked treemap tile, written below the treemap"""
+        if not selected_points:
+            return None
+        point = newsmap.point_index.resolve(selected_points[0].get("pointNumber"))
+        if point is None:
+            st.write(selected_points)
+        elif point.url:
+            st.write(f"{point.title} - [Read online]({point.url})")
+        else:
+            st.write(point.title)
+        return point
 
 
-# LAYING OUT THE TOP SECTION OF THE APP
-row1_1, row1_2 = st.columns((3, 3))
-with row1_1:
-    st.write(
-        """
-        ##
-        Exploring the lastest news in the internet in different categories \n
-        Or using free query to explore our news database
-        """
-    )
-with row1_2:
-    st.subheader("")
-    ## Newsmap
-    query_methods=['Lastest News', 'Free Query']
-    query_method=st.radio(
-        label='Select exploring method:',
-        options=query_methods,
-        )
+    # LAYING OUT THE MIDDLE SECTION OF THE APP WITH THE MAPS
+    row2_1, row2_2 = st.columns((3, 2))
 
-# LAYING OUT THE MIDDLE SECTION OF THE APP WITH THE MAPS
-row2_1, row2_2 = st.columns((3, 2))
+    with row2_1:
+        st.subheader("Newsmap")
+        # Search bar
+        if query_method == 'Lastest News':
+            if headlines.version > 0:
+                headlines_age = int((time.time() - headlines.fetched_at) / 60)
+                st.caption(f"Headlines updated {headlines_age} min ago")
+            elif headlines.fetched_at:
+                # the seed headlines until the first refresh completes, dated by the newest one
+                seed_date = time.strftime("%d %b %Y", time.gmtime(headlines.fetched_at))
+                st.caption(f"Loading the latest headlines, showing the ones of {seed_date}")
+            else:
+                st.caption("Loading the latest headlines...")
+            # rebuilt only when the headlines or the selected categories change
+            newsmap = pipeline.get("headlines_newsmap")
+            fig_tree, config_tree = newsmap.figure, newsmap.config
+            #st.plotly_chart(fig_tree, use_container_width=True, config=config_tree)
+            selected_points = plotly_events(
+                fig_tree, 
+                click_event=True, 
+                hover_event=False,
+                override_height=850,
+                override_width='100%')
+            point = clicked_point(newsmap, selected_points)
+            link = point.url if point else ""
+            # Question for API, repeated clicks on a tile hit the cached retrieve_doc
+            question = point.title if point else ""
+            pipeline.set("question", question)
+            pipeline.start("umap_query")
 
-with row2_1:
-    st.subheader("Newsmap")
-    # Search bar
-    if query_method == 'Lastest News':
-        newsmap = Newsmap(cached_df)
-        newsmap.pre_processing(filter_list=news_cat_options)
-        
-        fig_tree, config_tree = newsmap.tree_map()
-        #st.plotly_chart(fig_tree, use_container_width=True, config=config_tree)
-        selected_points = plotly_events(
-            fig_tree, 
-            click_event=True, 
-            hover_event=False,
-            override_height=850,
-            override_width='100%')
-        try:
-            # print plotly event
-            selected_query = newsmap.df_trees.iloc[selected_points[0]["pointNumber"],3].split("-")[0].replace("<br>"," ")         
-            link = newsmap.df_trees.iloc[selected_points[0]["pointNumber"],4]   
-            st.write(f"{selected_query} - [Read online]({link})")
-            #st.write(link)
-        except:
-            link=""
-            st.write(selected_points)   
-        # Question for API
-        try:          
-            question = selected_query
-        except:
-            question=""
-        # Request to API
-        results, raw_json = retrieve_doc(
-            query=question,
-            filters=filters,
-            #top_k_reader=top_k_reader,
-            top_k_reader=100, #for timeline developing purpose 
-            top_k_retriever=top_k_retriever,
-                )
-        # timeline dataframe
-        tl_df = pre_processing_timeline(results)
-        
 
-    if query_method == 'Free Query':
-        question = st.text_input(label="Please provide your query:", value=default_question)
-        # Request to API
-        results, raw_json = retrieve_doc(
-            query=question,
-            filters=filters,
-            #top_k_reader=top_k_reader,
-            top_k_reader=100, #for timeline developing purpose 
-            top_k_retriever=top_k_retriever,
-        )
-        # timeline dataframe
-        tl_df = pre_processing_timeline(results)
+        if query_method == 'Free Query':
+            question = st.text_input(label="Please provide your query:", value=default_question)
+            pipeline.set("question", question)
+            pipeline.start("umap_query")
+            # Generate treemap of the query results
+            newsmap = pipeline.get("query_newsmap")
+            fig_tree, config_tree = newsmap.figure, newsmap.config
 
-        # Generate treemap
-        newsmap = Newsmap(tl_df, date_col="date", value_col='relevance',num_articles=20)
-        newsmap.pre_processing(filter_list=tl_df.category.unique())
-        fig_tree, config_tree = newsmap.tree_map()
-        
-        selected_points = plotly_events(
-            fig_tree, 
-            click_event=True, 
-            hover_event=False,
-            override_height=850,
-            override_width='100%')
-        try:
-            # print plotly event
-            selected_query = newsmap.df_trees.iloc[selected_points[0]["pointNumber"],3].split("-")[0].replace("<br>"," ")         
-            link = newsmap.df_trees.iloc[selected_points[0]["pointNumber"],4]   
-            st.write(f"{selected_query} - [Read online]({link})")
-        except:
-            link=""
-            st.write(selected_points)
+            selected_points = plotly_events(
+                fig_tree, 
+                click_event=True, 
+                hover_event=False,
+                override_height=850,
+                override_width='100%')
+            point = clicked_point(newsmap, selected_points)
+            link = point.url if point else ""
 
-    with st.expander("Expand/collapse the embedded article!:", expanded=False):
-        if len(link) != 0:
-            with st.spinner("Loading"):
-                components.iframe(link, height=500, scrolling=True)
+        with st.expander("Expand/collapse the embedded article!:", expanded=False):
+            if len(link) != 0:
+                with st.spinner("Loading"):
+                    components.iframe(link, height=500, scrolling=True)
 
-with row2_2:
-    st.subheader("UMAP")
-    st.write(f"Input query:\n {question}")
-    with st.spinner(
-        "Getting documents from database... \n " "Documents will be plotted when ready."
-    ):
-        # Read data for umap plot (create generator)
-        umap_docs = get_all_docs(
-            filters=filters, batch_size=batch_size, sample_size=sample_size
-        )
-    # Get results for query
-    with st.spinner(
-        "Performing neural search on documents... 🧠 \n "
-        "Do you want to optimize speed or accuracy? \n"
-        "Check out the docs: https://haystack.deepset.ai/docs/latest/optimizationmd "
-    ):  
-        # Plot the completed UMAP plot
-        fig, config = umap_page(
-            documents=pd.DataFrame(umap_docs),
-            query=umap_query(question),
-            unique_topics=filter_topics,
-        )
-        st.plotly_chart(fig, use_container_width=True, config=config)
+    with row2_2:
+        st.subheader("UMAP")
+        st.write(f"Input query:\n {question}")
+        with st.spinner(
+            "Getting documents from database... \n " "Documents will be plotted when ready."
+        ):
+            # Read data for umap plot (requested with the document count)
+            with metrics.span("wait_umap_docs"):
+                pipeline.get("umap_docs")
+        # Get results for query
+        with st.spinner(
+            "Performing neural search on documents... 🧠 \n "
+            "Do you want to optimize speed or accuracy? \n"
+            "Check out the docs: https://haystack.deepset.ai/docs/latest/optimizationmd "
+        ):  
+            # Plot the completed UMAP plot
+            fig, config = pipeline.get("umap_overlay")
+            # Clicks and box selections are read back from the session state on
+            # the next run, with the traces of the documents they can be on
+            st.session_state["umap_curves"] = fig.document_curves
+            plotly_events(
+                fig,
+                click_event=True,
+                select_event=True,
+                override_height=800,
+                override_width="100%",
+                key="umap_events",
+            )
+        umap_highlight = pipeline.get("umap_highlight")
+        if umap_highlight is not None:
+            umap_selection = pipeline.get("umap_selection")
+            where = "near the clicked point" if umap_selection[0] == "knn" else "in the selected region"
+            with st.expander(f"{len(umap_highlight)} documents {where}", expanded=True):
+                highlighted = pipeline.get("umap_docs").iloc[umap_highlight[:50]]
+                for title, url in zip(highlighted["answer"].str.partition("#SEPTAG#")[0], highlighted["url"]):
+                    st.markdown(f"- [{title}]({url})")
 
 
-st.subheader("Timeline from the Artiles related to the query")
-row3_1, row3_2 = st.columns((5, 4))
+    st.subheader("Timeline from the Artiles related to the query")
+    row3_1, row3_2 = st.columns((5, 4))
 
-try:
-    with row3_1:
-        timeline_fig=timeline_plot(tl_df)          
-        st.plotly_chart(timeline_fig, use_container_width=True)
-        # get the group of range for date filtering
-        date_groups=group_by_date(tl_df.date.sort_values())  
-        if date_groups.shape[0]>1:
-            selected_date_range=st.select_slider(
-                label="Select a range of dates",
-                options=range(date_groups.shape[0]), 
-                format_func=lambda x: date_groups.iloc[x,0],
-                #value=date_groups[0],
-                )
-        else:
-            selected_date_range=0
-    with row3_2:
-        printed_articles = date_filter(
-                tl_df,
-                from_date=date_groups.iloc[selected_date_range,1][0],
-                to_date=date_groups.iloc[selected_date_range,1][1],
-            ).reset_index()
+    try:
+        with row3_1:
+            timeline_freq=st.selectbox(
+                label="Articles per",
+                options=["D", "W", "M"],
+                format_func={"D": "Day", "W": "Week", "M": "Month"}.get,
+            )
+            pipeline.set("timeline_freq", timeline_freq)
+            timeline_fig=pipeline.get("timeline_figure")
+            st.plotly_chart(timeline_fig, use_container_width=True)
+            # get the group of range for date filtering, the slider only slices
+            # the memoized date index
+            date_groups=pipeline.get("date_groups")
+            if date_groups.shape[0]>1:
+                selected_date_range=st.select_slider(
+                    label="Select a range of dates",
+                    options=range(date_groups.shape[0]), 
+                    format_func=lambda x: date_groups.iloc[x,0],
+                    #value=date_groups[0],
+                    )
+            else:
+                selected_date_range=0
+            pipeline.set("selected_date_range", selected_date_range)
+        with row3_2:
+            printed_articles = pipeline.get("printed_articles")
 
-        for index, row in printed_articles.sort_values('date',ascending=False).iterrows():
-            st.markdown(
-                 f"""
-                 <p style='font-size: 15px;'>{row['date']} - 
-                 <a href={row['url']}>{row['title']}</a>
-                 </p>
-                 """, 
-                 unsafe_allow_html=True)
-except:
-    st.write("No input query")
+            # most recent first
+            for index, row in printed_articles.iloc[::-1].iterrows():
+                st.markdown(
+                     f"""
+                     <p style='font-size: 15px;'>{row['date']} - 
+                     <a href={row['url']}>{row['title']}</a>
+                     </p>
+                     """, 
+                     unsafe_allow_html=True)
+    except:
+        st.write("No input query")
 
-st.write("Phuc Nguyen - @NOVAIMS")
-if debug:
-    st.subheader("REST API JSON response")
-    st.write(raw_json)
+    st.write("Phuc Nguyen - @NOVAIMS")
+    metrics.record("render", time.perf_counter() - render_start)
+    if debug:
+        st.subheader("REST API JSON response")
+        st.json(json.dumps(pipeline.get("retrieve")[1], default=dict))  # cached responses are read-only mappings
+        st.subheader("Timings")
+        st.write(metrics.summary())
+        st.write({"stages computed in this run": pipeline.computed})
+        st.write(api_cache.stats())
+        st.write(figure_cache.stats())
+        st.write(api_client.latency_stats())
+        with st.expander("Prometheus metrics"):
+            st.text(metrics.prometheus_text())
+        if st.button("Profile the next run"):
+            st.session_state["profile_next_run"] = True
+            st.experimental_rerun()
+finally:
+    profile_report = profiler.stop() if profiler is not None else None
+if profile_report is not None:
+    with st.expander(f"Profile of this run ({profiler.kind})", expanded=True):
+        st.text(profile_report)